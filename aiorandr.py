@@ -0,0 +1,150 @@
+"""Probe and apply with asyncio, with timeouts and cancellation
+
+    screens = await aiorandr.screens(randr.PROBE_TIERED, timeout=5)
+    ...
+    mismatched = await aiorandr.apply_and_save(screens, False, save=save)
+
+xrandr runs in asyncio subprocesses, killed when a step times out or its
+task is cancelled. A Prober cancels its running probe when a newer one is
+started, e.g. by a newer hotplug event. The synchronous randr.screens() and
+randr.xrandr_apply() do not use this module, asyncio takes longer to import
+than a whole run of auto.py.
+"""
+import asyncio
+import subprocess as sb
+import time
+
+import hotplug
+import randr
+import timing
+
+# Seconds xrandr --current may take when verifying an apply
+VERIFY_TIMEOUT = 5.0
+
+async def _communicate(p):
+    out = await p.stdout.read()
+    eof = time.perf_counter()
+    await p.wait()
+    return out, eof
+
+async def run_cmd(cmd, timeout=None, env=None):
+    """Output lines of cmd, killed after timeout seconds
+
+    Raises subprocess.CalledProcessError when cmd fails and
+    subprocess.TimeoutExpired when it times out.
+    """
+    start = time.perf_counter()
+    p = await asyncio.create_subprocess_exec(*cmd, stdout=sb.PIPE, stderr=sb.STDOUT, env=env)
+    try:
+        out, eof = await asyncio.wait_for(_communicate(p), timeout)
+    except asyncio.TimeoutError:
+        await _kill(p)
+        raise sb.TimeoutExpired(cmd, timeout)
+    except asyncio.CancelledError:
+        await _kill(p)
+        raise
+    randr._exited(cmd, start, eof, p.returncode)
+    if p.returncode:
+        raise sb.CalledProcessError(p.returncode, cmd, out)
+    return out.decode("utf-8").split('\n')
+
+async def _kill(p):
+    try:
+        p.kill()
+    except ProcessLookupError:
+        pass
+    await p.wait()
+
+async def screens(probe=randr.PROBE_TIERED, timeout=randr.PROBE_TIMEOUT, env=None):
+    """All outputs as Screens, as randr.XrandrBackend.screens() probes them"""
+    steps = randr.probe_steps(probe, env)
+    try:
+        cmd = next(steps)
+        while True:
+            cmd = steps.send(await run_cmd(cmd, timeout, env))
+    except StopIteration as e:
+        return e.value
+
+async def apply(screens, dryrun, force=False, timeout=randr.APPLY_TIMEOUT, env=None):
+    """Apply the settings of screens that changed, returns the xrandr
+    command or None when there was nothing to do"""
+    cmd = randr.xrandr_command(screens, force)
+    if cmd is None:
+        print("No changes, not running xrandr")
+        return None
+    print(" ".join(cmd))
+    if not dryrun:
+        await run_cmd(cmd, timeout, env)
+    return cmd
+
+async def verify(screens, timeout=VERIFY_TIMEOUT, env=None):
+    """Names of the screens whose mode or position differ from their
+    settings, as xrandr --current reports them"""
+    return randr.mismatched(randr.requested(screens), await run_cmd(['xrandr', '--current'], timeout, env))
+
+async def apply_and_save(screens, dryrun, force=False, save=None,
+                         timeout=randr.APPLY_TIMEOUT, verify_timeout=VERIFY_TIMEOUT, env=None):
+    """Apply, then verify while save() (e.g. the gnome save) runs in a thread
+
+    Returns the names of the screens that did not take their settings.
+    """
+    with timing.phase('apply'):
+        cmd = await apply(screens, dryrun, force, timeout, env)
+    if dryrun:
+        return []
+    steps = []
+    if cmd is not None:
+        steps.append(verify(screens, verify_timeout, env))
+    if save is not None:
+        # in a copy of the context, so save() records its timing phases
+        steps.append(asyncio.to_thread(save))
+    with timing.phase('verify'):
+        results = await asyncio.gather(*steps)
+    return results[0] if cmd is not None else []
+
+class Prober(object):
+    """Probes that supersede each other
+
+    Starting a probe cancels the one still running, whose caller gets
+    asyncio.CancelledError: its hotplug event is stale.
+    """
+    def __init__(self, probe=randr.PROBE_TIERED, timeout=randr.PROBE_TIMEOUT, env=None):
+        super(Prober, self).__init__()
+        self.probe = probe
+        self.timeout = timeout
+        self.env = env
+        self.task = None
+        self.cancelled = 0
+
+    async def screens(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            self.cancelled += 1
+        task = asyncio.ensure_future(screens(self.probe, self.timeout, self.env))
+        self.task = task
+        return await task
+
+async def watch(source, reconfigure, debounce, max_wait=hotplug.MAX_DEBOUNCE_SECONDS):
+    """Call the coroutine function reconfigure once, then once per settled
+    burst of events of source, without waiting for the previous call
+
+    A reconfigure still running when the next one starts is left to finish,
+    or to be cancelled by its Prober. Returns the number of calls when the
+    source is exhausted, a burst that does not settle is cut after
+    max_wait seconds as by hotplug.run().
+    """
+    loop = asyncio.get_running_loop()
+    tasks = [asyncio.ensure_future(reconfigure())]
+    runs = 1
+    while True:
+        event = await loop.run_in_executor(None, source.wait, None)
+        if event is None:
+            break
+        event = await loop.run_in_executor(None, hotplug.settle, source, debounce, max_wait)
+        tasks = [t for t in tasks if not t.done()]
+        tasks.append(asyncio.ensure_future(reconfigure()))
+        runs += 1
+        if event is None:
+            break
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return runs
@@ -1,8 +1,10 @@
 import randr
+import cache
+import modecolumns
+import timing
 import sys
 import os
 import math
-import string
 from functools import reduce
 
 # TODO select fallback if preferred dpi is 4k, but not all screens are 4k
@@ -17,11 +19,12 @@ EXTENAL_ON_LEFT = "external_on_left"
 MIRROR = "mirror"
 BUILTIN_ONLY = "builtin_only"
 EXTERNAL_ONLY = "external_only"
+OPTIMAL = "optimal"
 
 # Density
-DENSITY_ANY = "any"
-DENSITY_HD = "hd"
-DENSITY_4K = "4k"
+DENSITY_ANY = randr.DENSITY_ANY
+DENSITY_HD = randr.DENSITY_HD
+DENSITY_4K = randr.DENSITY_4K
 
 # Mode selectors
 MODE_SELECT_RATE = 'rate'
@@ -46,16 +49,58 @@ SETUPS = [
 	EXTENAL_ON_LEFT,
 	MIRROR,
 	BUILTIN_ONLY,
-	EXTERNAL_ONLY
+	EXTERNAL_ONLY,
+	OPTIMAL
 ]
 
-DENSITY_4K_THRESHOLD = 150.0
-ASPECT_CLOSE_EPS = 0.05
+DENSITY_4K_THRESHOLD = randr.DENSITY_4K_THRESHOLD
+ASPECT_CLOSE_EPS = randr.ASPECT_CLOSE_EPS
+
+# Bump when plan() would lay out the same screens differently
+PLAN_VERSION = 1
+
+# Command line defaults, a run without arguments uses them without argparse
+DEFAULT_ARGS = {
+    'setup': None,
+    'dry_run': False,
+    'density': DENSITY_ANY,
+    'print_modes': False,
+    'enable_gnome_save': False,
+    'gnome_save_file': os.path.expandvars("$HOME/.config/monitors.xml"),
+    'align': ALIGN_BOTTOM,
+    'min_rate': 0,
+    'force': False,
+    'no_plan_cache': False,
+    'show_plans': False,
+    'prune_plans': None,
+    'compact_gnome': False,
+    'gnome_keep': 2,
+    'probe': randr.PROBE_TIERED,
+    'daemon': False,
+    'server': False,
+    'debounce': 1.0,
+    'backend': randr.BACKEND_XRANDR,
+    'probe_timeout': randr.PROBE_TIMEOUT,
+    'apply_timeout': randr.APPLY_TIMEOUT,
+    'asyncio': False,
+    'transactional': False,
+    'displays': None,
+    'jobs': None,
+    'coalesce': None,
+    'min_interval': None,
+    'no_schedule': False,
+    'objective': None,
+    'timings': None,
+    'profile': None,
+}
+
+# Connector types of panels built into the machine
+BUILTIN_CONNECTORS = ('eDP', 'LVDS', 'DSI')
 
 def is_builtin(screen):
-    if screen.name in ['eDP-1', 'eDP-1-1']:
-        return True
-    return False
+    """Whether screen is a builtin panel, by connector type: eDP-1, eDP1,
+    eDP-1-1 (hybrid graphics), LVDS1, DSI-1, ..."""
+    return screen.name.startswith(BUILTIN_CONNECTORS)
 
 def filter_mode(mode, requirements = {}):
     #print(requirements)
@@ -84,12 +129,50 @@ def mode_sort_key(mode, order = []):
             keys.append(mode.width * mode.height)
     return tuple(keys)
 
+def select_mode_columns(columns, requirements = {}, sort = []):
+    """select_mode_2 over a modecolumns.ModeColumns table"""
+    min_dpi = None
+    max_dpi = None
+    density = requirements.get(MODE_SELECT_DENSITY)
+    if density == DENSITY_HD:
+        max_dpi = DENSITY_4K_THRESHOLD
+    elif density == DENSITY_4K:
+        min_dpi = DENSITY_4K_THRESHOLD
+    mask = columns.mask(min_dpi, max_dpi, requirements.get(MODE_SELECT_RATE),
+                        requirements.get(MODE_SELECT_ASPECT), ASPECT_CLOSE_EPS)
+    return columns.select(mask, sort)
+
 def select_mode_2(modes, requirements = {}, sort = []):
     candidates = list(filter(lambda x: filter_mode(x, requirements), modes))
     #print(candidates)
     a = sorted(candidates, key=lambda x: mode_sort_key(x, sort), reverse=True)
     return a[0]
 
+def select_mode(screen, requirements = {}, sort = []):
+    """Same choice as select_mode_2, looked up in the mode columns of
+    screens with many modes when NumPy is imported, or in the mode index of
+    the others with randr.index_modes()
+
+    Resident processes (randr.index_modes()) import NumPy for the first
+    screen with many modes, its columns build faster than an index; one-shot
+    runs never do, importing it takes longer than filtering the modes.
+    """
+    if len(screen.modes()) >= modecolumns.MIN_MODES:
+        np = modecolumns.loaded()
+        if np is None and randr.INDEX_MODES:
+            np = modecolumns.numpy()
+        if np is not None:
+            return select_mode_columns(screen.mode_table.columns, requirements, sort)
+    if randr.INDEX_MODES and sort == [MODE_SELECT_RESOLUTION, MODE_SELECT_RATE] and \
+            set(requirements) <= set([MODE_SELECT_DENSITY, MODE_SELECT_ASPECT, MODE_SELECT_RATE]):
+        mode = screen.mode_index.select(
+            requirements.get(MODE_SELECT_DENSITY, DENSITY_ANY),
+            requirements.get(MODE_SELECT_ASPECT),
+            requirements.get(MODE_SELECT_RATE, 0))
+        if mode is not None:
+            return mode
+    return select_mode_2(screen.modes(), requirements, sort)
+
 def set_positions(screens, align):
         widest = reduce(lambda y, x : x.set.resolution[0] if (x.set.resolution[0] > y) else y, screens, 0)
         highest = reduce(lambda y, x : x.set.resolution[1] if (x.set.resolution[1] > y) else y, screens, 0)
@@ -101,52 +184,93 @@ def set_positions(screens, align):
             used_width += s.set.resolution[0]
 
 
-def main(dry_run, setup_override, preferred_density,print_modes, gnome_save, gnome_save_file, align, min_rate):
-
-    screens_all = randr.screens()
+def plan_key(cs, selected_setup, preferred_density, align, min_rate, objective=None):
+    """Cache key of a layout: the options and the monitors on each output"""
+    import hashlib
+    import json
+    fingerprints = []
+    for s in cs:
+        modes = ",".join("{}x{}@{}".format(m.width, m.height, m.freq) for m in s.modes())
+        fingerprints.append([s.name, s.manufacturer_id, s.product_id, s.serial_no,
+                             hashlib.sha1(modes.encode('utf-8')).hexdigest()[:12]])
+    fingerprints.sort()
+    options = [selected_setup, preferred_density, align, min_rate]
+    if objective is not None:
+        options.append(sorted(objective.items()))
+    return json.dumps(options + [fingerprints])
+
+def plan_settings(cs):
+    settings = {}
+    for s in cs:
+        settings[s.name] = {
+            'enabled': s.set.is_enabled,
+            'mode': s.set.resolution,
+            'rate': s.set.freq,
+            'pos': s.set.position,
+        }
+    return settings
+
+def has_mode(screen, resolution, rate):
+    """Whether screen has a mode of resolution at rate, any rate when None"""
+    width, height = resolution
+    for m in screen.modes():
+        if m.width == width and m.height == height and (not rate or abs(m.freq - rate) <= randr.RATE_EPS):
+            return True
+    return False
 
-    cs = []
-    screens_disconnected = []
-    for s in screens_all:
-        if s.is_connected():
-            cs.append(s)
-        else:
-            screens_disconnected.append(s)
-            
-    #cs = randr.connected_screens()
+def apply_plan(cs, settings):
+    """Set a cached plan on the screens, False when it does not fit them"""
+    for s in cs:
+        entry = settings.get(s.name)
+        if entry is None:
+            return False
+        if entry['enabled'] and not has_mode(s, entry['mode'], entry['rate']):
+            return False
 
-    # Print info
-    print("connected screens:")
     for s in cs:
-        print("-", s)
-        if print_modes:
-            for m in s.modes():
-                print(m)
+        entry = settings[s.name]
+        s.set_enabled(entry['enabled'])
+        if entry['enabled']:
+            s.set_mode(tuple(entry['mode']) + ((entry['rate'],) if entry['rate'] else ()))
+            s.set_position(tuple(entry['pos']))
+    return True
+
+def show_plans():
+    for key, settings in cache.plan_cache(PLAN_VERSION).items():
+        print(key)
+        for name, entry in sorted(settings.items()):
+            print("  ", name, entry)
+
+def plan(cs, selected_setup, preferred_density, align, min_rate, objective=None):
 
     # Classify internal/external
     screen_builtin = None
     screens_external = []
     for s in cs:
-        if is_builtin(s):
+        if is_builtin(s) and screen_builtin is None:
             screen_builtin = s
         else:
             screens_external.append(s)
 
-    # Select setup
-    selected_setup = setup_override if setup_override is not None else EXTENAL_ON_RIGHT
+    if (selected_setup == OPTIMAL):
 
-    # Apply setup
-    print("Using setup:", selected_setup)
-    if (selected_setup == MIRROR):
+        import solver
+        solution = solver.solve(cs, objective, preferred_density, min_rate, screen_builtin)
+        for s, mode in zip(cs, solution.modes):
+            s.set_enabled(True)
+            s.set_mode(mode)
+        set_positions(solution.order, align)
+
+    elif (selected_setup == MIRROR):
 
         mode_requirements = {MODE_SELECT_DENSITY: preferred_density, MODE_SELECT_RATE: min_rate}
         mode_sort = [MODE_SELECT_RESOLUTION, MODE_SELECT_RATE]
 
-        builtin_mode = select_mode_2(screen_builtin.modes(), mode_requirements, mode_sort)
+        builtin_mode = select_mode(screen_builtin, mode_requirements, mode_sort)
 
         lowest = (builtin_mode.width, builtin_mode.height)
         for s in screens_external:
-            res = select_mode_2(s.modes(), mode_requirements, mode_sort)
+            res = select_mode(s, mode_requirements, mode_sort)
             if res.width < lowest[0]:
                 lowest = (res.width, res.height)
 
@@ -206,24 +330,104 @@ def main(dry_run, setup_override, preferred_density,print_modes, gnome_save, gno
                 #print(s.modes())
                 #print(s.physical_aspect)
                 mode_requirements = {MODE_SELECT_DENSITY: preferred_density, MODE_SELECT_ASPECT: s.physical_aspect, MODE_SELECT_RATE: min_rate}
-                mode = select_mode_2(s.modes(), mode_requirements, mode_sort)
+                mode = select_mode(s, mode_requirements, mode_sort)
                 s.set_mode(mode)
 
         # Set positions
         set_positions(screens_sorted, align)
 
+def prepare(screens_all, setup_override, preferred_density, print_modes, align, min_rate, plan_cache=True, objective=None):
+    """Print the screens and lay them out, returns the connected ones
+
+    Disconnected screens are set to be disabled.
+    """
+    cs = []
+    screens_disconnected = []
+    for s in screens_all:
+        if s.is_connected():
+            cs.append(s)
+        else:
+            screens_disconnected.append(s)
+
+    #cs = randr.connected_screens()
+
+    # Print info
+    print("connected screens:")
+    for s in cs:
+        print("-", s)
+        if print_modes:
+            for m in s.modes():
+                print(m, "\t current" if m is s.curr_mode else "")
+            for width, height, freq, preferred in s.native_timings:
+                print("{}\t{:.2f} hz\t native{}".format("{}x{}".format(width, height).ljust(10), freq, ", preferred" if preferred else ""))
+
+    # Select setup
+    selected_setup = setup_override if setup_override is not None else EXTENAL_ON_RIGHT
+
+    # Apply setup
+    print("Using setup:", selected_setup)
+    with timing.phase('plan'):
+        if selected_setup != OPTIMAL:
+            objective = None
+        key = plan_key(cs, selected_setup, preferred_density, align, min_rate, objective)
+        plans = cache.plan_cache(PLAN_VERSION) if plan_cache else None
+        cached = plans.get(key) if plans is not None else None
+        if cached is not None and apply_plan(cs, cached):
+            print("Using cached plan")
+        else:
+            with timing.phase('select'):
+                plan(cs, selected_setup, preferred_density, align, min_rate, objective)
+            if plans is not None:
+                plans.put(key, plan_settings(cs))
+                plans.save()
 
     # Disable disconnected screens
     for s in screens_disconnected:
         s.set_enabled(False)
+    return cs
 
-    randr.xrandr_apply(screens_all, dry_run)
-
-    if gnome_save and not dry_run:
-        print("Saving to: "+gnome_save_file)
+def save_gnome(cs, gnome_save_file):
+    print("Saving to: "+gnome_save_file)
+    with timing.phase('gnome_save'):
         import gnome_monitors
         gnome_monitors.save(cs, gnome_save_file)
-        
+
+def main(dry_run, setup_override, preferred_density,print_modes, gnome_save, gnome_save_file, align, min_rate, probe=None, force=False, plan_cache=True, timings=None, backend=None, objective=None, scheduler=None):
+    """Configure the screens
+
+    :probe: returns the screens, backend.screens by default
+    :timings: a timing.Timings recording the phases of the run, or None
+    :backend: a randr.Backend probing and applying the screens, randr.get_backend() by default
+    :objective: weights of the optimal setup, see solver.py
+    :scheduler: a scheduler.Scheduler serialising the run with those of
+        other processes, it returns early when a newer one supersedes it
+    """
+    if backend is None:
+        backend = randr.get_backend()
+    with timing.recording(timings):
+        ticket = None
+        if scheduler is not None:
+            with timing.phase('schedule'):
+                ticket = scheduler.acquire()
+            print(ticket.describe())
+            if ticket.superseded:
+                return
+        done = None
+        try:
+            with timing.phase('probe'):
+                screens_all = probe() if probe is not None else backend.screens()
+
+            cs = prepare(screens_all, setup_override, preferred_density, print_modes, align, min_rate, plan_cache, objective)
+
+            with timing.phase('apply'):
+                done = backend.apply(screens_all, dry_run, force)
+        finally:
+            if ticket is not None:
+                scheduler.release(ticket, done is not None and not dry_run)
+
+        if gnome_save and not dry_run:
+            save_gnome(cs, gnome_save_file)
+
 
     # print i3 config
     #for s in screens_sorted:
@@ -235,12 +439,113 @@ def main(dry_run, setup_override, preferred_density,print_modes, gnome_save, gno
     #        ))
 
 
-if(__name__ == "__main__"):
+async def main_async(dry_run, setup_override, preferred_density, print_modes, gnome_save, gnome_save_file, align, min_rate, prober=None, force=False, plan_cache=True, timings=None, objective=None, lock=None, apply_timeout=randr.APPLY_TIMEOUT, scheduler=None):
+    """main with the asyncio pipeline of aiorandr, xrandr only
+
+    The gnome save runs while the apply is verified.
+
+    :prober: an aiorandr.Prober, whose next probe cancels this one
+    :lock: an asyncio.Lock serialising the applies of concurrent runs
+    :scheduler: a scheduler.Scheduler, as for main
+    """
+    import asyncio
+    import aiorandr
+    if prober is None:
+        prober = aiorandr.Prober()
+    with timing.recording(timings):
+        ticket = None
+        if scheduler is not None:
+            with timing.phase('schedule'):
+                ticket = await asyncio.get_running_loop().run_in_executor(None, scheduler.acquire)
+            print(ticket.describe())
+            if ticket.superseded:
+                return []
+        applied = False
+        try:
+            with timing.phase('probe'):
+                screens_all = await prober.screens()
+
+            cs = prepare(screens_all, setup_override, preferred_density, print_modes, align, min_rate, plan_cache, objective)
+            applied = not dry_run and randr.xrandr_command(screens_all, force) is not None
+
+            save = None
+            if gnome_save and not dry_run:
+                save = lambda: save_gnome(cs, gnome_save_file)
+            if lock is None:
+                mismatched = await aiorandr.apply_and_save(screens_all, dry_run, force, save, apply_timeout, env=prober.env)
+            else:
+                async with lock:
+                    mismatched = await aiorandr.apply_and_save(screens_all, dry_run, force, save, apply_timeout, env=prober.env)
+        finally:
+            if ticket is not None:
+                scheduler.release(ticket, applied)
+        if mismatched:
+            print("Settings not applied to:", ", ".join(mismatched))
+        return mismatched
+
+def daemon(source, debounce, *args, run=None, **kwargs):
+    """Reconfigure on every hotplug event, with run (main by default)"""
+    import hotplug
+    if run is None:
+        run = main
+    randr.index_modes()
+
+    def reconfigure():
+        try:
+            run(*args, **kwargs)
+        except Exception as e:
+            # Keep listening, the next hotplug event may well succeed
+            print("Reconfiguration failed:", repr(e))
+        sys.stdout.flush()
+
+    try:
+        return hotplug.run(source, reconfigure, debounce)
+    finally:
+        source.close()
+
+
+def daemon_async(source, debounce, *args, probe=randr.PROBE_TIERED, probe_timeout=randr.PROBE_TIMEOUT, timings_file=None, **kwargs):
+    """daemon with main_async: a probe still running when the next burst
+    of hotplug events settles is cancelled, it would apply a stale layout"""
+    import asyncio
+    import aiorandr
+    randr.index_modes()
+
+    async def watch():
+        prober = aiorandr.Prober(probe, probe_timeout)
+        lock = asyncio.Lock()
+
+        async def reconfigure():
+            timings = timing.Timings() if timings_file is not None else None
+            try:
+                await main_async(*args, prober=prober, lock=lock, timings=timings, **kwargs)
+            except asyncio.CancelledError:
+                print("Probe cancelled by a newer hotplug event")
+            except Exception as e:
+                print("Reconfiguration failed:", repr(e))
+            finally:
+                if timings is not None:
+                    timings.write(timings_file)
+            sys.stdout.flush()
+
+        return await aiorandr.watch(source, reconfigure, debounce)
+
+    try:
+        return asyncio.run(watch())
+    finally:
+        source.close()
+
+
+def parse_args():
+    """Parse sys.argv, the argparse parser is only built when there are arguments"""
+    if len(sys.argv) == 1:
+        import types
+        return types.SimpleNamespace(**DEFAULT_ARGS)
 
     import argparse
     parser = argparse.ArgumentParser(description='Autoconfigure monitor setup')
 
-    default_backend_path = string.Template("$HOME/.config/monitors.xml").substitute(os.environ)
+    default_backend_path = DEFAULT_ARGS['gnome_save_file']
 
     parser.add_argument("--setup", "-s", help='override setup autoselection, must be one of:\n['+", ".join(SETUPS)+']', default = None, type=str)
     parser.add_argument("--dry-run", "-d", help='dry run, only print xrandr command', action='store_true')
@@ -250,7 +555,31 @@ if(__name__ == "__main__"):
     parser.add_argument("--gnome-save-file", help='gnome xml backend file to use ['+default_backend_path+']', default = default_backend_path, type=str)
     parser.add_argument("--align", "-a",  help='align display edges ['+", ".join([ALIGN_BOTTOM, ALIGN_TOP])+']', default = ALIGN_BOTTOM, type=str)
     parser.add_argument("--min-rate", "-r",  help='minimum refresh rate', default = 0, type=float)
-
+    parser.add_argument("--objective", help='weights of the optimal setup [pixels=1,dpi=0.5,edges=0.5,rate=0.25]', default = None, type=str)
+    parser.add_argument("--force", "-f", help='reapply the settings of all outputs, also unchanged ones', action='store_true')
+    parser.add_argument("--no-plan-cache", help='always compute the layout, do not use or update the plan cache', action='store_true')
+    parser.add_argument("--show-plans", help='print the cached layouts and exit', action='store_true')
+    parser.add_argument("--prune-plans", help='keep only the N most recently used cached layouts and exit', metavar='N', default = None, type=int)
+    parser.add_argument("--compact-gnome", help='drop stale and duplicate generated configurations from the gnome xml backend file and exit', action='store_true')
+    parser.add_argument("--gnome-keep", help='generated configurations --compact-gnome keeps per set of monitors [2]', metavar='N', default = 2, type=int)
+    parser.add_argument("--probe", help='how to probe screens ['+", ".join(randr.PROBES)+']', default = randr.PROBE_TIERED, type=str)
+    parser.add_argument("--backend", help='how to talk to the X server ['+", ".join(randr.BACKENDS)+']', default = randr.BACKEND_XRANDR, type=str)
+    parser.add_argument("--probe-timeout", help='seconds before a hung xrandr probe is killed, 0 waits forever ['+str(randr.PROBE_TIMEOUT)+']', metavar='SECONDS', default = randr.PROBE_TIMEOUT, type=float)
+    parser.add_argument("--apply-timeout", help='seconds before a hung xrandr apply is killed, 0 waits forever ['+str(randr.APPLY_TIMEOUT)+']', metavar='SECONDS', default = randr.APPLY_TIMEOUT, type=float)
+    parser.add_argument("--asyncio", help='probe and apply with asyncio: a newer hotplug cancels a stale probe, the apply is verified while the gnome save runs', action='store_true')
+    parser.add_argument("--transactional", help='turn outputs off first, then set up the rest on the CRTCs left free, verify the layout and roll back when it does not settle', action='store_true')
+    parser.add_argument("--displays", help='configure the comma separated X displays DISPLAYS in parallel, e.g. :1,:2', default = None, type=str)
+    parser.add_argument("--jobs", "-j", help='displays --displays configures at once [4]', metavar='N', default = None, type=int)
+    parser.add_argument("--coalesce", help='seconds a reconfiguration arriving in a burst waits for newer requests to merge into [0.2]', metavar='SECONDS', default = None, type=float)
+    parser.add_argument("--min-interval", help='minimum seconds between two modesets [1.0]', metavar='SECONDS', default = None, type=float)
+    parser.add_argument("--no-schedule", help='do not serialise and coalesce with concurrent runs', action='store_true')
+    parser.add_argument("--daemon", "-D", help='stay resident and reconfigure on monitor hotplug', action='store_true')
+    parser.add_argument("--server", help='stay resident and answer client.py on a unix socket with the screens kept in memory, reprobed on hotplug; with --daemon also reconfigure on hotplug', action='store_true')
+    parser.add_argument("--debounce", help='seconds to wait for hotplug events to settle [1.0]', default = 1.0, type=float)
+    parser.add_argument("--timings", help='append the time spent in each phase as a JSON line to FILE, - for stderr', metavar='FILE', default = None, type=str)
+    parser.add_argument("--profile", help='profile the (first) run with cProfile, stats to FILE, - for stderr', metavar='FILE', default = None, type=str)
+
+    parser.set_defaults(**DEFAULT_ARGS)
     args = parser.parse_args()
 
     if args.setup is not None and args.setup not in SETUPS:
@@ -259,4 +588,139 @@ if(__name__ == "__main__"):
     if args.density is not None and args.density not in DENSITIES:
         parser.error("--density must be one of: "+", ".join(DENSITIES))
 
-    main(args.dry_run, args.setup, args.density, args.print_modes, args.enable_gnome_save, args.gnome_save_file, args.align, args.min_rate)
+    if args.probe not in randr.PROBES:
+        parser.error("--probe must be one of: "+", ".join(randr.PROBES))
+
+    if args.backend not in randr.BACKENDS:
+        parser.error("--backend must be one of: "+", ".join(randr.BACKENDS))
+
+    # 0 disables a timeout
+    args.probe_timeout = args.probe_timeout or None
+    args.apply_timeout = args.apply_timeout or None
+
+    if args.asyncio and args.backend != randr.BACKEND_XRANDR:
+        parser.error("--asyncio needs --backend "+randr.BACKEND_XRANDR)
+    if args.transactional and args.backend != randr.BACKEND_XRANDR:
+        parser.error("--transactional needs --backend "+randr.BACKEND_XRANDR+", "+randr.BACKEND_XLIB+" always applies in two phases")
+    if args.transactional and args.asyncio:
+        parser.error("--transactional can not be used with --asyncio")
+    if args.server and args.asyncio:
+        parser.error("--server can not be used with --asyncio")
+
+    if args.displays is not None:
+        import displays
+        try:
+            args.displays = displays.parse_displays(args.displays)
+        except ValueError:
+            parser.error("--displays must be a comma separated list of X displays")
+        if args.daemon:
+            parser.error("--displays can not be used with --daemon")
+        if args.server:
+            parser.error("--displays can not be used with --server, start one server per display")
+        if args.asyncio:
+            parser.error("--displays can not be used with --asyncio")
+        if args.enable_gnome_save:
+            parser.error("--displays can not be used with --enable-gnome-save, the displays would share one monitors.xml")
+        if args.jobs is None:
+            args.jobs = displays.DEFAULT_JOBS
+        if args.jobs < 1:
+            parser.error("--jobs must be at least 1")
+
+    for name, value in (('--coalesce', args.coalesce), ('--min-interval', args.min_interval)):
+        if value is not None and value < 0:
+            parser.error(name+" can not be negative")
+
+    if args.objective is not None:
+        import solver
+        try:
+            args.objective = solver.parse_objective(args.objective)
+        except ValueError:
+            parser.error("--objective must be a list of term=weight, terms: "+", ".join(sorted(solver.DEFAULT_OBJECTIVE)))
+
+    return args
+
+
+if(__name__ == "__main__"):
+
+    args = parse_args()
+
+    if args.show_plans:
+        show_plans()
+        sys.exit(0)
+
+    if args.prune_plans is not None:
+        plans = cache.plan_cache(PLAN_VERSION)
+        print("Removed", plans.prune(max(0, args.prune_plans)), "cached layouts")
+        plans.save()
+        sys.exit(0)
+
+    if args.compact_gnome:
+        import gnome_monitors
+        print("Removed", gnome_monitors.compact(args.gnome_save_file, max(1, args.gnome_keep)), "configurations from", args.gnome_save_file)
+        sys.exit(0)
+
+    main_args = (args.dry_run, args.setup, args.density, args.print_modes, args.enable_gnome_save, args.gnome_save_file, args.align, args.min_rate)
+
+    if args.displays is not None:
+        import time
+        import displays
+        start = time.perf_counter()
+        results = displays.run(args.displays, args.jobs, lambda d: randr.backend(args.backend, args.probe, d, args.probe_timeout, args.apply_timeout, args.transactional), *main_args,
+                               force=args.force, plan_cache=not args.no_plan_cache, objective=args.objective)
+        displays.report(results, time.perf_counter() - start)
+        if args.timings is not None:
+            for r in results:
+                r.timings.write(args.timings)
+        sys.exit(0 if all(r.ok for r in results) else 1)
+
+    sched = None
+    if not args.dry_run and not args.no_schedule:
+        import scheduler
+        sched = scheduler.Scheduler(os.environ.get('DISPLAY', ''), args.coalesce, args.min_interval)
+
+    if args.asyncio:
+        async_kwargs = dict(force=args.force, plan_cache=not args.no_plan_cache, objective=args.objective, apply_timeout=args.apply_timeout, scheduler=sched)
+        if args.daemon:
+            import hotplug
+            daemon_async(hotplug.default_source(), args.debounce, *main_args, probe=args.probe, probe_timeout=args.probe_timeout,
+                         timings_file=args.timings, **async_kwargs)
+            sys.exit(0)
+
+        import asyncio
+        import aiorandr
+        timings = timing.Timings() if args.timings is not None else None
+        try:
+            mismatched = asyncio.run(main_async(*main_args, prober=aiorandr.Prober(args.probe, args.probe_timeout), timings=timings, **async_kwargs))
+        finally:
+            if timings is not None:
+                timings.write(args.timings)
+        sys.exit(1 if mismatched else 0)
+
+    backend = randr.backend(args.backend, args.probe, None, args.probe_timeout, args.apply_timeout, args.transactional)
+
+    if args.server:
+        import hotplug
+        import server
+        defaults = dict(setup=args.setup, density=args.density, align=args.align, min_rate=args.min_rate,
+                        force=args.force, objective=args.objective, dry_run=args.dry_run)
+        state = server.Server(backend, defaults, sched, args.gnome_save_file if args.enable_gnome_save else None)
+        server.serve(state, source=hotplug.default_source(), debounce=args.debounce, reconfigure=args.daemon)
+        sys.exit(0)
+
+    run = main
+    if args.timings is not None:
+        def timed_run(*run_args, **kwargs):
+            timings = timing.Timings()
+            try:
+                main(*run_args, timings=timings, **kwargs)
+            finally:
+                timings.write(args.timings)
+        run = timed_run
+    if args.profile is not None:
+        run = timing.profiled(run, args.profile)
+
+    if args.daemon:
+        import hotplug
+        daemon(hotplug.default_source(), args.debounce, *main_args, force=args.force, plan_cache=not args.no_plan_cache, backend=backend, objective=args.objective, scheduler=sched, run=run)
+    else:
+        run(*main_args, force=args.force, plan_cache=not args.no_plan_cache, backend=backend, objective=args.objective, scheduler=sched)
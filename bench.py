@@ -0,0 +1,1123 @@
+"""Offline benchmarks, no X server needed, xlib starts Xvfb when installed
+
+    python bench.py daemon
+    python bench.py displays
+    python bench.py edid
+    python bench.py gnome
+    python bench.py imports
+    python bench.py plans
+    python bench.py pnp
+    python bench.py probe
+    python bench.py schedule
+    python bench.py server
+    python bench.py solver
+    python bench.py modes
+    python bench.py memory
+    python bench.py stages [--save-baseline]
+    python bench.py xlib
+
+Benchmarks that return timings are compared with bench_baseline.json,
+the run fails when a timing is more than --threshold times its baseline in
+a run and in CONFIRM_RUNS reruns of its benchmark. Timings are stored in
+units of a calibration loop, so a baseline recorded on another machine
+still applies.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(DIR, 'bench_baseline.json')
+
+# connectors, modes per output
+SYNTHETIC_CORPORA = [(1, 10), (4, 100), (8, 250), (32, 500)]
+
+# import auto, in seconds, and the modules it must not pull in
+IMPORT_BUDGET = 0.060
+LAZY_MODULES = ['aiorandr', 'argparse', 'asyncio', 'csv', 'edid', 'gnome_monitors', 'hotplug', 'lxml', 'numpy', 'pnpid', 'server', 'socketserver', 'tempfile']
+
+# Slowdowns smaller than this many calibration loops are timer noise
+NOISE_FLOOR = 0.01
+
+# Reruns of a benchmark with a regressed timing, its best timing counts
+CONFIRM_RUNS = 2
+
+def best_of(fn, repeat=5, number=1, setup=None):
+    """Best time of fn(), or of fn(setup()) with setup not timed"""
+    best = None
+    for _ in range(repeat):
+        elapsed = 0.0
+        for _ in range(number):
+            if setup is None:
+                start = time.perf_counter()
+                fn()
+            else:
+                arg = setup()
+                start = time.perf_counter()
+                fn(arg)
+            elapsed += time.perf_counter() - start
+        elapsed /= number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def fresh_python(code, repeat=10):
+    """Best wall time of running code (imports included) in a new interpreter"""
+    timed = "import time\nt = time.perf_counter()\n{}\nprint(time.perf_counter() - t)".format(code)
+    return min(float(subprocess.check_output([sys.executable, '-c', timed], cwd=DIR))
+               for _ in range(repeat))
+
+def import_times(module, repeat=5):
+    """Best cumulative import time of module and of everything it imports,
+    from python -X importtime, in seconds"""
+    env = dict(os.environ)
+    # stale bytecode would be compiled on every import
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    best = {}
+    for run in range(repeat + 1):
+        output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                                cwd=DIR, env=env, stderr=subprocess.PIPE, check=True).stderr.decode()
+        times = {}
+        for line in output.split('\n'):
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line.split('|')
+            times[name.strip()] = int(cumulative) / 1e6
+        # the first run warms up the bytecode and the page cache
+        if run > 0:
+            best = {name: min(t, best.get(name, t)) for name, t in times.items()}
+    return best
+
+def allocated(fn):
+    """Bytes still allocated (traced) after calling fn"""
+    tracemalloc.start()
+    result = fn()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+def report(rows, header):
+    widths = [max(len(str(r[i])) for r in rows + [header]) for i in range(len(header))]
+    print("  ".join(str(h).ljust(w) for h, w in zip(header, widths)))
+    for r in rows:
+        print("  ".join(str(c).ljust(w) for c, w in zip(r, widths)))
+
+def bench_pnp(args):
+    import tempfile
+    import pnpid
+    pnpid.read_csv()
+
+    # a table built from an edit of the csv of the same size is stale
+    directory = tempfile.mkdtemp()
+    edited = os.path.join(directory, 'pnp_ids.csv')
+    with open(pnpid.CSV_FILENAME, 'rb') as f:
+        data = f.read()
+    with open(edited, 'wb') as f:
+        f.write(data.replace(b'"DEL","Dell Inc."', b'"DEL","Dell Inc,"'))
+    csv_filename, table_filename = pnpid.CSV_FILENAME, pnpid.TABLE_FILENAME
+    digest = pnpid.csv_digest
+    try:
+        pnpid.TABLE_FILENAME = os.path.join(directory, 'pnp_ids.bin')
+        pnpid.compile_table(edited, pnpid.TABLE_FILENAME)
+        st = os.stat(csv_filename)
+        os.utime(edited, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+        pnpid._table = None
+        if pnpid.manufacturer_from_id('DEL') != 'Dell Inc.':
+            raise AssertionError("a table built from another csv of the same size was used")
+
+        # an unchanged csv is not read to check the table
+        pnpid.compile_table(edited, pnpid.TABLE_FILENAME)
+        pnpid.CSV_FILENAME, pnpid._table = edited, None
+        def csv_digest(filename=None):
+            raise AssertionError("the csv was hashed though its size and mtime match the table")
+        pnpid.csv_digest = csv_digest
+        if pnpid.manufacturer_from_id('DEL') != 'Dell Inc,':
+            raise AssertionError("the table built from the csv was not used")
+    finally:
+        pnpid.CSV_FILENAME, pnpid.TABLE_FILENAME = csv_filename, table_filename
+        pnpid.csv_digest = digest
+        pnpid._table = None
+
+    def load_table():
+        pnpid._table = None
+        return pnpid._load()
+
+    rows = [
+        ("csv dict",
+         "{:.2f} ms".format(1000 * fresh_python("import pnpid; pnpid.read_csv()")),
+         "{:.1f} KiB".format(allocated(pnpid.read_csv) / 1024)),
+        ("compiled table",
+         "{:.2f} ms".format(1000 * fresh_python("import pnpid; pnpid.manufacturer_from_id('DEL')")),
+         "{:.1f} KiB".format(allocated(load_table) / 1024)),
+    ]
+    report(rows, ("pnp ids", "import + first lookup", "heap"))
+    print("(the compiled table is memory mapped, its pages are shared and loaded on demand)")
+
+def bench_imports(args):
+    """Import time of auto.py, checked against IMPORT_BUDGET"""
+    times = import_times('auto')
+    rows = [(name, "{:.2f} ms".format(1000 * times[name])) for name in ('auto', 'randr', 'cache', 'subprocess', 're')
+            if name in times]
+    report(rows, ("module", "cumulative import"))
+    eager = [name for name in LAZY_MODULES if name in times]
+    if eager:
+        raise AssertionError("import auto imports " + ", ".join(eager))
+    if times['auto'] > IMPORT_BUDGET:
+        raise AssertionError("import auto takes {:.1f} ms, over the {:.0f} ms budget".format(
+            1000 * times['auto'], 1000 * IMPORT_BUDGET))
+    return {'import/auto': times['auto']}
+
+RESOLUTIONS = [
+    (640, 480), (800, 600), (1024, 768), (1280, 720), (1280, 800), (1280, 1024),
+    (1366, 768), (1440, 900), (1600, 900), (1680, 1050), (1920, 1080), (1920, 1200),
+    (2560, 1080), (2560, 1440), (2560, 1600), (3440, 1440), (3840, 1600), (3840, 2160),
+]
+RATES = [23.98, 24.0, 29.97, 30.0, 48.0, 50.0, 59.94, 60.0, 75.0, 100.0, 120.0, 144.0, 165.0, 240.0]
+
+def synthetic_modes(n, physical_height=34.0, seed=0):
+    import randr
+    rng = random.Random(seed)
+    modes = []
+    for _ in range(n):
+        width, height = rng.choice(RESOLUTIONS)
+        modes.append(randr.Mode(width, height, rng.choice(RATES), dpi=height / (physical_height/2.54)))
+    return modes
+
+def synthetic_raw_modes(n, seed=0):
+    rng = random.Random(seed)
+    return [rng.choice(RESOLUTIONS) + (rng.choice(RATES), i == 0) for i in range(n)]
+
+def bench_memory(args):
+    import corpus
+    import randr
+
+    outputs = 12
+    identical = 6
+    modes = 300
+
+    def build(shared):
+        screens = []
+        for i in range(outputs):
+            edid = corpus.synthetic_edid(serial=1 if i < identical else 100 + i)
+            line = "DP-{} connected (normal left inverted right x axis y axis)".format(i + 1)
+            screens.append(randr.make_screen(line, synthetic_raw_modes(modes, 0 if i < identical else i), edid, True))
+            if not shared:
+                randr._mode_tables.clear()
+        return screens
+
+    # decode the EDIDs once, so only the screens are measured
+    build(True)
+
+    rows = []
+    for shared in (False, True):
+        size = allocated(lambda: build(shared))
+        tables = len(set(id(s.mode_table) for s in build(shared)))
+        rows.append(("interned" if shared else "per screen", tables,
+                     "{:.1f} KiB".format(size / 1024), "{:.1f} KiB".format(size / 1024 / outputs)))
+    report(rows, ("mode tables", "tables", "total", "per output"))
+    print("({} outputs, {} identical, {} modes each)".format(outputs, identical, modes))
+
+def check_mode_index(screens):
+    """The mode index of each screen picks the mode filtering and sorting
+    its modes does, for every density, aspect and minimum rate"""
+    import auto
+    import modecolumns
+    import randr
+
+    sort = [auto.MODE_SELECT_RESOLUTION, auto.MODE_SELECT_RATE]
+    has_numpy = modecolumns.numpy() is not None
+    for s in screens:
+        index = randr.ModeIndex(s.modes())
+        columns = modecolumns.ModeColumns(s.modes()) if has_numpy else None
+        for density in auto.DENSITIES:
+            for aspect in (None, s.physical_aspect, 16/9., 4/3.):
+                for min_rate in (0, 50.0, 60.0, 100.0):
+                    requirements = {auto.MODE_SELECT_DENSITY: density, auto.MODE_SELECT_RATE: min_rate}
+                    if aspect is not None:
+                        requirements[auto.MODE_SELECT_ASPECT] = aspect
+                    candidates = [m for m in s.modes() if auto.filter_mode(m, requirements)]
+                    expected = sorted(candidates, key=lambda x: auto.mode_sort_key(x, sort), reverse=True)[:1]
+                    got = index.select(density, aspect, min_rate)
+                    if got is not (expected[0] if expected else None):
+                        raise AssertionError("{}: the index picks {} instead of {} for {}".format(
+                            s.name, got, expected, requirements))
+                    if columns is not None and expected and \
+                            auto.select_mode_columns(columns, requirements, sort) is not expected[0]:
+                        raise AssertionError("{}: the columns pick {} instead of {} for {}".format(
+                            s.name, auto.select_mode_columns(columns, requirements, sort), expected, requirements))
+
+def bench_modes(args):
+    import auto
+    import modecolumns
+    import randr
+
+    for name, lines in corpora():
+        check_mode_index([s for s in randr.parse_xrandr(lines) if s.is_connected()])
+
+    # a run planning screens with hundreds of modes does not import numpy
+    import tempfile
+    code = ("import sys, auto, corpus, randr\n"
+            "cs = [s for s in randr.parse_xrandr(corpus.synthetic_verbose(4, 500)) if s.is_connected()]\n"
+            "auto.plan(cs, auto.EXTENAL_ON_RIGHT, auto.DENSITY_ANY, auto.ALIGN_BOTTOM, 0)\n"
+            "sys.exit('numpy' in sys.modules)")
+    if subprocess.call([sys.executable, '-c', code], cwd=DIR, env=dict(os.environ, XDG_CACHE_HOME=tempfile.mkdtemp())):
+        raise AssertionError("planning imported numpy")
+
+    # a resident process plans them with the mode columns, same choice
+    has_numpy = modecolumns.numpy() is not None
+    if has_numpy:
+        code = ("import sys, auto, corpus, randr\n"
+                "def plan():\n"
+                "    cs = [s for s in randr.parse_xrandr(corpus.synthetic_verbose(4, 500)) if s.is_connected()]\n"
+                "    auto.plan(cs, auto.EXTENAL_ON_RIGHT, auto.DENSITY_ANY, auto.ALIGN_BOTTOM, 0)\n"
+                "    return [(s.name, s.set.resolution, s.set.freq, s.mode_table._columns is not None) for s in cs]\n"
+                "one_shot = plan()\n"
+                "randr.index_modes()\n"
+                "resident = plan()\n"
+                "sys.exit([r[:3] for r in one_shot] != [r[:3] for r in resident] or not all(r[3] for r in resident))")
+        if subprocess.call([sys.executable, '-c', code], cwd=DIR, env=dict(os.environ, XDG_CACHE_HOME=tempfile.mkdtemp())):
+            raise AssertionError("a resident process did not plan with the mode columns, or chose other modes")
+
+    sort = [auto.MODE_SELECT_RESOLUTION, auto.MODE_SELECT_RATE]
+    requirements = {auto.MODE_SELECT_DENSITY: auto.DENSITY_HD, auto.MODE_SELECT_ASPECT: 16/9., auto.MODE_SELECT_RATE: 60.0}
+
+    def python_select(modes):
+        candidates = [m for m in modes if auto.filter_mode(m, requirements)]
+        return sorted(candidates, key=lambda x: auto.mode_sort_key(x, sort), reverse=True)[0]
+
+    def us(seconds):
+        return "{:.1f} us".format(seconds * 1e6)
+
+    rows = []
+    for n in (10, 50, 100, 500, 2000):
+        modes = synthetic_modes(n)
+        screen = randr.Screen('DP-1', False, None, modes, '', '', '', 60.0, 34.0, 0, 0, True)
+        expected = python_select(modes)
+        if screen.mode_index.select(auto.DENSITY_HD, 16/9., 60.0) is not expected or \
+                (has_numpy and auto.select_mode_columns(modecolumns.ModeColumns(modes), requirements, sort) is not expected):
+            raise AssertionError("selectors disagree on {} modes".format(n))
+        row = [n, us(best_of(lambda: python_select(modes), number=20)),
+               us(best_of(lambda: screen.mode_index.select(auto.DENSITY_HD, 16/9., 60.0), number=20)),
+               us(best_of(lambda: randr.ModeIndex(modes), number=5))]
+        if has_numpy:
+            columns = modecolumns.ModeColumns(modes)
+            row += [us(best_of(lambda: auto.select_mode_columns(columns, requirements, sort), number=20)),
+                    us(best_of(lambda: modecolumns.ModeColumns(modes), number=5))]
+        else:
+            row += ["-", "-"]
+        rows.append(row)
+    report(rows, ("modes", "filter + sort", "index", "index build", "numpy", "numpy build"))
+    if not has_numpy:
+        print("(numpy is not installed)")
+
+def bench_gnome(args):
+    """gnome_monitors.save on large monitors.xml files"""
+    import tempfile
+    import auto
+    import corpus
+    import randr
+    try:
+        import gnome_monitors
+    except ImportError:
+        print("(lxml is not installed)")
+        return {}
+
+    cs = [s for s in randr.parse_xrandr(corpus.load_fixture('laptop-dock')) if s.is_connected()]
+    auto.plan(cs, auto.EXTENAL_ON_RIGHT, auto.DENSITY_ANY, auto.ALIGN_BOTTOM, 0)
+    monitors_xml = os.path.join(tempfile.mkdtemp(), 'monitors.xml')
+
+    def write_synthetic(n):
+        with open(monitors_xml, 'w') as f:
+            f.write(corpus.synthetic_monitors_xml(n))
+
+    results = {}
+    rows = []
+    for n in (10, 100, 1000, 5000):
+        write_synthetic(n)
+        parse = best_of(lambda: gnome_monitors.ConfigurationIndex(gnome_monitors.parse(monitors_xml)[0].getroot()))
+        changed = best_of(lambda _: gnome_monitors.save(cs, monitors_xml), setup=lambda: write_synthetic(n))
+        if gnome_monitors.save(cs, monitors_xml):
+            raise AssertionError("saving the same configuration again rewrote the file")
+        unchanged = best_of(lambda: gnome_monitors.save(cs, monitors_xml))
+        results.update({'gnome/parse/{}'.format(n): parse,
+                        'gnome/save/{}'.format(n): changed,
+                        'gnome/unchanged/{}'.format(n): unchanged})
+        rows.append((n, "{:.2f} ms".format(1000 * parse), "{:.2f} ms".format(1000 * changed), "{:.2f} ms".format(1000 * unchanged),
+                     "{:.0f} KiB".format(os.path.getsize(monitors_xml) / 1024)))
+    report(rows, ("configurations", "parse + index", "save", "save, already present", "size"))
+
+    # a symlinked monitors.xml (dotfiles) stays a symlink
+    link = os.path.join(os.path.dirname(monitors_xml), 'link.xml')
+    write_synthetic(10)
+    os.symlink(monitors_xml, link)
+    gnome_monitors.save(cs, link)
+    if not os.path.islink(link) or gnome_monitors.save(cs, monitors_xml):
+        raise AssertionError("saving through a symlink replaced the link instead of its target")
+    return results
+
+def bench_edid(args):
+    """Decoding EDIDs with CEA-861 and DisplayID extension blocks"""
+    import corpus
+    import edid
+
+    monitors = [
+        ('base', corpus.synthetic_edid(preferred=(1920, 1200, 59.95)),
+         [(1920, 1200, 59.95)], None),
+        ('cea', corpus.synthetic_edid(preferred=(3840, 2160, 60.0), extensions=[
+            corpus.cea_extension([16, 97, 118, 4 + 128], [(2560, 1440, 144.0)])]),
+         [(3840, 2160, 60.0), (1280, 720, 60.0), (1920, 1080, 60.0), (3840, 2160, 120.0), (2560, 1440, 144.0)], None),
+        ('cea+displayid', corpus.synthetic_edid(preferred=(2560, 2880, 60.0), extensions=[
+            corpus.cea_extension([16, 97], [(3840, 2160, 30.0)]),
+            corpus.displayid_extension([(2560, 2880, 60.0), (2560, 2880, 30.0)], (2, 1, 1, 0))]),
+         [(2560, 2880, 60.0), (1920, 1080, 60.0), (3840, 2160, 60.0), (3840, 2160, 30.0), (2560, 2880, 30.0)],
+         edid.Tile(2, 1, 1, 0, 2560, 2880)),
+    ]
+
+    # a CEA block without data blocks, with junk where they would be
+    junk = bytearray(corpus.cea_extension([16, 97, 118]))
+    junk[2] = 0
+    junk[127] = -sum(junk[:127]) % 256
+    monitors.append(('cea-empty', corpus.synthetic_edid(preferred=(1920, 1200, 59.95), extensions=[bytes(junk)]),
+                     [(1920, 1200, 59.95)], None))
+
+    results = {}
+    rows = []
+    for name, data, expected, tile in monitors:
+        decoded = edid.Edid(data)
+        got = [(t.width, t.height, round(t.freq)) for t in decoded.native_timings]
+        if got != [(w, h, round(f)) for w, h, f in expected] or decoded.tile != tile:
+            raise AssertionError("{}: decoded {} {}".format(name, got, decoded.tile))
+        seconds = best_of(lambda: edid.Edid(data), number=100)
+        results['edid/' + name] = seconds
+        rows.append((name, len(data) // edid.EDID_BLOCK_SIZE, len(decoded.native_timings),
+                     "{:.1f} us".format(1e6 * seconds)))
+    report(rows, ("edid", "blocks", "timings", "decode"))
+    return results
+
+def bench_solver(args):
+    """Solve time of the optimal setup against the number of outputs"""
+    import itertools
+    import corpus
+    import randr
+    import solver
+
+    def brute_force(screens):
+        options = [solver.candidates(s) for s in screens]
+        best = None
+        for modes in itertools.product(*options):
+            pixels = sum(m.width * m.height for m in modes)
+            total = float(sum(o[0].width * o[0].height for o in options))
+            dpis = [m.dpi for m in modes]
+            heights = [m.height for m in modes]
+            top_rate = max(m.freq for o in options for m in o)
+            o = solver.DEFAULT_OBJECTIVE
+            score = (o[solver.PIXELS] * pixels / total + o[solver.DPI] * (1 - (max(dpis) - min(dpis)) / max(dpis)) +
+                     o[solver.EDGES] * (1 - (max(heights) - min(heights)) / float(max(heights))) +
+                     o[solver.RATE] * min(m.freq for m in modes) / top_rate)
+            best = score if best is None else max(best, score)
+        return best
+
+    results = {}
+    rows = []
+    for n in (2, 3, 4, 6, 8, 10, 12):
+        cs = [s for s in randr.parse_xrandr(corpus.synthetic_verbose(n, 10, seed=n)) if s.is_connected()]
+        solution = solver.solve(cs, first=cs[0])
+        if n <= 4 and abs(solution.score - brute_force(cs)) > 1e-9:
+            raise AssertionError("solver is not optimal on {} outputs".format(n))
+        seconds = best_of(lambda: solver.solve(cs, first=cs[0]))
+        results['solver/{}'.format(n)] = seconds
+        rows.append((n, "{:.2f} ms".format(1000 * seconds), solution.visited, "{:.3f}".format(solution.score),
+                     "{:.1f}".format(sum(m.width * m.height for m in solution.modes) / 1e6)))
+    report(rows, ("outputs", "solve", "visited", "score", "megapixels"))
+    return results
+
+def bench_probe(args):
+    """Snapshot tier against full parse, the digests of both must agree"""
+    import cache
+    import corpus
+    import drm
+    import randr
+    import snapshot
+
+    # hits of the EDID cache do not rewrite it
+    edid_cache = cache.edid_cache()
+    for _ in range(2):
+        randr.parse_xrandr(corpus.load_fixture('laptop-docked'))
+        edid_cache.save()
+    randr.parse_xrandr(corpus.load_fixture('laptop-docked'))
+    if edid_cache.dirty:
+        raise AssertionError("probing the same monitors again rewrites " + cache.EDID_CACHE_FILE)
+
+    # a monitor swapped for another model with the same modes, on a kernel
+    # without epoch
+    import tempfile
+    root = tempfile.mkdtemp()
+    os.makedirs(os.path.join(root, 'card0-DP-1'))
+    digests = []
+    for serial in (1, 2):
+        for name, data in (('status', b'connected\n'), ('edid', corpus.synthetic_edid(serial=serial))):
+            with open(os.path.join(root, 'card0-DP-1', name), 'wb') as f:
+                f.write(data)
+        digests.append(snapshot.connector_digest(drm.connector_states(root), []))
+    if digests[0] == digests[1]:
+        raise AssertionError("the snapshot digest does not change with the monitor")
+    # with an epoch, the swap bumps it and the EDID is not read
+    with open(os.path.join(root, 'card0-DP-1', 'epoch'), 'w') as f:
+        f.write('3\n')
+    if drm.connector_states(root) != [['card0-DP-1', 'connected', '3', None]]:
+        raise AssertionError("the EDID was hashed on a kernel with connector epochs")
+
+    # the scale is not in xrandr --current: a remembered one is used while
+    # the output looks the same, a scale changed since is probed again
+    sysfs = [['card0-eDP-1', 'connected', None, None]]
+    outputs = corpus.synthetic_outputs(2, 20)
+    def snapshot_scales(state):
+        parsed = randr.parse_xrandr_current(corpus.current_output(outputs))
+        if snapshot.current_digest(sysfs, parsed) != state['digest']:
+            return None
+        screens = snapshot.remembered(parsed, state)
+        return screens and [s.curr_scale for s in screens]
+    states = {}
+    for scale in ((1.0, 1.0), (2.0, 2.0)):
+        outputs[0].scale = scale
+        states[scale] = snapshot.probed_state(sysfs, randr.parse_xrandr_current(corpus.current_output(outputs)),
+                                              randr.parse_xrandr(corpus.verbose_output(outputs)))
+        if snapshot_scales(states[scale]) != [list(scale), [1.0, 1.0]]:
+            raise AssertionError("the snapshot lost the scale {}x{}".format(*scale))
+    outputs[0].scale = (1.0, 1.0)
+    if snapshot_scales(states[(2.0, 2.0)]) != [[1.0, 1.0], [1.0, 1.0]]:
+        raise AssertionError("the snapshot kept a scale reset since")
+    outputs[0].scale = (2.0, 2.0)
+    if snapshot_scales(states[(1.0, 1.0)]) is not None:
+        raise AssertionError("the snapshot missed a scale set since")
+
+    results = {}
+    rows = []
+    for connectors, modes in SYNTHETIC_CORPORA:
+        outputs = corpus.synthetic_outputs(connectors, modes, disconnected=1)
+        verbose = corpus.verbose_output(outputs)
+        current = corpus.current_output(outputs)
+        name = "synthetic-{}x{}".format(connectors, modes)
+
+        full = randr.parse_xrandr(verbose)
+        state = snapshot.probed_state(sysfs, randr.parse_xrandr_current(current), full)
+
+        def quick():
+            parsed = randr.parse_xrandr_current(current)
+            if snapshot.current_digest(sysfs, parsed) != state['digest']:
+                raise AssertionError("{}: digests of --current and --verbose differ".format(name))
+            return snapshot.remembered(parsed, state)
+
+        got = [(s.name, s.is_connected(), s.model, len(s.modes())) for s in quick()]
+        expected = [(s.name, s.is_connected(), s.model, len(s.modes())) for s in full]
+        if got != expected:
+            raise AssertionError("{}: snapshot screens {} differ from {}".format(name, got, expected))
+        results['probe/snapshot/' + name] = best_of(quick)
+        results['probe/full/' + name] = best_of(lambda: randr.parse_xrandr(verbose))
+        rows.append((name, "{:.3f} ms".format(1000 * results['probe/snapshot/' + name]),
+                     "{:.3f} ms".format(1000 * results['probe/full/' + name])))
+    report(rows, ("corpus", "snapshot", "full"))
+    return results
+
+def bench_schedule(args):
+    """Apply scheduler: overhead of an uncontended turn, merging a burst"""
+    import tempfile
+    import threading
+    import scheduler
+
+    directory = tempfile.mkdtemp()
+    idle = scheduler.Scheduler('bench-idle', 0, 0, directory)
+
+    def turn():
+        with idle.turn():
+            pass
+
+    # a run alone does not wait for the coalesce window
+    alone = scheduler.Scheduler('bench-alone', None, 0, directory)
+    start = time.time()
+    with alone.turn():
+        alone_waited = time.time() - start
+    if alone_waited > alone.window / 2:
+        raise AssertionError("an uncontended run waited {:.0f} ms".format(1000 * alone_waited))
+
+    # a burst arriving during a modeset is applied once after it
+    burst = scheduler.Scheduler('bench-burst', 0.2, 0, directory)
+    tickets = []
+
+    def request():
+        with burst.turn() as ticket:
+            tickets.append(ticket)
+
+    threads = [threading.Thread(target=request) for _ in range(7)]
+    with burst.turn() as first:
+        tickets.append(first)
+        for t in threads:
+            t.start()
+        time.sleep(0.05)
+    for t in threads:
+        t.join()
+    applied = [t for t in tickets if not t.superseded]
+    if [len(t.merged) for t in applied] != [1, len(threads)]:
+        raise AssertionError("burst of {} requests during a modeset: {}".format(
+            len(threads), [t.describe() for t in tickets]))
+
+    # a run that changed nothing does not hold off the next one
+    spaced = scheduler.Scheduler('bench-spaced', 0, 60.0, directory)
+    with spaced.turn() as ticket:
+        ticket.applied = False
+    start = time.time()
+    with spaced.turn():
+        waited = time.time() - start
+    if waited > 1.0:
+        raise AssertionError("a run without modeset delayed the next one by {:.0f} ms".format(1000 * waited))
+
+    results = {'schedule/turn': best_of(turn, number=20)}
+    report([("turn", "{:.3f} ms".format(1000 * results['schedule/turn'])),
+            ("alone", "{:.3f} ms".format(1000 * alone_waited)),
+            ("burst", "; ".join(t.describe() for t in applied))], ("schedule", ""))
+    return results
+
+def bench_displays(args):
+    """Configuring several displays serially and in parallel, against
+    simulated servers with real probe and modeset latencies"""
+    import displays
+    import simulate
+
+    class SleepingBackend(simulate.SimulatedBackend):
+        def screens(self):
+            time.sleep(self.server.probe_latency)
+            return super(SleepingBackend, self).screens()
+
+        def apply(self, screens, dryrun, force=False):
+            time.sleep(self.server.modeset_latency)
+            return super(SleepingBackend, self).apply(screens, dryrun, force)
+
+    names = [":{}".format(i + 1) for i in range(8)]
+    outputs, initial, _ = simulate.mst_hub(3)
+    main_args = (False, None, 'any', False, False, None, 'bottom', 0)
+
+    rows = []
+    walls = {}
+    for jobs in (1, 4, 8):
+        servers = dict((name, simulate.SimulatedServer(outputs, initial, 0.01, 0.02)) for name in names)
+        start = time.perf_counter()
+        results = displays.run(names, jobs, lambda name: SleepingBackend(servers[name]), *main_args, force=True, plan_cache=False)
+        walls[jobs] = time.perf_counter() - start
+        for r in results:
+            if not r.ok:
+                raise AssertionError("{} failed: {}".format(r.display, r.error))
+            if servers[r.display].modesets != 1 or r.log.count("connected screens:") != 1:
+                raise AssertionError("runs of {} were mixed up".format(r.display))
+        rows.append((jobs, "{:.1f} ms".format(1000 * walls[jobs]), "{:.1f}x".format(walls[1] / walls[jobs])))
+    report(rows, ("jobs", "8 displays", "speedup"))
+    if walls[1] / walls[8] < 2:
+        raise AssertionError("8 jobs are not faster than 1")
+
+def bench_plans(args):
+    """Planning with a cold and a warm plan cache; a changed refresh rate
+    must not reuse the cached plan"""
+    import contextlib
+    import io
+    import auto
+    import cache
+    import corpus
+    import randr
+
+    outputs = corpus.synthetic_outputs(3, 50, seed=1)
+
+    def prepare():
+        screens = randr.parse_xrandr(corpus.verbose_output(outputs))
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            cs = auto.prepare(screens, None, auto.DENSITY_ANY, False, auto.ALIGN_BOTTOM, 0)
+        return cs, "Using cached plan" in output.getvalue()
+
+    cache.plan_cache(auto.PLAN_VERSION).prune(0)
+    cs, cached = prepare()
+    if cached or not prepare()[1]:
+        raise AssertionError("the plan cache missed the same monitors")
+    settings = auto.plan_settings(cs)
+
+    # the monitor on DP-1 drops the rate of its chosen mode
+    external = [s for s in cs if s.name == 'DP-1'][0]
+    chosen = (external.set.resolution[0], external.set.resolution[1], external.set.freq)
+    o = [o for o in outputs if o.name == 'DP-1'][0]
+    o.modes = [(w, h, r / 2) if (w, h, r) == chosen else (w, h, r) for w, h, r in o.modes]
+    screens = [s for s in randr.parse_xrandr(corpus.verbose_output(outputs)) if s.is_connected()]
+    if auto.apply_plan(screens, settings):
+        raise AssertionError("a cached plan was applied with a rate the monitor no longer has")
+    cs, cached = prepare()
+    external = [s for s in cs if s.name == 'DP-1'][0]
+    if cached or not auto.has_mode(external, external.set.resolution, external.set.freq):
+        raise AssertionError("a changed refresh rate reused the cached plan")
+
+    def cold():
+        cache.plan_cache(auto.PLAN_VERSION).prune(0)
+        prepare()
+
+    results = {'plans/cold': best_of(cold), 'plans/warm': best_of(prepare)}
+    report([(name, "{:.3f} ms".format(1000 * results['plans/' + name])) for name in ('cold', 'warm')], ("plan cache", "prepare"))
+    return results
+
+def bench_daemon(args):
+    """Replay the generated fixtures as hotplug events through auto.daemon,
+    and a connector flapping for longer than hotplug.MAX_DEBOUNCE_SECONDS"""
+    import contextlib
+    import io
+    import auto
+    import corpus
+    import hotplug
+    import randr
+
+    names = corpus.fixtures()
+    order = names + names[:1]
+
+    def replay():
+        # an event every 5 s, a burst settles after 1 s
+        source = hotplug.FakeEventSource([(5.0, corpus.load_fixture(name)) for name in order[1:]],
+                                         corpus.load_fixture(order[0]))
+        probed = []
+
+        def probe():
+            probed.append(source.probe())
+            return probed[-1]
+
+        output = io.StringIO()
+        main_args = (True, None, auto.DENSITY_ANY, False, False, None, auto.ALIGN_BOTTOM, 0)
+        with contextlib.redirect_stdout(output):
+            runs = auto.daemon(source, 1.0, *main_args, probe=probe, plan_cache=False, backend=randr.XrandrBackend())
+        return runs, probed, output.getvalue()
+
+    runs, probed, output = replay()
+    expected = [sorted(s.name for s in randr.parse_xrandr(corpus.load_fixture(name)) if s.is_connected()) for name in order]
+    got = [sorted(s.name for s in screens if s.is_connected()) for screens in probed]
+    if runs != len(order) or got != expected:
+        raise AssertionError("replayed {} in {} runs, probed {}".format(order, runs, got))
+    if "Reconfiguration failed" in output or output.count("Using setup:") != runs:
+        raise AssertionError("replay failed:\n" + output)
+
+    # a dock dropping its monitor every 0.5 s for a minute
+    flapping = [(0.5, corpus.load_fixture(names[i % 2])) for i in range(120)]
+    source = hotplug.FakeEventSource(flapping)
+    flaps = hotplug.run(source, lambda: None, 1.0)
+    if flaps < 1 + int(source.now() // hotplug.MAX_DEBOUNCE_SECONDS):
+        raise AssertionError("{:.0f} s of flapping reconfigured {} times".format(source.now(), flaps))
+
+    results = {'daemon/replay': best_of(replay) / runs}
+    report([("replay", runs, "{:.3f} ms".format(1000 * results['daemon/replay'])),
+            ("flapping", flaps, "{:.0f} s".format(source.now()))], ("daemon", "runs", ""))
+    return results
+
+# Round trip of a status query to a warm server
+STATUS_BUDGET = 0.010
+
+def bench_server(args):
+    """Round trips to a warm server, against a simulated display server,
+    and concurrent clients"""
+    import tempfile
+    import threading
+    import client
+    import server
+    import simulate
+
+    outputs, initial, _ = simulate.mst_hub(3)
+    display = simulate.SimulatedServer(outputs, initial, 0, 0)
+    defaults = dict(setup=None, density='any', align='bottom', min_rate=0, force=False, objective=None, dry_run=False)
+    state = server.Server(simulate.SimulatedBackend(display), defaults)
+    path = os.path.join(tempfile.mkdtemp(), 'server.sock')
+    unix = server.listen(state, path, None)
+    thread = threading.Thread(target=unix.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        # before the first probe, e.g. while the hotplug watcher starts
+        ok, output = client.request('status', path=path)
+        if not ok or display.probes != 1:
+            raise AssertionError("status of a fresh server failed: " + output)
+
+        ok, output = client.request('apply', path=path)
+        if not ok or display.modesets != 1:
+            raise AssertionError("apply failed: " + output)
+        probes = display.probes
+
+        results = {}
+        rows = []
+        for command in ('status', 'plan', 'print-modes'):
+            seconds = best_of(lambda: client.request(command, path=path), number=10)
+            results['server/' + command] = seconds
+            rows.append((command, "{:.3f} ms".format(1000 * seconds)))
+        report(rows, ("command", "round trip"))
+        if display.probes != probes:
+            raise AssertionError("queries probed the display again")
+        if results['server/status'] > STATUS_BUDGET:
+            raise AssertionError("status takes {:.1f} ms".format(1000 * results['server/status']))
+
+        replies = []
+        def query(command):
+            replies.append(client.request(command, path=path))
+        threads = [threading.Thread(target=query, args=(c,)) for c in ['status', 'plan', 'apply'] * 4]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        failed = [output for ok, output in replies if not ok]
+        if failed or len(replies) != len(threads):
+            raise AssertionError("concurrent clients failed: {}".format(failed))
+        return results
+    finally:
+        unix.shutdown()
+        unix.server_close()
+
+# What parse_xrandr must make of each fixture, output by output: name,
+# connected, current mode and position, number of modes, preferred mode and
+# the start of the sha1 of the EDID, cross-checked against the fixture text
+GOLDEN_SCREENS = {
+    'laptop': [
+        ('eDP-1', True, (1920, 1080, 60.02), (0, 0), 82, (1920, 1080, 60.02), 'cfe8e3307dc4'),
+        ('DP-1', False, None, None, 0, None, None),
+        ('HDMI-1', False, None, None, 0, None, None),
+        ('DP-2', False, None, None, 0, None, None),
+        ('HDMI-2', False, None, None, 0, None, None),
+    ],
+    'laptop-dock': [
+        ('eDP-1', True, (1920, 1080, 60.02), (0, 0), 82, (1920, 1080, 60.02), 'cfe8e3307dc4'),
+        ('DP-1', False, None, None, 0, None, None),
+        ('HDMI-1', False, None, None, 0, None, None),
+        ('DP-2', False, None, None, 0, None, None),
+        ('HDMI-2', False, None, None, 0, None, None),
+        ('DP-2-1', True, None, None, 30, (1920, 1200, 59.95), '146913c2ed2e'),
+        ('DP-2-2', True, None, None, 42, (3840, 2160, 60.0), '56091d317377'),
+        ('DP-2-3', False, None, None, 0, None, None),
+    ],
+    'laptop-docked': [
+        ('eDP-1', True, (1920, 1080, 60.02), (0, 1080), 82, (1920, 1080, 60.02), 'cfe8e3307dc4'),
+        ('DP-1', False, None, None, 0, None, None),
+        ('HDMI-1', False, None, None, 0, None, None),
+        ('DP-2', False, None, None, 0, None, None),
+        ('HDMI-2', False, None, None, 0, None, None),
+        ('DP-2-1', True, (1920, 1200, 59.95), (1920, 960), 30, (1920, 1200, 59.95), '146913c2ed2e'),
+        ('DP-2-2', True, (3840, 2160, 60.0), (3840, 0), 42, (3840, 2160, 60.0), '56091d317377'),
+        ('DP-2-3', False, None, None, 0, None, None),
+    ],
+    'mst-hub': [
+        ('eDP-1', True, (1920, 1080, 60.02), (0, 0), 82, (1920, 1080, 60.02), 'cfe8e3307dc4'),
+        ('DP-1', False, None, None, 0, None, None),
+        ('HDMI-1', False, None, None, 0, None, None),
+        ('DP-1-1', True, None, None, 23, (1920, 1080, 60.0), 'b1feabcdb110'),
+        ('DP-1-2', True, None, None, 23, (1920, 1080, 60.0), '3b3d3ea50483'),
+        ('DP-1-3', True, None, None, 23, (1920, 1080, 60.0), '97df7ee0e77a'),
+    ],
+}
+
+def check_golden(name, screens):
+    """Compare parsed screens with GOLDEN_SCREENS[name]"""
+    import hashlib
+    def mode(m):
+        return m and (m.width, m.height, m.freq)
+    got = []
+    for s in screens:
+        preferred = [m for m in s.supported_modes if m.preferred]
+        got.append((s.name, s.is_connected(), mode(s.curr_mode), s.curr_position, len(s.supported_modes),
+                    mode(preferred[0]) if preferred else None,
+                    s.edid and hashlib.sha1(s.edid).hexdigest()[:12]))
+    for expected, parsed in zip(GOLDEN_SCREENS[name], got):
+        if expected != parsed:
+            raise AssertionError("{}: parsed {}, expected {}".format(name, parsed, expected))
+    if len(got) != len(GOLDEN_SCREENS[name]):
+        raise AssertionError("{}: parsed {} outputs, expected {}".format(name, len(got), len(GOLDEN_SCREENS[name])))
+
+def corpora():
+    import corpus
+    result = [(name, corpus.load_fixture(name)) for name in corpus.fixtures()]
+    for connectors, modes in SYNTHETIC_CORPORA:
+        result.append(("synthetic-{}x{}".format(connectors, modes), corpus.synthetic_verbose(connectors, modes)))
+    return result
+
+def bench_stages(args):
+    """Time each stage of a run on every corpus, probing excluded, after
+    checking what the fixtures parse to"""
+    import tempfile
+    import auto
+    import edid
+    import randr
+    try:
+        import gnome_monitors
+    except ImportError:
+        gnome_monitors = None
+
+    monitors_xml = os.path.join(tempfile.mkdtemp(), 'monitors.xml')
+
+    def fresh_monitors_xml():
+        with open(monitors_xml, 'w') as f:
+            f.write('<monitors version="1">\n</monitors>\n')
+
+    def fresh_screens_all(lines):
+        # drop the mode tables of the last run, as a new process would
+        randr._mode_tables.clear()
+        return randr.parse_xrandr(lines)
+
+    def fresh_screens(lines):
+        return [s for s in fresh_screens_all(lines) if s.is_connected()]
+
+    def planned(lines):
+        cs = fresh_screens(lines)
+        auto.plan(cs, auto.EXTENAL_ON_RIGHT, auto.DENSITY_ANY, auto.ALIGN_BOTTOM, 0)
+        return cs
+
+    def save(cs):
+        fresh_monitors_xml()
+        gnome_monitors.save(cs, monitors_xml)
+
+    results = {}
+    rows = []
+    for name, lines in corpora():
+        if name in GOLDEN_SCREENS:
+            check_golden(name, fresh_screens_all(lines))
+        edids = [bytes.fromhex(block) for block in edid_blocks(lines)]
+        stages = [
+            ('parse', best_of(lambda: randr.parse_xrandr(lines))),
+            ('edid', best_of(lambda: [edid.Edid(e) for e in edids])),
+            ('select', best_of(lambda cs: auto.plan(cs, auto.EXTENAL_ON_RIGHT, auto.DENSITY_ANY, auto.ALIGN_BOTTOM, 0),
+                               setup=lambda: fresh_screens(lines))),
+            ('build_cmd', best_of(lambda cs: [s.build_cmd(True) for s in cs], setup=lambda: planned(lines))),
+        ]
+        if gnome_monitors is not None:
+            stages.append(('gnome_save', best_of(save, setup=lambda: planned(lines))))
+        for stage, seconds in stages:
+            results[stage + '/' + name] = seconds
+        rows.append([name] + ["{:.3f} ms".format(1000 * seconds) for _, seconds in stages])
+    report(rows, ["corpus"] + [stage for stage, _ in stages])
+    if gnome_monitors is None:
+        print("(lxml is not installed, gnome_save skipped)")
+    return results
+
+def edid_blocks(lines):
+    """Hex text of the EDIDs in xrandr --verbose output, extensions included"""
+    blocks = []
+    for i, line in enumerate(lines):
+        if line.strip() == "EDID:":
+            hex_lines = []
+            for l in lines[i + 1:]:
+                if len(l.strip()) != 32:
+                    break
+                hex_lines.append(l.strip())
+            blocks.append("".join(hex_lines))
+    return blocks
+
+def calibrate():
+    """Seconds of a fixed pure python loop, the unit of baseline timings"""
+    data = [(i * 7919) % 10007 for i in range(2000)]
+    return best_of(lambda: sorted(data, key=lambda x: (x % 7, x)), repeat=20)
+
+def load_baseline(path):
+    """Timings in calibration loops, empty when path is missing or older"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        data = json.load(f)
+    return data.get('timings', {}) if 'calibration' in data else {}
+
+def save_baseline(path, results, calibration):
+    timings = load_baseline(path)
+    timings.update((key, seconds / calibration) for key, seconds in results.items())
+    with open(path, 'w') as f:
+        json.dump({'calibration': calibration, 'timings': timings}, f, indent=1, sort_keys=True)
+
+def compare(results, baseline, threshold, calibration, quiet=False):
+    """Print timings against the baseline, in seconds on this machine,
+    returns the regressed keys"""
+    regressions = []
+    rows = []
+    for key in sorted(results):
+        if key not in baseline:
+            rows.append((key, "{:.3f} ms".format(1000 * results[key]), "-", "new"))
+            continue
+        expected = baseline[key] * calibration
+        ratio = results[key] / expected if expected else 1.0
+        regressed = ratio > threshold and results[key] - expected > NOISE_FLOOR * calibration
+        if regressed:
+            regressions.append(key)
+        rows.append((key, "{:.3f} ms".format(1000 * results[key]), "{:.3f} ms".format(1000 * expected),
+                     "{:.2f}x{}".format(ratio, " REGRESSION" if regressed else "")))
+    if not quiet:
+        report(rows, ("timing", "now", "baseline", "ratio"))
+    return regressions
+
+def start_xvfb(width=1920, height=1080):
+    """An Xvfb server on a free display, returns (process, display name)"""
+    read, write = os.pipe()
+    xvfb = subprocess.Popen(['Xvfb', '-displayfd', str(write), '-screen', '0', '{}x{}x24'.format(width, height),
+                             '-nolisten', 'tcp'], pass_fds=(write,),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.close(write)
+    with os.fdopen(read) as f:
+        number = f.readline().strip()
+    if not number:
+        xvfb.wait()
+        raise AssertionError("Xvfb did not start")
+    return xvfb, ':' + number
+
+def add_xvfb_modes(name, modes):
+    """Add (width, height, rate) modes to the outputs of Xvfb display name"""
+    from Xlib import display
+    d = display.Display(name)
+    try:
+        root = d.screen().root
+        outputs = root.xrandr_get_screen_resources().outputs
+        for width, height, rate in modes:
+            h_total, v_total = width + 160, height + 30
+            mode_name = "{}x{}".format(width, height)
+            info = dict(id=0, width=width, height=height, dot_clock=int(h_total * v_total * rate),
+                        h_sync_start=width + 48, h_sync_end=width + 80, h_total=h_total, h_skew=0,
+                        v_sync_start=height + 3, v_sync_end=height + 8, v_total=v_total,
+                        name_length=len(mode_name), flags=0)
+            mode = root.xrandr_create_mode(info, mode_name).mode
+            for output in outputs:
+                d.xrandr_add_output_mode(output, mode)
+        d.sync()
+    finally:
+        d.close()
+
+def bench_xlib(args):
+    """Probe and apply round trips of the xlib backend and of the two-phase
+    xrandr apply against Xvfb, skipped without Xvfb or python-xlib"""
+    import shutil
+    import randr
+    import xlibrandr
+    if shutil.which('Xvfb') is None:
+        print("(Xvfb is not installed, skipped)")
+        return {}
+    import importlib.util
+    if importlib.util.find_spec('Xlib') is None:
+        print("(python-xlib is not installed, skipped)")
+        return {}
+
+    def connected(screens):
+        cs = [s for s in screens if s.is_connected()]
+        if len(cs) != 1:
+            raise AssertionError("Xvfb has {} connected outputs, expected one".format(len(cs)))
+        return cs[0]
+
+    def current(name):
+        probe = xlibrandr.XlibBackend(name)
+        try:
+            s = connected(probe.screens())
+            return s.curr_mode and s.curr_mode.resolution()
+        finally:
+            probe.close()
+
+    def switch(backend, resolution):
+        screens = backend.screens()
+        s = connected(screens)
+        s.set_enabled(True)
+        s.set_mode([m for m in s.modes() if m.resolution() == resolution][0])
+        s.set_position((0, 0))
+        return backend.apply(screens, False)
+
+    xvfb, name = start_xvfb()
+    rows = []
+    try:
+        add_xvfb_modes(name, [(1280, 720, 60.0), (1024, 768, 60.0)])
+        backend = xlibrandr.XlibBackend(name)
+        try:
+            s = connected(backend.screens())
+            if s.curr_mode is None or s.curr_mode.resolution() != (1920, 1080):
+                raise AssertionError("the xlib backend probed {} instead of the 1920x1080 of Xvfb".format(s.curr_mode))
+            if not set([(1280, 720), (1024, 768)]) <= set(m.resolution() for m in s.modes()):
+                raise AssertionError("the xlib backend did not probe the added modes")
+            rows.append(("xlib probe", "{:.2f} ms".format(1000 * best_of(backend.screens))))
+
+            # shrinking takes the CRTC off before the screen is resized
+            disable, enable, size = switch(backend, (1280, 720))
+            if not disable or not enable or size != (1280, 720) or current(name) != (1280, 720):
+                raise AssertionError("the xlib backend did not switch to 1280x720 in two phases")
+            # growing does not
+            disable, enable, size = switch(backend, (1920, 1080))
+            if disable or size != (1920, 1080) or current(name) != (1920, 1080):
+                raise AssertionError("the xlib backend did not switch back to 1920x1080")
+            if switch(backend, (1920, 1080)) is not None:
+                raise AssertionError("the xlib backend reapplied an unchanged layout")
+        finally:
+            backend.close()
+
+        if shutil.which('xrandr') is None:
+            print("(xrandr is not installed, the two-phase xrandr apply is skipped)")
+        else:
+            backend = randr.backend(randr.BACKEND_XRANDR, randr.PROBE_XRANDR, name, transactional=True)
+            rows.append(("xrandr probe", "{:.2f} ms".format(1000 * best_of(backend.screens))))
+            for resolution in ((1024, 768), (1920, 1080)):
+                if not switch(backend, resolution) or current(name) != resolution:
+                    raise AssertionError("the transactional xrandr apply did not switch to {}x{}".format(*resolution))
+    finally:
+        xvfb.terminate()
+        xvfb.wait()
+    report(rows, ("Xvfb", "time"))
+
+BENCHMARKS = {
+    'daemon': bench_daemon,
+    'displays': bench_displays,
+    'edid': bench_edid,
+    'gnome': bench_gnome,
+    'imports': bench_imports,
+    'memory': bench_memory,
+    'modes': bench_modes,
+    'plans': bench_plans,
+    'pnp': bench_pnp,
+    'probe': bench_probe,
+    'schedule': bench_schedule,
+    'server': bench_server,
+    'solver': bench_solver,
+    'stages': bench_stages,
+    'xlib': bench_xlib,
+}
+
+if(__name__ == "__main__"):
+
+    parser = argparse.ArgumentParser(description='Run offline benchmarks')
+    parser.add_argument("benchmarks", help='benchmarks to run ['+", ".join(sorted(BENCHMARKS))+'], all by default', nargs='*')
+    parser.add_argument("--baseline", help='baseline timings ['+BASELINE_FILE+']', default = BASELINE_FILE, type=str)
+    parser.add_argument("--save-baseline", help='store the timings as the new baseline', action='store_true')
+    parser.add_argument("--threshold", help='slowdown against the baseline that fails the run [1.5]', default = 1.5, type=float)
+
+    args = parser.parse_args()
+
+    # keep the caches of the user out of it
+    import tempfile
+    import cache
+    cache.CACHE_DIR = tempfile.mkdtemp()
+
+    results = {}
+    # benchmark of each timing, to rerun it
+    produced_by = {}
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: "+name)
+        print("==", name)
+        timings = BENCHMARKS[name](args) or {}
+        results.update(timings)
+        produced_by.update((key, name) for key in timings)
+
+    calibration = calibrate()
+    if results and args.save_baseline:
+        save_baseline(args.baseline, results, calibration)
+        print("Saved baseline to", args.baseline)
+    elif results:
+        baseline = load_baseline(args.baseline)
+        regressions = compare(results, baseline, args.threshold, calibration, quiet=True)
+        for _ in range(CONFIRM_RUNS):
+            if not regressions:
+                break
+            for name in sorted(set(produced_by[key] for key in regressions)):
+                print("== {} (rerun)".format(name))
+                for key, seconds in (BENCHMARKS[name](args) or {}).items():
+                    results[key] = min(seconds, results.get(key, seconds))
+            calibration = min(calibration, calibrate())
+            regressions = compare(results, baseline, args.threshold, calibration, quiet=True)
+        print("== baseline (calibration loop {:.3f} ms)".format(1000 * calibration))
+        if compare(results, baseline, args.threshold, calibration):
+            sys.exit(1)
@@ -0,0 +1,152 @@
+import json
+import os
+import os.path
+import threading
+from collections import OrderedDict
+
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'auto-randr')
+
+EDID_CACHE_FILE = 'edid.json'
+EDID_CACHE_SIZE = 64
+
+PLAN_CACHE_FILE = 'plans.json'
+PLAN_CACHE_SIZE = 32
+
+# Connector digests and EDIDs of the last probe, per display
+PROBE_CACHE_FILE = 'probes.json'
+PROBE_CACHE_SIZE = 16
+
+class PersistentLRU(object):
+    """Bounded LRU mapping of strings to json values, stored in a file
+
+    Entries written by another version are discarded on load. It can be
+    shared by threads, see auto.py --displays.
+    """
+    def __init__(self, path, version, max_entries):
+        super(PersistentLRU, self).__init__()
+        self.path = path
+        self.version = version
+        self.max_entries = max_entries
+        self.entries = None
+        self.dirty = False
+        self.lock = threading.RLock()
+
+    def load(self):
+        with self.lock:
+            self._load()
+
+    def _load(self):
+        if self.entries is not None:
+            return
+        self.entries = OrderedDict()
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict) or data.get('version') != self.version:
+            return
+        for key, value in data.get('entries', []):
+            self.entries[key] = value
+
+    def get(self, key):
+        with self.lock:
+            self._load()
+            value = self.entries.get(key)
+            if value is not None:
+                # the new order is only written with the next put or
+                # eviction, a hit alone does not rewrite the file
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self._load()
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self.prune(self.max_entries)
+            self.dirty = True
+
+    def prune(self, max_entries):
+        """Evict least recently used entries, returns how many"""
+        with self.lock:
+            self._load()
+            evicted = 0
+            while len(self.entries) > max_entries:
+                self.entries.popitem(last=False)
+                evicted += 1
+            if evicted:
+                self.dirty = True
+            return evicted
+
+    def items(self):
+        with self.lock:
+            self._load()
+            return list(self.entries.items())
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            data = {'version': self.version, 'entries': list(self.entries.items())}
+            try:
+                write_atomic(self.path, json.dumps(data).encode('utf-8'))
+            except OSError:
+                # A cache that can not be written is just a slower run
+                return
+            self.dirty = False
+
+    def __len__(self):
+        with self.lock:
+            self._load()
+            return len(self.entries)
+
+def write_atomic(path, data, mode=None):
+    """Replace path with data, readers see either the old or the new file,
+    also after a crash: data and directory entry are synced to disk
+
+    The new file gets permission bits mode, 0600 by default.
+    """
+    import tempfile
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            if mode is not None:
+                os.fchmod(f.fileno(), mode)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    fd = os.open(directory, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def open_cache(filename, version, max_entries):
+    """The cache stored in filename, shared by all users in this process"""
+    with _caches_lock:
+        if filename not in _caches:
+            _caches[filename] = PersistentLRU(os.path.join(CACHE_DIR, filename), version, max_entries)
+        return _caches[filename]
+
+def edid_cache():
+    import edid
+    return open_cache(EDID_CACHE_FILE, edid.PARSER_VERSION, EDID_CACHE_SIZE)
+
+def plan_cache(version):
+    return open_cache(PLAN_CACHE_FILE, version, PLAN_CACHE_SIZE)
+
+def probe_cache(version):
+    return open_cache(PROBE_CACHE_FILE, version, PROBE_CACHE_SIZE)
@@ -0,0 +1,72 @@
+"""Thin client of the auto.py server (python auto.py --server)
+
+    python client.py status
+    python client.py plan setup=optimal
+    python client.py apply density=hd force=1
+    python client.py print-modes
+
+A request is one line, the command and its key=value options. The reply is
+"ok" or "error", then the output of the command, until the server closes
+the connection. This module only imports what a round trip needs, the
+server keeps everything else warm.
+"""
+import os
+import socket
+import sys
+
+COMMANDS = ('status', 'plan', 'apply', 'print-modes')
+
+# Seconds to wait for a reply, an apply may wait for the scheduler and xrandr
+TIMEOUT = 60.0
+
+def socket_path(display=None):
+    """The socket of the server of display, $DISPLAY by default, in the
+    directory of scheduler.runtime_dir()"""
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        directory = os.path.join(runtime, 'auto-randr')
+    else:
+        directory = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'auto-randr')
+    if display is None:
+        display = os.environ.get('DISPLAY', '')
+    name = ''.join(c if c.isalnum() or c in '.-' else '_' for c in display) or 'default'
+    return os.path.join(directory, 'server-{}.sock'.format(name))
+
+def request(command, options=(), path=None, timeout=TIMEOUT):
+    """Send command with options, a list of "key=value", to the server
+
+    Returns (ok, output). Raises OSError when no server listens on path.
+    """
+    if path is None:
+        path = socket_path()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall((" ".join([command] + list(options)) + "\n").encode('utf-8'))
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    status, _, output = b"".join(chunks).decode('utf-8').partition("\n")
+    return status == 'ok', output
+
+def main(argv):
+    path = None
+    if argv[:1] == ['--socket'] and len(argv) > 1:
+        path = argv[1]
+        argv = argv[2:]
+    if not argv or argv[0] not in COMMANDS:
+        sys.stderr.write("usage: client.py [--socket PATH] {} [key=value ...]\n".format("|".join(COMMANDS)))
+        return 2
+    try:
+        ok, output = request(argv[0], argv[1:], path)
+    except OSError as e:
+        sys.stderr.write("No server on {}: {}\n".format(path or socket_path(), e))
+        return 2
+    sys.stdout.write(output)
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
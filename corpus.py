@@ -0,0 +1,391 @@
+"""Generated xrandr --verbose outputs, for benchmarks and replays
+
+    python corpus.py 8 100 > out.txt     # 8 connectors, 100 modes each
+    python corpus.py fixtures            # regenerate generated/
+
+The fixtures in generated/ model common setups (a laptop, a dock, an MST
+hub) with synthetic EDIDs; they are not captures of real hardware.
+"""
+import os
+import os.path
+import random
+import struct
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(DIR, 'generated')
+
+RESOLUTIONS = [
+    (640, 480), (720, 400), (800, 600), (1024, 768), (1152, 864), (1280, 720),
+    (1280, 800), (1280, 1024), (1366, 768), (1440, 900), (1600, 900), (1600, 1200),
+    (1680, 1050), (1920, 1080), (1920, 1200), (2560, 1080), (2560, 1440), (2560, 1600),
+    (3440, 1440), (3840, 1600), (3840, 2160), (5120, 2880),
+]
+RATES = [23.98, 24.0, 25.0, 29.97, 30.0, 48.0, 50.0, 59.94, 60.0, 75.0, 100.0, 120.0, 144.0, 165.0, 240.0]
+
+def fixtures():
+    """Names of the generated outputs in generated/"""
+    return sorted(f[:-4] for f in os.listdir(FIXTURES_DIR) if f.endswith('.txt'))
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name + '.txt'), 'r') as f:
+        return f.read().split('\n')
+
+def synthetic_edid(vendor="DEL", product=0xa0c4, serial=1, width_cm=60, height_cm=34, name="SYNTHETIC",
+                   preferred=None, extensions=()):
+    """A valid EDID, a 128 byte base block followed by extensions
+
+    :preferred: (width, height, rate) of a detailed timing in the first
+        descriptor, the name moves to the second one
+    :extensions: 128 byte extension blocks, see cea_extension() and
+        displayid_extension()
+    """
+    edid = bytearray(128)
+    edid[0:8] = b'\x00\xff\xff\xff\xff\xff\xff\x00'
+    manufacturer = ((ord(vendor[0]) - 64) << 10) | ((ord(vendor[1]) - 64) << 5) | (ord(vendor[2]) - 64)
+    struct.pack_into(">HHI", edid, 8, manufacturer, product, serial)
+    edid[16:24] = bytes([1, 30, 1, 4, 0xa5, width_cm, height_cm, 0x78])
+    edid[38:54] = b'\x01' * 16
+    # monitor name descriptor, the others are dummies
+    descriptors = [b'\x00\x00\x00\xfc\x00' + (name.encode('cp437')[:12] + b'\n').ljust(13, b' ')]
+    if preferred is not None:
+        descriptors.insert(0, detailed_timing(*preferred))
+    for i, offset in enumerate((54, 72, 90, 108)):
+        edid[offset:offset + 18] = descriptors[i] if i < len(descriptors) else b'\x00\x00\x00\x10' + b'\x00' * 14
+    edid[126] = len(extensions)
+    edid[127] = -sum(edid[:127]) % 256
+    return bytes(edid) + b''.join(extensions)
+
+def _blanking(width, height, rate):
+    # reduced blanking, as for digital panels
+    h_blank = 160
+    v_blank = max(3, int(round(460e-6 * rate * height / (1 - 460e-6 * rate))))
+    return h_blank, v_blank
+
+def detailed_timing(width, height, rate):
+    """An 18 byte detailed timing descriptor"""
+    h_blank, v_blank = _blanking(width, height, rate)
+    clock = int(round((width + h_blank) * (height + v_blank) * rate / 10000.0))
+    d = bytearray(18)
+    struct.pack_into("<H", d, 0, clock)
+    d[2], d[3], d[4] = width & 0xff, h_blank & 0xff, (width >> 8) << 4 | h_blank >> 8
+    d[5], d[6], d[7] = height & 0xff, v_blank & 0xff, (height >> 8) << 4 | v_blank >> 8
+    d[17] = 0x18
+    return bytes(d)
+
+def _checksummed(block):
+    block[127] = -sum(block[:127]) % 256
+    return bytes(block)
+
+def cea_extension(vics=(), timings=()):
+    """A CEA-861 extension block with short video descriptors for vics and
+    detailed timing descriptors for (width, height, rate) timings"""
+    block = bytearray(128)
+    block[0:2] = b'\x02\x03'
+    svds = bytes([2 << 5 | len(vics)]) + bytes(vics)
+    block[2] = 4 + len(svds)
+    block[4:4 + len(svds)] = svds
+    offset = block[2]
+    for t in timings:
+        block[offset:offset + 18] = detailed_timing(*t)
+        offset += 18
+    return _checksummed(block)
+
+def displayid_extension(timings=(), tile=None):
+    """A DisplayID extension block with type I timings for (width, height,
+    rate) and a tiled display block for tile, a (columns, rows, column, row)
+    tuple of a tile of the first timing's size"""
+    payload = b''
+    if timings:
+        data = b''
+        for i, (width, height, rate) in enumerate(timings):
+            h_blank, v_blank = _blanking(width, height, rate)
+            clock = int(round((width + h_blank) * (height + v_blank) * rate / 10000.0))
+            d = bytearray(20)
+            d[0:3] = struct.pack("<I", clock - 1)[:3]
+            d[3] = 0x80 if i == 0 else 0
+            struct.pack_into("<HHHHHHHH", d, 4, width - 1, h_blank - 1, 47, 31, height - 1, v_blank - 1, 2, 4)
+            data += bytes(d)
+        payload += bytes([0x03, 0, len(data)]) + data
+    if tile is not None:
+        columns, rows, column, row = tile
+        width, height = timings[0][:2]
+        data = bytearray(22)
+        data[1] = (columns - 1) << 4 | (rows - 1)
+        data[2] = column << 4 | row
+        struct.pack_into("<HH", data, 4, width - 1, height - 1)
+        payload += bytes([0x12, 0, len(data)]) + bytes(data)
+    block = bytearray(128)
+    block[0:5] = bytes([0x70, 0x12, len(payload), 0, 0])
+    block[5:5 + len(payload)] = payload
+    # the DisplayID section has its own checksum before the block's
+    block[5 + len(payload)] = -sum(block[1:5 + len(payload)]) % 256
+    return _checksummed(block)
+
+class Output(object):
+    """An output as xrandr --verbose prints it
+
+    :modes: list of (width, height, rate), the first one is preferred
+    :current: index of the current mode, None when the output is off
+    :scale: (x, y) of xrandr --scale
+
+    """
+    def __init__(self, name, edid=None, modes=(), current=None, position=(0, 0), primary=False, scale=(1.0, 1.0)):
+        super(Output, self).__init__()
+        self.name = name
+        self.edid = edid
+        self.modes = list(modes)
+        self.current = current
+        self.position = position
+        self.primary = primary
+        self.scale = scale
+
+    def size(self):
+        """Size of the current mode on the screen, scaled"""
+        width, height, _ = self.modes[self.current]
+        return int(round(width * self.scale[0])), int(round(height * self.scale[1]))
+
+    def lines(self, mode_id):
+        connected = self.edid is not None
+        header = [self.name, "connected" if connected else "disconnected"]
+        if self.primary:
+            header.append("primary")
+        if self.current is not None:
+            width, height = self.size()
+            header.append("{}x{}+{}+{} (0x{:x}) normal".format(width, height, self.position[0], self.position[1], mode_id + self.current))
+        header.append("(normal left inverted right x axis y axis)")
+        if connected:
+            header.append("{}mm x {}mm".format(self.edid[21] * 10, self.edid[22] * 10))
+
+        lines = [" ".join(header),
+                 "\tIdentifier: 0x{:x}".format(0x40 + mode_id % 0x40),
+                 "\tTimestamp:  1234567",
+                 "\tSubpixel:   unknown",
+                 "\tClones:    ",
+                 "\tCRTCs:      0 1 2",
+                 "\tTransform:  {:.6f} 0.000000 0.000000".format(self.scale[0]),
+                 "\t            0.000000 {:.6f} 0.000000".format(self.scale[1]),
+                 "\t            0.000000 0.000000 1.000000",
+                 "\t           filter: "]
+        if connected:
+            lines.append("\tEDID: ")
+            text = self.edid.hex()
+            lines.extend("\t\t" + text[i:i + 32] for i in range(0, len(text), 32))
+        lines.extend(["\tlink-status: Good ",
+                      "\t\tsupported: Good, Bad",
+                      "\tnon-desktop: 0 ",
+                      "\t\trange: (0, 1)"])
+
+        for i, (width, height, rate) in enumerate(self.modes):
+            htotal = width + 160
+            vtotal = height + 35
+            clock = htotal * vtotal * rate / 1e6
+            flags = (" *current" if i == self.current else "") + (" +preferred" if i == 0 else "")
+            lines.append("  {}x{} (0x{:x}) {:.3f}MHz +HSync -VSync{}".format(width, height, mode_id + i, clock, flags))
+            lines.append("        h: width  {} start {} end {} total {} skew    0 clock  {:.2f}KHz".format(
+                width, width + 48, width + 80, htotal, vtotal * rate / 1000))
+            lines.append("        v: height {} start {} end {} total {}           clock  {:.2f}Hz".format(
+                height, height + 3, height + 9, vtotal, rate))
+        return lines
+
+    def current_lines(self):
+        """Lines of xrandr --current, rates grouped by resolution"""
+        connected = self.edid is not None
+        header = [self.name, "connected" if connected else "disconnected"]
+        if self.primary:
+            header.append("primary")
+        if self.current is not None:
+            width, height = self.size()
+            header.append("{}x{}+{}+{}".format(width, height, self.position[0], self.position[1]))
+        header.append("(normal left inverted right x axis y axis)")
+        if connected:
+            header.append("{}mm x {}mm".format(self.edid[21] * 10, self.edid[22] * 10))
+
+        rates = {}
+        order = []
+        for i, (width, height, rate) in enumerate(self.modes):
+            if (width, height) not in rates:
+                rates[(width, height)] = []
+                order.append((width, height))
+            flags = ("*" if i == self.current else "") + ("+" if i == 0 else "")
+            rates[(width, height)].append("{:.2f}{}".format(rate, flags))
+        lines = [" ".join(header)]
+        for width, height in order:
+            lines.append("   {:<13} {}".format("{}x{}".format(width, height), "  ".join(rates[(width, height)])))
+        return lines
+
+def verbose_output(outputs):
+    """Lines of xrandr --verbose for a list of Outputs"""
+    width = max([o.position[0] + o.size()[0] for o in outputs if o.current is not None] or [0])
+    height = max([o.position[1] + o.size()[1] for o in outputs if o.current is not None] or [0])
+    lines = ["Screen 0: minimum 320 x 200, current {} x {}, maximum 16384 x 16384".format(width, height)]
+    mode_id = 0x40
+    for o in outputs:
+        lines.extend(o.lines(mode_id))
+        mode_id += len(o.modes)
+    lines.append("")
+    return lines
+
+# Modes of the monitors in the generated fixtures, as their EDIDs and
+# drivers list them
+_LAPTOP_MODES = [
+    (1920, 1080, 60.02), (1920, 1080, 59.93), (1920, 1080, 48.0), (1680, 1050, 59.95),
+    (1680, 1050, 59.88), (1600, 1024, 60.17), (1400, 1050, 59.98), (1600, 900, 59.99),
+    (1600, 900, 59.94), (1600, 900, 59.95), (1600, 900, 59.82), (1280, 1024, 60.02),
+    (1440, 900, 59.89), (1400, 900, 59.96), (1400, 900, 59.88), (1280, 960, 60.0),
+    (1440, 810, 60.0), (1440, 810, 59.97), (1368, 768, 59.88), (1368, 768, 59.85),
+    (1280, 800, 59.99), (1280, 800, 59.97), (1280, 800, 59.81), (1280, 800, 59.91),
+    (1280, 720, 60.0), (1280, 720, 59.99), (1280, 720, 59.86), (1280, 720, 59.74),
+    (1024, 768, 60.04), (1024, 768, 60.0), (960, 720, 60.0), (928, 696, 60.05),
+    (896, 672, 60.01), (1024, 576, 59.95), (1024, 576, 59.96), (1024, 576, 59.9),
+    (1024, 576, 59.82), (960, 600, 59.93), (960, 600, 60.0), (960, 540, 59.96),
+    (960, 540, 59.99), (960, 540, 59.63), (960, 540, 59.82), (800, 600, 60.0),
+    (800, 600, 60.32), (800, 600, 56.25), (840, 525, 60.01), (840, 525, 59.88),
+    (864, 486, 59.92), (864, 486, 59.57), (700, 525, 59.98), (800, 450, 59.95),
+    (800, 450, 59.82), (640, 512, 60.02), (700, 450, 59.96), (700, 450, 59.88),
+    (640, 480, 60.0), (640, 480, 59.94), (720, 405, 59.51), (720, 405, 58.99),
+    (684, 384, 59.88), (684, 384, 59.85), (640, 400, 59.88), (640, 400, 59.98),
+    (640, 360, 59.86), (640, 360, 59.83), (640, 360, 59.84), (640, 360, 59.32),
+    (512, 384, 60.0), (512, 288, 60.0), (512, 288, 59.92), (480, 270, 59.63), (480, 270, 59.82),
+    (400, 300, 60.32), (400, 300, 56.34), (432, 243, 59.92), (432, 243, 59.57),
+    (320, 240, 60.05), (360, 202, 59.51), (360, 202, 59.13), (320, 180, 59.84),
+    (320, 180, 59.32),
+]
+_U2415_MODES = [
+    (1920, 1200, 59.95), (1920, 1080, 60.0), (1920, 1080, 59.94), (1920, 1080, 50.0),
+    (1600, 1200, 60.0), (1680, 1050, 59.95), (1280, 1024, 75.02), (1280, 1024, 60.02),
+    (1280, 960, 60.0), (1152, 864, 75.0), (1280, 720, 60.0), (1280, 720, 59.94),
+    (1280, 720, 50.0), (1024, 768, 75.03), (1024, 768, 70.07), (1024, 768, 60.0),
+    (832, 624, 74.55), (800, 600, 75.0), (800, 600, 72.19), (800, 600, 60.32),
+    (800, 600, 56.25), (720, 576, 50.0), (720, 480, 60.0), (720, 480, 59.94), (640, 480, 75.0),
+    (640, 480, 72.81), (640, 480, 66.67), (640, 480, 60.0), (640, 480, 59.94),
+    (720, 400, 70.08),
+]
+_UK850_MODES = [
+    (3840, 2160, 60.0), (3840, 2160, 59.94), (3840, 2160, 50.0), (3840, 2160, 30.0),
+    (3840, 2160, 29.97), (3840, 2160, 25.0), (3840, 2160, 24.0), (3840, 2160, 23.98),
+    (2560, 1440, 59.95), (1920, 1200, 59.95), (1920, 1080, 120.0), (1920, 1080, 119.88),
+    (1920, 1080, 60.0), (1920, 1080, 60.0), (1920, 1080, 50.0), (1920, 1080, 59.94),
+    (1920, 1080, 30.0), (1920, 1080, 25.0), (1920, 1080, 24.0), (1920, 1080, 29.97),
+    (1920, 1080, 23.98), (1600, 1200, 60.0), (1680, 1050, 59.95), (1600, 900, 60.0),
+    (1280, 1024, 75.02), (1280, 1024, 60.02), (1280, 800, 59.91), (1152, 864, 75.0),
+    (1280, 720, 60.0), (1280, 720, 50.0), (1280, 720, 59.94), (1024, 768, 75.03),
+    (1024, 768, 60.0), (800, 600, 75.0), (800, 600, 60.32), (720, 576, 50.0), (720, 480, 60.0),
+    (720, 480, 59.94), (640, 480, 75.0), (640, 480, 60.0), (640, 480, 59.94), (720, 400, 70.08),
+]
+_P2419H_MODES = [
+    (1920, 1080, 60.0), (1920, 1080, 59.94), (1920, 1080, 50.0), (1680, 1050, 59.95),
+    (1280, 1024, 75.02), (1280, 1024, 60.02), (1440, 900, 59.89), (1280, 960, 60.0),
+    (1152, 864, 75.0), (1280, 720, 60.0), (1280, 720, 59.94), (1280, 720, 50.0),
+    (1024, 768, 75.03), (1024, 768, 60.0), (800, 600, 75.0), (800, 600, 60.32),
+    (720, 576, 50.0), (720, 480, 60.0), (720, 480, 59.94), (640, 480, 75.0), (640, 480, 60.0),
+    (640, 480, 59.94), (720, 400, 70.08),
+]
+
+def fixture_outputs():
+    """Outputs of the fixtures, by name: a laptop alone, docked with its two
+    monitors off and on, and on an MST hub with three monitors"""
+    auo = synthetic_edid("AUO", 0x403d, 0, 31, 17, "")
+    u2415 = synthetic_edid("DEL", 0xa0c4, 0x3033304c, 52, 32, "DELL U2415")
+    uk850 = synthetic_edid("GSM", 0x7707, 0x0001f6b1, 60, 34, "LG HDR 4K")
+    p2419h = [synthetic_edid("DEL", 0xd0c1, 0x31415900 + i, 53, 30, "DELL P2419H") for i in range(3)]
+    def laptop(position=(0, 0)):
+        return Output("eDP-1", auo, _LAPTOP_MODES, 0, position, True)
+    unused = [Output("DP-1"), Output("HDMI-1"), Output("DP-2"), Output("HDMI-2")]
+    return {
+        'laptop': [laptop()] + unused,
+        'laptop-dock': [laptop()] + unused + [
+            Output("DP-2-1", u2415, _U2415_MODES, None),
+            Output("DP-2-2", uk850, _UK850_MODES, None),
+            Output("DP-2-3")],
+        'laptop-docked': [laptop((0, 1080))] + unused + [
+            Output("DP-2-1", u2415, _U2415_MODES, 0, (1920, 960)),
+            Output("DP-2-2", uk850, _UK850_MODES, 0, (3840, 0)),
+            Output("DP-2-3")],
+        'mst-hub': [laptop(), Output("DP-1"), Output("HDMI-1")] + [
+            Output("DP-1-{}".format(i + 1), edid, _P2419H_MODES, None) for i, edid in enumerate(p2419h)],
+    }
+
+def write_fixtures(directory=FIXTURES_DIR):
+    """Generate the fixtures into directory"""
+    for name, outputs in fixture_outputs().items():
+        with open(os.path.join(directory, name + '.txt'), 'w') as f:
+            f.write("\n".join(verbose_output(outputs)))
+
+def synthetic_modes(n, rng):
+    """n modes, largest first; long lists repeat modes, like outputs listing
+    the same mode with different timings"""
+    modes = [rng.choice(RESOLUTIONS) + (rng.choice(RATES),) for _ in range(n)]
+    return sorted(modes, key=lambda m: (m[0] * m[1], m[2]), reverse=True)
+
+def synthetic_outputs(connectors, modes, seed=0, disconnected=0):
+    """eDP-1 and connectors - 1 external outputs, all enabled left to right,
+    plus disconnected outputs"""
+    rng = random.Random(seed)
+    outputs = []
+    x = 0
+    for i in range(connectors):
+        if i == 0:
+            name = "eDP-1"
+            edid = synthetic_edid("AUO", 0x123d, 0, 31, 17, "")
+        else:
+            name = "DP-{}".format(i)
+            size = rng.choice([(53, 30), (60, 34), (70, 39), (80, 33)])
+            edid = synthetic_edid(rng.choice(["DEL", "GSM", "SAM", "ACR"]), rng.randrange(1 << 16),
+                                  rng.randrange(1 << 32), size[0], size[1], "MONITOR {}".format(i))
+        output = Output(name, edid, synthetic_modes(modes, rng), 0, (x, 0), i == 0)
+        x += output.modes[0][0]
+        outputs.append(output)
+    for i in range(disconnected):
+        outputs.append(Output("HDMI-{}".format(i + 1)))
+    return outputs
+
+def current_output(outputs):
+    """Lines of xrandr --current for a list of Outputs"""
+    lines = verbose_output(outputs)[:1]
+    for o in outputs:
+        lines.extend(o.current_lines())
+    lines.append("")
+    return lines
+
+def synthetic_verbose(connectors, modes, seed=0, disconnected=1):
+    return verbose_output(synthetic_outputs(connectors, modes, seed, disconnected))
+
+def synthetic_monitors_xml(configurations, seed=0):
+    """A GNOME monitors.xml with configurations for 1 to 3 random monitors
+    each, a quarter of them written by GNOME and the rest by auto randr"""
+    rng = random.Random(seed)
+    lines = ['<monitors version="1">']
+    for i in range(configurations):
+        lines.append('  <configuration>')
+        if i % 4:
+            lines.append('    <!--Generated by auto randr-->')
+        lines.append('    <clone>no</clone>')
+        x = 0
+        for j in range(rng.randint(1, 3)):
+            width, height = rng.choice(RESOLUTIONS)
+            lines.extend([
+                '    <output name="{}">'.format("eDP-1" if j == 0 else "DP-{}".format(j)),
+                '      <vendor>{}</vendor>'.format(rng.choice(["DEL", "GSM", "SAM", "ACR", "AUO"])),
+                '      <product>0x{:04x}</product>'.format(rng.randrange(1 << 16)),
+                '      <serial>0x{:08x}</serial>'.format(rng.randrange(1 << 32)),
+                '      <width>{}</width>'.format(width),
+                '      <height>{}</height>'.format(height),
+                '      <rate>{}</rate>'.format(rng.choice(RATES)),
+                '      <x>{}</x>'.format(x),
+                '      <y>0</y>',
+                '      <rotation>normal</rotation>',
+                '      <reflect_x>no</reflect_x>',
+                '      <reflect_y>no</reflect_y>',
+                '      <primary>{}</primary>'.format("yes" if j == 0 else "no"),
+                '    </output>'])
+            x += width
+        lines.append('  </configuration>')
+    lines.append('</monitors>')
+    return "\n".join(lines) + "\n"
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] == ['fixtures']:
+        write_fixtures()
+    else:
+        print("\n".join(synthetic_verbose(int(sys.argv[1]), int(sys.argv[2]))))
@@ -0,0 +1,147 @@
+"""Configure several X displays at once, e.g. Xvfb or VNC seats
+
+    python auto.py --displays :1,:2,:3 --jobs 4
+
+Every display is probed, planned and applied by its own backend in a thread
+pool, the runs only share the caches. What a run prints is captured per
+display, and one report with the timings and failures of all of them is
+printed at the end.
+"""
+import io
+import sys
+import threading
+import time
+import traceback
+
+import timing
+
+# Threads used when --jobs is not given
+DEFAULT_JOBS = 4
+
+# Phases shown in the report, see auto.main
+REPORT_PHASES = ('probe', 'plan', 'apply')
+
+class DisplayResult(object):
+    """Outcome of configuring one display
+
+    :error: repr of the exception the run failed with, None on success
+    :log: what the run printed
+    """
+    def __init__(self, display, error, log, timings, seconds):
+        super(DisplayResult, self).__init__()
+        self.display = display
+        self.error = error
+        self.log = log
+        self.timings = timings
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return self.error is None
+
+class ThreadStdout(object):
+    """sys.stdout writing to a buffer per thread, when the thread has one"""
+    def __init__(self, stream):
+        super(ThreadStdout, self).__init__()
+        self.stream = stream
+        self.local = threading.local()
+
+    def target(self):
+        return getattr(self.local, 'buffer', None) or self.stream
+
+    def write(self, data):
+        return self.target().write(data)
+
+    def flush(self):
+        self.target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def parse_displays(text):
+    """Display names from ":1,:2", duplicates dropped
+
+    Raises ValueError when there are none.
+    """
+    names = []
+    for name in text.split(','):
+        name = name.strip()
+        if name and name not in names:
+            names.append(name)
+    if not names:
+        raise ValueError('No displays', text)
+    return names
+
+def configure(display, backend, run, args, kwargs, stdout):
+    """Run run for display with its own backend, capturing its output"""
+    buffer = io.StringIO()
+    stdout.local.buffer = buffer
+    timings = timing.Timings(display)
+    error = None
+    start = time.perf_counter()
+    b = None
+    try:
+        b = backend(display)
+        run(*args, backend=b, timings=timings, **kwargs)
+    except Exception as e:
+        error = repr(e)
+        buffer.write(traceback.format_exc())
+    finally:
+        if b is not None:
+            b.close()
+        stdout.local.buffer = None
+    return DisplayResult(display, error, buffer.getvalue(), timings, time.perf_counter() - start)
+
+def run(displays, jobs, backend, *args, main=None, **kwargs):
+    """Configure displays with at most jobs threads
+
+    :backend: returns the randr.Backend of a display name
+    :main: runs one display, auto.main by default, args and kwargs are
+        passed on to it
+
+    Returns the DisplayResults in the order of displays.
+    """
+    if main is None:
+        import auto
+        main = auto.main
+    from concurrent.futures import ThreadPoolExecutor
+
+    stdout = ThreadStdout(sys.stdout)
+    sys.stdout = stdout
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(displays)))) as pool:
+            futures = [pool.submit(configure, d, backend, main, args, kwargs, stdout) for d in displays]
+            return [f.result() for f in futures]
+    finally:
+        sys.stdout = stdout.stream
+
+def _ms(timings, name):
+    p = timings.phases.get(name)
+    return "{:.1f} ms".format(1000 * p.wall) if p is not None else "-"
+
+def report(results, wall=None, out=None):
+    """Print the log of every display, then a table of their timings"""
+    if out is None:
+        out = sys.stdout
+    for r in results:
+        out.write("== {}\n".format(r.display))
+        out.write(r.log if r.log.endswith('\n') or not r.log else r.log + '\n')
+
+    header = ("display", "status") + REPORT_PHASES + ("total",)
+    rows = []
+    for r in results:
+        rows.append((r.display, "ok" if r.ok else "failed")
+                    + tuple(_ms(r.timings, name) for name in REPORT_PHASES)
+                    + ("{:.1f} ms".format(1000 * r.seconds),))
+    widths = [max(len(row[i]) for row in rows + [header]) for i in range(len(header))]
+    out.write("\n")
+    for row in [header] + rows:
+        out.write("  ".join(c.ljust(w) for c, w in zip(row, widths)).rstrip() + "\n")
+
+    failed = [r for r in results if not r.ok]
+    for r in failed:
+        out.write("{} failed: {}\n".format(r.display, r.error))
+    summary = "{} displays, {} failed".format(len(results), len(failed))
+    if wall is not None:
+        summary += ", {:.2f} s".format(wall)
+    out.write(summary + "\n")
@@ -0,0 +1,197 @@
+import hashlib
+import os
+import os.path
+import re
+
+import randr
+import timing
+
+SYSFS_DRM = '/sys/class/drm'
+
+EDID_BLOCK_SIZE = 128
+
+# Connector types the kernel and X drivers spell differently
+CONNECTOR_ALIASES = {
+    'HDMI-A': 'HDMI',
+    'HDMI-B': 'HDMI',
+}
+
+_rxconnector = re.compile(r'^card\d+-(.+)-(\d+)$')
+
+class Connector(object):
+    """A drm connector as seen in /sys/class/drm"""
+    def __init__(self, sysfs_name, path):
+        super(Connector, self).__init__()
+        self.sysfs_name = sysfs_name
+        self.path = path
+        self.status = read_text(os.path.join(path, 'status'))
+        self.edid = read_edid(os.path.join(path, 'edid'))
+        self.modes = read_modes(os.path.join(path, 'modes'))
+
+    def is_connected(self):
+        return self.status == 'connected'
+
+    def key(self):
+        r = re.match(_rxconnector, self.sysfs_name)
+        if not r:
+            return None
+        kind = CONNECTOR_ALIASES.get(r.group(1), r.group(1))
+        return output_key(kind + r.group(2))
+
+    def __str__(self):
+        return '{}: {}, edid: {} bytes, modes: {}'.format(
+            self.sysfs_name,
+            self.status,
+            len(self.edid) if self.edid is not None else 0,
+            len(self.modes))
+
+    __repr__ = __str__
+
+def output_key(name):
+    """Common spelling of sysfs (HDMI-A-1) and xrandr (HDMI-1, HDMI1) names"""
+    return name.replace('-', '')
+
+def read_text(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def read_edid(path):
+    """Read the binary EDID of a connector without copying it around
+
+    Returns a memoryview over the base block and all extension blocks, or None
+    """
+    try:
+        with open(path, 'rb', buffering=0) as f:
+            data = bytearray(os.fstat(f.fileno()).st_size or 32 * EDID_BLOCK_SIZE)
+            size = f.readinto(data)
+    except OSError:
+        return None
+    if size < EDID_BLOCK_SIZE:
+        return None
+    return memoryview(data)[:size]
+
+def read_modes(path):
+    """Resolutions listed in the modes file, interlaced modes skipped"""
+    text = read_text(path)
+    if not text:
+        return []
+    modes = []
+    for line in text.split('\n'):
+        width, _, height = line.partition('x')
+        if width.isdigit() and height.isdigit():
+            modes.append((int(width), int(height)))
+    return modes
+
+def connectors(root=SYSFS_DRM):
+    try:
+        names = sorted(os.listdir(root))
+    except OSError:
+        return []
+    return [Connector(name, os.path.join(root, name)) for name in names
+            if re.match(_rxconnector, name) and os.path.exists(os.path.join(root, name, 'status'))]
+
+def edid_digest(path):
+    """sha1 of the edid file of a connector, None when it is empty
+
+    The kernel keeps the EDID it read on hotplug, reading the file does
+    not touch the DDC bus.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    return hashlib.sha1(data).hexdigest() if data else None
+
+def connector_states(root=SYSFS_DRM):
+    """[connector, status, epoch, EDID digest] of all connectors
+
+    epoch counts the hotplugs of a connector on kernels that export it,
+    None elsewhere. Only there the EDID is hashed, see edid_digest(), to
+    tell apart monitors with the same modes swapped; with an epoch the
+    digest is None, the swap bumps the epoch.
+    """
+    try:
+        names = sorted(os.listdir(root))
+    except OSError:
+        return []
+    states = []
+    for name in names:
+        if not re.match(_rxconnector, name):
+            continue
+        path = os.path.join(root, name)
+        status = read_text(os.path.join(path, 'status'))
+        if status is not None:
+            epoch = read_text(os.path.join(path, 'epoch'))
+            edid = None
+            if status == 'connected' and epoch is None:
+                edid = edid_digest(os.path.join(path, 'edid'))
+            states.append([name, status, epoch, edid])
+    return states
+
+def read_edids(root=SYSFS_DRM):
+    return [c.edid for c in connectors(root) if c.is_connected() and c.edid is not None]
+
+def reconcile(conns, outputs):
+    """Pair xrandr outputs with drm connectors
+
+    Returns a list of (output line, modes, current, connector) in xrandr
+    order, or None when the two views disagree on names, connection state or
+    modes.
+    """
+    by_key = {}
+    for c in conns:
+        key = c.key()
+        if key is None or key in by_key:
+            return None
+        by_key[key] = c
+
+    paired = []
+    for line, modes, connected, current in outputs:
+        c = by_key.pop(output_key(line.split(' ')[0]), None)
+        if c is None or c.is_connected() != connected:
+            return None
+        # X has not caught up with the kernel yet, needs a real reprobe
+        if connected and not set(c.modes) <= set((m[0], m[1]) for m in modes):
+            return None
+        paired.append((line, modes, current, c))
+
+    if by_key:
+        return None
+    return paired
+
+def screens(root=SYSFS_DRM, env=None, timeout=None):
+    """Probe screens from sysfs, names and rates from the cached xrandr state
+
+    :env: environment of xrandr, e.g. to set DISPLAY
+    :timeout: seconds before xrandr is killed
+
+    Returns None when sysfs and xrandr can not be reconciled, the caller
+    should then fall back to a full xrandr --verbose probe.
+    """
+    with timing.phase('sysfs'):
+        conns = connectors(root)
+    if not conns:
+        return None
+    return build_screens(conns, randr.exec_cmd(['xrandr', '--current'], env, timeout))
+
+def build_screens(conns, lines):
+    """Screens of connectors and the output of xrandr --current, None
+    when they can not be reconciled"""
+    with timing.phase('parse'):
+        paired = reconcile(conns, randr.parse_xrandr_current(lines))
+    if paired is None:
+        return None
+
+    result = []
+    for line, modes, current, c in paired:
+        edid_bytes = c.edid if c.is_connected() and c.edid is not None else None
+        result.append(randr.make_screen(line, modes, edid_bytes, c.is_connected(), current=current))
+    return result
+
+if __name__ == "__main__":
+    for c in connectors():
+        print(c)
@@ -2,25 +2,154 @@ import struct
 import subprocess
 from collections import namedtuple
 
-import pnpid
-import util
+# Bump when decoding changes, invalidates cached decodes (see cache.py)
+PARSER_VERSION = 3
+
+EDID_BLOCK_SIZE = 128
+EDID_HEADER = b'\x00\xff\xff\xff\xff\xff\xff\x00'
+
+# Extension block tags
+CEA_EXTENSION = 0x02
+DISPLAYID_EXTENSION = 0x70
+
+# CEA-861 data block tags
+CEA_VIDEO_BLOCK = 2
+
+# DisplayID data block tags, 1.3 and 2.0
+DISPLAYID_TYPE_I_TIMING = 0x03
+DISPLAYID_TILED_DISPLAY = 0x12
+DISPLAYID_TYPE_VII_TIMING = 0x22
+DISPLAYID_TILED_DISPLAY_2 = 0x28
+
+# CEA-861 video identification codes of progressive modes:
+# vic -> (width, height, rate)
+CEA_VICS = {
+    1: (640, 480, 60.0), 2: (720, 480, 60.0), 3: (720, 480, 60.0),
+    4: (1280, 720, 60.0), 16: (1920, 1080, 60.0), 17: (720, 576, 50.0),
+    18: (720, 576, 50.0), 19: (1280, 720, 50.0), 31: (1920, 1080, 50.0),
+    32: (1920, 1080, 24.0), 33: (1920, 1080, 25.0), 34: (1920, 1080, 30.0),
+    41: (1280, 720, 100.0), 47: (1280, 720, 120.0), 60: (1280, 720, 24.0),
+    61: (1280, 720, 25.0), 62: (1280, 720, 30.0), 63: (1920, 1080, 120.0),
+    64: (1920, 1080, 100.0), 93: (3840, 2160, 24.0), 94: (3840, 2160, 25.0),
+    95: (3840, 2160, 30.0), 96: (3840, 2160, 50.0), 97: (3840, 2160, 60.0),
+    98: (4096, 2160, 24.0), 99: (4096, 2160, 25.0), 100: (4096, 2160, 30.0),
+    101: (4096, 2160, 50.0), 102: (4096, 2160, 60.0), 114: (3840, 2160, 48.0),
+    115: (4096, 2160, 48.0), 117: (3840, 2160, 100.0), 118: (3840, 2160, 120.0),
+    121: (5120, 2160, 24.0), 122: (5120, 2160, 25.0), 123: (5120, 2160, 30.0),
+    124: (5120, 2160, 48.0), 125: (5120, 2160, 50.0), 126: (5120, 2160, 60.0),
+    127: (5120, 2160, 100.0), 193: (5120, 2160, 120.0), 194: (7680, 4320, 24.0),
+    195: (7680, 4320, 25.0), 196: (7680, 4320, 30.0), 197: (7680, 4320, 48.0),
+    198: (7680, 4320, 50.0), 199: (7680, 4320, 60.0), 200: (7680, 4320, 100.0),
+    201: (7680, 4320, 120.0),
+}
+
+# A timing the monitor lists itself, from a detailed timing descriptor
+# (dtd), a CEA-861 short video descriptor (svd) or a DisplayID timing
+Timing = namedtuple("Timing", "width height freq preferred source")
+
+# Position of a monitor in a tiled display (e.g. a 5k panel driven as two
+# DisplayPort streams), and the size of one tile
+Tile = namedtuple("Tile", "columns rows column row width height")
 
 def get_edids():
+    import drm
+    edids = drm.read_edids()
+    if edids:
+        return edids
     output = subprocess.check_output(["xrandr", "--verbose"])
     edids = []
     lines = output.splitlines()
     for i, line in enumerate(lines):
         line = line.decode().strip()
         if line.startswith("EDID:"):
-            selection = lines[i+1:i+9]
-            selection = list(s.decode().strip() for s in selection)
-            selection = "".join(selection)
-            bytes = util.hex2bytes(selection)
-            edids.append(bytes)
+            # the base block and all extension blocks, 8 lines each
+            selection = []
+            for s in lines[i+1:]:
+                s = s.decode().strip()
+                if len(s) != 32:
+                    break
+                selection.append(s)
+            edids.append(bytes.fromhex("".join(selection)))
     return edids
 
+def detailed_timing(view, preferred=False):
+    """The Timing of an 18 byte detailed timing descriptor, None for
+    display descriptors and interlaced timings"""
+    clock = view[0] | view[1] << 8
+    if not clock or view[17] & 0x80:
+        return None
+    width = view[2] | (view[4] & 0xf0) << 4
+    h_blank = view[3] | (view[4] & 0x0f) << 8
+    height = view[5] | (view[7] & 0xf0) << 4
+    v_blank = view[6] | (view[7] & 0x0f) << 8
+    total = (width + h_blank) * (height + v_blank)
+    if not total:
+        return None
+    return Timing(width, height, round(clock * 10000.0 / total, 2), preferred, 'dtd')
+
+def cea_timings(block):
+    """Timings of a CEA-861 extension block: its short video descriptors,
+    then its detailed timing descriptors"""
+    timings = []
+    dtd_offset = block[2]
+    if dtd_offset < 4:
+        # 0: neither data blocks nor detailed timings, 1-3 are invalid
+        return timings
+    dtd_offset = min(dtd_offset, EDID_BLOCK_SIZE - 1)
+    i = 4
+    while i < dtd_offset:
+        tag, length = block[i] >> 5, block[i] & 0x1f
+        if tag == CEA_VIDEO_BLOCK:
+            for code in block[i + 1:min(i + 1 + length, dtd_offset)]:
+                # codes 129-192 are vics 1-64 flagged native
+                native = 129 <= code <= 192
+                mode = CEA_VICS.get(code & 0x7f if native else code)
+                if mode is not None:
+                    timings.append(Timing(mode[0], mode[1], mode[2], native, 'svd'))
+        i += 1 + length
+    for offset in range(dtd_offset, EDID_BLOCK_SIZE - 18, 18):
+        t = detailed_timing(block[offset:offset + 18])
+        if t is None:
+            break
+        timings.append(t)
+    return timings
+
+def displayid_blocks(block):
+    """(tag, payload) of the data blocks in a DisplayID extension block"""
+    end = min(5 + block[2], EDID_BLOCK_SIZE - 1)
+    i = 5
+    while i + 3 <= end:
+        tag, length = block[i], block[i + 2]
+        if not tag and not length:
+            break
+        yield tag, block[i + 3:i + 3 + length]
+        i += 3 + length
+
+def displayid_timing(view, khz):
+    """The Timing of a 20 byte DisplayID type I (10 kHz units) or type VII
+    (1 kHz units) descriptor, None for interlaced timings"""
+    if view[3] & 0x10:
+        return None
+    clock = (view[0] | view[1] << 8 | view[2] << 16) + 1
+    width = (view[4] | view[5] << 8) + 1
+    h_blank = (view[6] | view[7] << 8) + 1
+    height = (view[12] | view[13] << 8) + 1
+    v_blank = (view[14] | view[15] << 8) + 1
+    freq = clock * (1000.0 if khz else 10000.0) / ((width + h_blank) * (height + v_blank))
+    return Timing(width, height, round(freq, 2), bool(view[3] & 0x80), 'displayid')
+
+def displayid_tile(payload):
+    topology = payload[1:4]
+    columns = (topology[0] >> 4 | (topology[2] >> 2) & 0x30) + 1
+    rows = (topology[0] & 0x0f | topology[2] & 0x30) + 1
+    column = topology[1] >> 4 | (topology[2] >> 2 & 0x3) << 4
+    row = topology[1] & 0x0f | (topology[2] & 0x3) << 4
+    width = (payload[4] | payload[5] << 8) + 1
+    height = (payload[6] | payload[7] << 8) + 1
+    return Tile(columns, rows, column, row, width, height)
+
 class Edid:
-    _STRUCT_FORMAT = (  ">"     # big-endian
+    _HEADER_FORMAT = (  ">"     # big-endian
                         "8s"    # constant header (8 bytes)
                         "H"     # manufacturer id (2 bytes)
                         "H"     # product id (2 bytes)
@@ -33,17 +162,14 @@ class Edid:
                         "B"     # horizontal size in cm (1 byte)
                         "B"     # vertical size in cm (1 byte)
                         "B"     # display gamma (1 byte)
-                        "B"     # supported features (1 byte)
-                        "10s"   # color characteristics (10 bytes)
-                        "H"     # supported timings (2 bytes)
-                        "B"     # reserved timing (1 byte)
-                        "16s"   # EDID supported timings (16 bytes)
-                        "18s"   # detailed timing block 1 (18 bytes)
-                        "18s"   # detailed timing block 2 (18 bytes)
-                        "18s"   # detailed timing block 3 (18 bytes)
-                        "18s"   # detailed timing block 4 (18 bytes)
-                        "B"     # extension flag (1 byte)
-                        "B" )   # checksum (1 byte)
+                        "B" )   # supported features (1 byte)
+
+    # Offsets of the rest of the base block
+    _COLOR = 25                 # color characteristics (10 bytes)
+    _TIMINGS_SUPPORTED = 35     # supported timings (2 bytes)
+    _TIMINGS_EDID = 38          # EDID supported timings (16 bytes)
+    _DESCRIPTORS = (54, 72, 90, 108)  # detailed timing blocks (18 bytes each)
+    _EXTENSIONS = 126           # extension count (1 byte)
 
     _TIMINGS = {
         0: (1280, 1024, 75.),
@@ -71,76 +197,124 @@ class Edid:
         0b11: (16,  9),
     }
 
-    _RawEdid = namedtuple("RawEdid", ("header", "manu_id", "prod_id", "serial_no", "manu_week", "manu_year", "edid_version", "edid_revision", "input_type", "width", "height", "gamma", "features", "color", "timings_supported", "timings_reserved", "timings_edid", "timing_1", "timing_2", "timing_3", "timing_4", "extension", "checksum"))
-
     def __init__(self, bytes=None):
         if bytes is not None:
             self._parse_edid(bytes)
 
     def _parse_edid(self, bytes):
-        if struct.calcsize(self._STRUCT_FORMAT) != 128:
+        """Decode the base block and the extension blocks of bytes
+
+        bytes can be anything supporting the buffer protocol, the blocks
+        are read through a memoryview without copying them.
+        """
+        view = memoryview(bytes)
+        if len(view) < EDID_BLOCK_SIZE:
             raise ValueError("Wrong edid size.")
+        base = view[:EDID_BLOCK_SIZE]
 
-        if sum(map(int, bytes)) % 256 != 0:
+        if sum(base) % 256 != 0:
             raise ValueError("Checksum mismatch.")
 
-        tuple = struct.unpack(self._STRUCT_FORMAT, bytes)
-        raw_edid = self._RawEdid(*tuple)
+        (header, manu_id, prod_id, serial_no, manu_week, manu_year, edid_version, edid_revision,
+         input_type, width, height, gamma, features) = struct.unpack_from(self._HEADER_FORMAT, base)
 
-        if raw_edid.header != b'\x00\xff\xff\xff\xff\xff\xff\x00':
+        if header != EDID_HEADER:
             raise ValueError("Invalid header.")
 
-        self.raw = bytes
-        self.manufacturer_id = pnpid.id_from_raw(raw_edid.manu_id)
-        self.manufacturer = pnpid.manufacturer_from_raw(raw_edid.manu_id)
-        self.product = raw_edid.prod_id
-        self.manufacturer_num = raw_edid.manu_id
-        self.serial_no = raw_edid.serial_no
-
-        self.year = raw_edid.manu_year + 1990
-        self.edid_version = "%d.%d" % (raw_edid.edid_version, raw_edid.edid_revision)
-        self.type = "digital" if (raw_edid.input_type & 0xFF) else "analog"
-        self.width = float(raw_edid.width)
-        self.height = float(raw_edid.height)
-        self.gamma = (raw_edid.gamma+100)/100
-        self.dpms_standby = bool( raw_edid.features & 0xFF )
-        self.dpms_suspend = bool( raw_edid.features & 0x7F )
-        self.dpms_activeoff = bool( raw_edid.features & 0x3F )
+        import pnpid
+        self.raw = view
+        self.manufacturer_id = pnpid.id_from_raw(manu_id)
+        self.manufacturer = pnpid.manufacturer_from_raw(manu_id)
+        self.product = prod_id
+        self.manufacturer_num = manu_id
+        self.serial_no = serial_no
+
+        self.year = manu_year + 1990
+        self.edid_version = "%d.%d" % (edid_version, edid_revision)
+        self.type = "digital" if (input_type & 0xFF) else "analog"
+        self.width = float(width)
+        self.height = float(height)
+        self.gamma = (gamma+100)/100
+        self.dpms_standby = bool( features & 0xFF )
+        self.dpms_suspend = bool( features & 0x7F )
+        self.dpms_activeoff = bool( features & 0x3F )
 
         self.resolutions = []
+        timings_supported = base[self._TIMINGS_SUPPORTED] << 8 | base[self._TIMINGS_SUPPORTED + 1]
         for i in range(16):
-            bit = raw_edid.timings_supported & i
-            if bit:
-                self.resolutions.append(self._TIMINGS[16-i])
+            if timings_supported & (1 << i):
+                self.resolutions.append(self._TIMINGS[i])
 
         for i in range(8):
-            bytes = raw_edid.timings_edid[2*i:2*i+2]
-            if bytes == b'\x01\x01':
+            byte1 = base[self._TIMINGS_EDID + 2*i]
+            byte2 = base[self._TIMINGS_EDID + 2*i + 1]
+            if byte1 == 1 and byte2 == 1:
                 continue
-            byte1, byte2 = bytes
-            x_res = 8*(int(byte1)+31)
+            x_res = 8*(byte1+31)
             aspect_ratio = self._ASPECT_RATIOS[ (byte2>>6) & 0b11 ]
             y_res = int(x_res * aspect_ratio[1]/aspect_ratio[0])
-            rate = (int(byte2) & 0b00111111) + 60.0
+            rate = (byte2 & 0b00111111) + 60.0
             self.resolutions.append((x_res, y_res, rate))
 
         self.name = None
         self.serial = None
+        # native timings, the first detailed timing is the preferred mode
+        timings = []
 
-        for bytes in (raw_edid.timing_1, raw_edid.timing_2, raw_edid.timing_3, raw_edid.timing_4):
-            if bytes[0:2] == b'\x00\x00': # "other" descriptor
-                type = bytes[3]
+        for offset in self._DESCRIPTORS:
+            descriptor = base[offset:offset + 18]
+            if descriptor[0] == 0 and descriptor[1] == 0: # "other" descriptor
+                type = descriptor[3]
                 if type in (0xFF, 0xFE, 0xFC):
-                    buffer = bytes[5:]
-                    buffer = buffer.partition(b"\x0a")[0]
-                    text = buffer.decode("cp437")
+                    text = descriptor[5:].tobytes().partition(b"\x0a")[0].decode("cp437")
                     if type == 0xFF:
                         self.serial = text
                     elif type == 0xFC:
                         self.name = text
+            else:
+                t = detailed_timing(descriptor, offset == self._DESCRIPTORS[0])
+                if t is not None:
+                    timings.append(t)
 
         if not self.serial:
-            self.serial = raw_edid.serial_no
+            self.serial = serial_no
+
+        self.tile = None
+        self.extensions = 0
+        for i in range(1, min(base[self._EXTENSIONS] + 1, len(view) // EDID_BLOCK_SIZE)):
+            block = view[i * EDID_BLOCK_SIZE:(i + 1) * EDID_BLOCK_SIZE]
+            if sum(block) % 256 != 0:
+                # a corrupt extension does not spoil the base block
+                continue
+            self.extensions += 1
+            if block[0] == CEA_EXTENSION:
+                timings.extend(cea_timings(block))
+            elif block[0] == DISPLAYID_EXTENSION:
+                self._parse_displayid(block, timings)
+
+        self.native_timings = self._unique(timings)
+
+    def _parse_displayid(self, block, timings):
+        for tag, payload in displayid_blocks(block):
+            if tag in (DISPLAYID_TYPE_I_TIMING, DISPLAYID_TYPE_VII_TIMING):
+                for offset in range(0, len(payload) - 19, 20):
+                    t = displayid_timing(payload[offset:offset + 20], tag == DISPLAYID_TYPE_VII_TIMING)
+                    if t is not None:
+                        timings.append(t)
+            elif tag in (DISPLAYID_TILED_DISPLAY, DISPLAYID_TILED_DISPLAY_2) and len(payload) >= 8:
+                self.tile = displayid_tile(payload)
+
+    @staticmethod
+    def _unique(timings):
+        """timings without repeats, preferred ones first"""
+        seen = {}
+        for t in timings:
+            key = (t.width, t.height, round(t.freq))
+            if key not in seen or (t.preferred and not seen[key].preferred):
+                seen[key] = t
+        unique = list(seen.values())
+        unique.sort(key=lambda t: not t.preferred)
+        return unique
 
     def __repr__(self):
         clsname = self.__class__.__name__
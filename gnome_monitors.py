@@ -1,13 +1,23 @@
 #import xml.etree.ElementTree as ET
 from lxml import etree as ET
 from collections import namedtuple
+import io
+import os
 
-def save(input_screens, file):
+# The fields of an output element, in the order GNOME writes them
+Output = namedtuple("Output", "vendor product serial width height rate x y rotation reflect_x reflect_y primary")
+
+# Text of the comment marking the configurations written by save
+GENERATED = "Generated by auto randr"
+
+# Generated configurations compact keeps for each set of monitors
+KEEP_GENERATED = 2
 
+def output_map(input_screens):
+    """Output fields of the enabled screens, by output name"""
     # Remove disabled screens
     screens = list(filter(lambda x: x.set.is_enabled, input_screens))
 
-    Output = namedtuple("Output", "vendor product serial width height rate x y rotation reflect_x reflect_y primary")
     screens_map = {}
     for s in screens:
         screens_map[s.name] = Output(
@@ -24,41 +34,139 @@ def save(input_screens, file):
             "no",
             "yes" if s.set.is_primary else "no"
         )
+    return screens_map
+
+def monitor_key(name, output):
+    """Identifies a monitor connected to an output"""
+    return (name, output.vendor, output.product, output.serial)
+
+def layout_key(screens_map):
+    """Identifies a configuration, monitors and their settings"""
+    return tuple(sorted((name,) + tuple(output) for name, output in screens_map.items()))
+
+def read_outputs(configuration):
+    """Output fields of the outputs with a monitor in a configuration element"""
+    outputs = {}
+    for output in configuration:
+        if output.tag != "output":
+            continue
+        fields = {}
+        for field in output:
+            fields[field.tag] = field.text
+        if fields.get("vendor") is None:
+            continue
+        outputs[output.get("name")] = Output(*(fields.get(f) for f in Output._fields))
+    return outputs
+
+def monitor_keys(configuration):
+    """monitor_key of each output with a monitor in a configuration element"""
+    keys = []
+    for output in configuration.iterchildren("output"):
+        vendor = output.findtext("vendor")
+        if vendor is not None:
+            keys.append((output.get("name"), vendor, output.findtext("product"), output.findtext("serial")))
+    return keys
+
+class ConfigurationIndex(object):
+    """The configurations of a monitors.xml root element, indexed by the
+    monitors they use"""
+    def __init__(self, root):
+        super(ConfigurationIndex, self).__init__()
+        self.configurations = []
+        self.by_monitor = {}
+        for configuration in root.iterchildren("configuration"):
+            self.configurations.append(configuration)
+            for key in monitor_keys(configuration):
+                self.by_monitor.setdefault(key, []).append(configuration)
+
+    def using(self, screens_map):
+        """Configurations using all monitors of screens_map, and possibly more"""
+        if not screens_map:
+            return list(self.configurations)
+        lists = sorted((self.by_monitor.get(monitor_key(name, output), []) for name, output in screens_map.items()), key=len)
+        common = set(map(id, lists[0]))
+        for l in lists[1:]:
+            common &= set(map(id, l))
+        return [c for c in lists[0] if id(c) in common]
+
+def parse(file):
+    """The tree of file, and its bytes"""
+    with open(file, 'rb') as f:
+        data = f.read()
+    return ET.parse(io.BytesIO(data)), data
+
+def write(tree, file, data):
+    """Atomically replace file with tree, unless that leaves it as it was
+
+    A symlinked file is replaced where the link points, the link stays.
+    """
+    new_data = ET.tostring(tree)
+    if new_data == data:
+        return False
+    import cache
+    file = os.path.realpath(file)
+    cache.write_atomic(file, new_data, os.stat(file).st_mode & 0o777)
+    return True
+
+def save(input_screens, file):
+    """Store the layout of input_screens in file, replacing the configurations
+    for the same monitors
+
+    Returns False when file already had exactly this configuration.
+    """
+    screens_map = output_map(input_screens)
 
     # Find existing entry
-    tree = ET.parse(file)
+    tree, data = parse(file)
     root = tree.getroot()
-    for configuration in root:
-        matches = 0
-        for output in configuration:
-            if output.tag == "output":
-                output_name = output.get("name")
-                if output.find("vendor") is not None:
-                    if output_name in screens_map:
-                        if output.find("vendor").text == screens_map[output_name].vendor and \
-                            output.find("product").text == screens_map[output_name].product and \
-                            output.find("serial").text == screens_map[output_name].serial:
-                            #print(output_name + ": Output match!")
-                            matches += 1
-                        else:
-                            #print(output_name + ": output match, but wrong screen")
-                            pass
-                    else:
-                        #print(output_name + ": defined, but not present")
-                        pass
-                else:
-                    #print(output_name + ": No config")
-                    pass
-        if matches == len(screens):
-            root.remove(configuration)
+    index = ConfigurationIndex(root)
+    replaced = index.using(screens_map)
+    if len(replaced) == 1 and layout_key(read_outputs(replaced[0])) == layout_key(screens_map):
+        return False
+
+    for configuration in replaced:
+        root.remove(configuration)
 
     root.append(make_configuration(screens_map))
-    tree.write(file)
+    return write(tree, file, data)
+
+def is_generated(configuration):
+    """Whether save wrote the configuration, rather than GNOME"""
+    for comment in configuration.iterchildren(ET.Comment):
+        if comment.text.strip() == GENERATED:
+            return True
+    return False
+
+def compact(file, keep=KEEP_GENERATED):
+    """Keep the newest keep generated configurations for each set of
+    monitors, dropping duplicates, configurations GNOME wrote are kept
+
+    Returns the number of configurations removed.
+    """
+    tree, data = parse(file)
+    root = tree.getroot()
+    kept = {}
+    removed = []
+    # save appends, newest last
+    for configuration in reversed(list(root.iterchildren("configuration"))):
+        if not is_generated(configuration):
+            continue
+        layouts = kept.setdefault(frozenset(monitor_keys(configuration)), set())
+        layout = layout_key(read_outputs(configuration))
+        if layout in layouts or len(layouts) >= keep:
+            removed.append(configuration)
+        else:
+            layouts.add(layout)
+
+    for configuration in removed:
+        root.remove(configuration)
+    write(tree, file, data)
+    return len(removed)
 
 def make_configuration(screens_map):
     config = ET.Element("configuration")
     
-    comment = ET.Comment("Generated by auto randr")
+    comment = ET.Comment(GENERATED)
     config.append(comment)
 
     clone = ET.SubElement(config, "clone")
@@ -0,0 +1,160 @@
+import glob
+import select
+import socket
+import time
+
+# Connector status files, one per card/connector pair (card0-eDP-1, ...)
+DRM_STATUS_GLOB = '/sys/class/drm/card*-*/status'
+
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_GROUP_KERNEL = 1
+
+# A dock announces its outputs in a burst, wait for it to settle
+DEBOUNCE_SECONDS = 1.0
+POLL_INTERVAL = 2.0
+
+# A connector that keeps flapping is reconfigured at least this often
+MAX_DEBOUNCE_SECONDS = 10.0
+
+# Event sources implement wait(timeout), which returns True when a connector
+# changed, False when the timeout expired and None when the source is exhausted.
+# Sources with a clock of their own implement now(), time.monotonic() otherwise.
+
+class UdevEventSource(object):
+    """Kernel uevents for the drm subsystem, read from a netlink socket"""
+    def __init__(self):
+        super(UdevEventSource, self).__init__()
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        self.sock.bind((0, UEVENT_GROUP_KERNEL))
+
+    def wait(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            ready, _, _ = select.select([self.sock], [], [], remaining)
+            if not ready:
+                return False
+            if is_drm_uevent(self.sock.recv(8192)):
+                return True
+
+    def close(self):
+        self.sock.close()
+
+class SysfsPollSource(object):
+    """Polls connector status files when uevents are unavailable"""
+    def __init__(self, interval=POLL_INTERVAL, pattern=DRM_STATUS_GLOB):
+        super(SysfsPollSource, self).__init__()
+        self.interval = interval
+        self.pattern = pattern
+        self.state = self.read_state()
+
+    def read_state(self):
+        state = {}
+        for path in glob.glob(self.pattern):
+            try:
+                with open(path, 'r') as f:
+                    state[path] = f.read().strip()
+            except OSError:
+                pass
+        return state
+
+    def wait(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, deadline - time.monotonic())
+                if delay <= 0:
+                    return False
+            time.sleep(delay)
+            state = self.read_state()
+            if state != self.state:
+                self.state = state
+                return True
+
+    def close(self):
+        pass
+
+class FakeEventSource(object):
+    """Replays xrandr --verbose outputs as hotplug events
+
+    :timeline: list of (delay in seconds, xrandr --verbose lines)
+
+    """
+    def __init__(self, timeline, initial=None):
+        super(FakeEventSource, self).__init__()
+        self.timeline = list(timeline)
+        self.lines = initial if initial is not None else (self.timeline[0][1] if self.timeline else [])
+        self.probes = 0
+        # seconds replayed
+        self.time = 0.0
+
+    def now(self):
+        return self.time
+
+    def wait(self, timeout):
+        if not self.timeline:
+            return None
+        delay, lines = self.timeline[0]
+        if timeout is not None and delay > timeout:
+            self.timeline[0] = (delay - timeout, lines)
+            self.time += timeout
+            return False
+        self.timeline.pop(0)
+        self.time += delay
+        self.lines = lines
+        return True
+
+    def probe(self):
+        import randr
+        self.probes += 1
+        return randr.parse_xrandr(self.lines)
+
+    def close(self):
+        pass
+
+def is_drm_uevent(message):
+    fields = message.split(b'\0')
+    return b'SUBSYSTEM=drm' in fields and b'HOTPLUG=1' in fields
+
+def default_source():
+    try:
+        return UdevEventSource()
+    except (OSError, AttributeError):
+        # No netlink (not linux, or sandboxed), fall back to polling
+        return SysfsPollSource()
+
+def settle(source, debounce=DEBOUNCE_SECONDS, max_wait=MAX_DEBOUNCE_SECONDS):
+    """Wait until source has no event for debounce seconds, for at most
+    max_wait seconds
+
+    Returns False when the events settled, True when max_wait ran out and
+    None when the source is exhausted.
+    """
+    clock = getattr(source, 'now', time.monotonic)
+    deadline = clock() + max_wait
+    event = True
+    while event:
+        remaining = deadline - clock()
+        if remaining <= 0:
+            return True
+        event = source.wait(min(debounce, remaining))
+    return event
+
+def run(source, reconfigure, debounce=DEBOUNCE_SECONDS, max_wait=MAX_DEBOUNCE_SECONDS):
+    """Call reconfigure once, then once per settled burst of events, and
+    every max_wait seconds of a burst that does not settle
+
+    Returns the number of reconfigurations when the source is exhausted.
+    """
+    reconfigure()
+    runs = 1
+    while True:
+        event = source.wait(None)
+        if event is None:
+            return runs
+        event = settle(source, debounce, max_wait)
+        reconfigure()
+        runs += 1
+        if event is None:
+            return runs
@@ -0,0 +1,87 @@
+"""Columnar mode tables, for outputs advertising hundreds of modes
+
+NumPy is optional, without it numpy() returns None and callers keep using
+the per-mode selectors. Importing it takes longer than filtering thousands
+of modes, so selectors only use it when loaded() says it is imported
+already.
+"""
+import sys
+
+# Below this many modes the pure python selector is faster
+MIN_MODES = 64
+
+# Sort keys, as used by the selectors in auto.py
+SORT_DENSITY = 'density'
+SORT_RATE = 'rate'
+SORT_RESOLUTION = 'resolution'
+
+_numpy = None
+
+def numpy():
+    """The numpy module, or None when it is not installed"""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy as np
+            _numpy = np
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+def loaded():
+    """The numpy module when it is imported already, else None"""
+    return sys.modules.get('numpy')
+
+class ModeColumns(object):
+    """Width, height, freq, dpi and aspect of a mode list, one array each"""
+    def __init__(self, modes):
+        super(ModeColumns, self).__init__()
+        np = numpy()
+        n = len(modes)
+        self.modes = modes
+        self.width = np.fromiter((m.width for m in modes), np.float64, n)
+        self.height = np.fromiter((m.height for m in modes), np.float64, n)
+        self.freq = np.fromiter((m.freq for m in modes), np.float64, n)
+        self.dpi = np.fromiter((m.dpi for m in modes), np.float64, n)
+        self.aspect = np.fromiter((m.aspect for m in modes), np.float64, n)
+        self.resolution = self.width * self.height
+
+    def mask(self, min_dpi=None, max_dpi=None, min_rate=None, aspect=None, aspect_eps=0.0):
+        np = numpy()
+        mask = np.ones(len(self.modes), dtype=bool)
+        if min_dpi is not None:
+            mask &= self.dpi >= min_dpi
+        if max_dpi is not None:
+            mask &= self.dpi <= max_dpi
+        if min_rate is not None:
+            mask &= self.freq >= min_rate
+        if aspect is not None:
+            mask &= np.abs(self.aspect - aspect) <= aspect_eps
+        return mask
+
+    def column(self, key):
+        if key == SORT_DENSITY:
+            return self.dpi
+        elif key == SORT_RATE:
+            return self.freq
+        elif key == SORT_RESOLUTION:
+            return self.resolution
+        return None
+
+    def select(self, mask, order):
+        """First of the masked modes ranked highest by the order keys
+
+        Raises IndexError when no mode is left, like indexing an empty list
+        """
+        np = numpy()
+        candidates = np.flatnonzero(mask)
+        if len(candidates) == 0:
+            raise IndexError('no mode meets the requirements')
+        # lexsort takes the primary key last, ties go to the earliest mode
+        keys = [-candidates]
+        for key in reversed(order):
+            column = self.column(key)
+            if column is not None:
+                keys.append(column[candidates])
+        best = np.lexsort(keys)[-1]
+        return self.modes[candidates[best]]
@@ -1,24 +1,128 @@
-import csv
+import hashlib
+import mmap
 import os, os.path
-import string
+import struct
 
 DIR = os.path.dirname(os.path.abspath(__file__))
 CSV_FILENAME = os.path.join(DIR, 'pnp_ids.csv')
+TABLE_FILENAME = os.path.join(DIR, 'pnp_ids.bin')
 
-PNP_IDS = {}
-with open(CSV_FILENAME, 'r') as file:
-    reader = csv.reader(file)
-    for line in reader:
-        PNP_IDS[ line[0] ] = line[1]
+# Compiled table layout, little endian:
+#   header   magic, size, mtime (ns) and sha1 of the csv it was built from,
+#            number of names
+#   index    one uint16 per 15-bit manufacturer code, name number + 1 or 0
+#   offsets  uint32 start of each name in the blob, plus the end of the blob
+#   blob     utf-8 names
+_MAGIC = b'PNP3'
+_HEADER = struct.Struct('<4sQq20sI')
+_CODES = 1 << 15
+_INDEX_OFFSET = _HEADER.size
+_OFFSETS_OFFSET = _INDEX_OFFSET + 2 * _CODES
+
+# string.ascii_uppercase, without importing string (and re)
+_LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+_table = None
 
 def manufacturer_from_raw(raw):
-    id = id_from_raw(raw)
-    return manufacturer_from_id(id)
+    return _lookup(raw & (_CODES - 1))
 
 def manufacturer_from_id(id):
-    return PNP_IDS.get(id, "Unknown")
+    code = raw_from_id(id)
+    if code is None:
+        return "Unknown"
+    return _lookup(code)
 
 def id_from_raw(raw):
     tmp = [ (raw >> 10) & 31, (raw >> 5) & 31, raw & 31 ]
-    return "".join( string.ascii_uppercase[n-1] for n in tmp )
+    return "".join( _LETTERS[n-1] for n in tmp )
+
+def raw_from_id(id):
+    if len(id) != 3 or not all(c in _LETTERS for c in id):
+        return None
+    return ((ord(id[0]) - 64) << 10) | ((ord(id[1]) - 64) << 5) | (ord(id[2]) - 64)
+
+def read_csv(filename=CSV_FILENAME):
+    import csv
+    ids = {}
+    with open(filename, 'r') as file:
+        reader = csv.reader(file)
+        for line in reader:
+            ids[ line[0] ] = line[1]
+    return ids
+
+def csv_digest(filename=CSV_FILENAME):
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).digest()
+
+def csv_stat(filename=CSV_FILENAME):
+    st = os.stat(filename)
+    return st.st_size, st.st_mtime_ns
+
+def build_table(ids, digest, stat=(0, 0)):
+    names = []
+    index = [0] * _CODES
+    for id, name in ids.items():
+        code = raw_from_id(id)
+        if code is not None:
+            names.append(name.encode('utf-8'))
+            index[code] = len(names)
+
+    offsets = [0]
+    for name in names:
+        offsets.append(offsets[-1] + len(name))
+
+    return b''.join([
+        _HEADER.pack(_MAGIC, stat[0], stat[1], digest, len(names)),
+        struct.pack('<%dH' % _CODES, *index),
+        struct.pack('<%dI' % len(offsets), *offsets),
+        ] + names)
+
+def compile_table(csv_filename=CSV_FILENAME, table_filename=TABLE_FILENAME):
+    """Build the table of csv_filename into table_filename, at build time"""
+    table = build_table(read_csv(csv_filename), csv_digest(csv_filename),
+                        csv_stat(csv_filename))
+    with open(table_filename, 'wb') as f:
+        f.write(table)
+    return table
+
+def _load():
+    global _table
+    stat = csv_stat(CSV_FILENAME)
+    digest = None
+    try:
+        with open(TABLE_FILENAME, 'rb') as f:
+            table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, size, mtime, built_from, _ = _HEADER.unpack_from(table)
+        if magic == _MAGIC:
+            # Same size and mtime as at build time: trust it without reading
+            # the csv, otherwise (a fresh checkout, say) compare the content
+            if (size, mtime) == stat:
+                _table = table
+                return _table
+            digest = csv_digest(CSV_FILENAME)
+            if built_from == digest:
+                _table = table
+                return _table
+        table.close()
+    except (OSError, ValueError, struct.error):
+        pass
+
+    # Missing or built from another csv: build it in memory, the package
+    # directory may well be read only, python pnpid.py writes it
+    _table = build_table(read_csv(CSV_FILENAME), digest or csv_digest(CSV_FILENAME), stat)
+    return _table
+
+def _lookup(code):
+    table = _table if _table is not None else _load()
+    n = struct.unpack_from('<H', table, _INDEX_OFFSET + 2 * code)[0]
+    if n == 0:
+        return "Unknown"
+    count = _HEADER.unpack_from(table)[4]
+    start, end = struct.unpack_from('<II', table, _OFFSETS_OFFSET + 4 * (n - 1))
+    blob = _OFFSETS_OFFSET + 4 * (count + 1)
+    return table[blob + start:blob + end].decode('utf-8')
 
+if __name__ == "__main__":
+    compile_table()
+    print("Wrote", TABLE_FILENAME)
@@ -15,31 +15,68 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import heapq
+import math
+import re
 import subprocess as sb
-from util import hex2bytes
-from edid import Edid
-
-class Mode(object):
-    """docstring for Mode"""
-    def __init__(self, width, height, freq, current, preferred):
-        super(Mode, self).__init__()
-        self.width = width
-        self.height = height
-        self.freq = freq
-        self.current = current
-        self.preferred = preferred
-        self.dpi = 100.0
-        self.aspect = self.width / self.height
+import threading
+import time
+import weakref
+from collections import deque, namedtuple
+import cache
+import timing
+
+# Backends, see backend()
+BACKEND_XRANDR = "xrandr"
+BACKEND_XLIB = "xlib"
+BACKENDS = [BACKEND_XRANDR, BACKEND_XLIB]
+
+# Refresh rates closer than this are the same mode
+RATE_EPS = 0.005
+
+# Density classes of modes
+DENSITY_ANY = "any"
+DENSITY_HD = "hd"
+DENSITY_4K = "4k"
+
+DENSITY_4K_THRESHOLD = 150.0
+ASPECT_CLOSE_EPS = 0.05
+
+# Probe strategies
+PROBE_XRANDR = 'xrandr'
+PROBE_SYSFS = 'sysfs'
+PROBE_TIERED = 'tiered'
+PROBES = [PROBE_TIERED, PROBE_SYSFS, PROBE_XRANDR]
+
+# Seconds xrandr may take before it is killed, a hung DDC bus stalls a probe
+PROBE_TIMEOUT = 10.0
+APPLY_TIMEOUT = 30.0
+
+class Mode(namedtuple("Mode", "width height freq preferred dpi aspect")):
+    """An immutable mode, shared by all screens using the same ModeTable
+
+    preferred and dpi are keyword only: whether a mode is the current one is
+    state of the output, see Screen.curr_mode. Modes compare by identity, as
+    a list may hold several modes with the same fields.
+    """
+    __slots__ = ()
+
+    def __new__(cls, width, height, freq, *, preferred=False, dpi=100.0):
+        return super(Mode, cls).__new__(cls, width, height, freq, preferred, dpi, width / height)
+
+    __eq__ = object.__eq__
+    __ne__ = object.__ne__
+    __hash__ = object.__hash__
 
     def resolution(self):
         return (self.width, self.height)
 
     def __str__(self):
-        return "{}\t{:.2f} hz\t{:.1f} dpi\t preferred: {}\tcurrent: {}\t aspect: {:.2f}".format(
+        return "{}\t{:.2f} hz\t{:.1f} dpi\t preferred: {}\t aspect: {:.2f}".format(
             "{}x{}".format(self.width, self.height).ljust(10), 
             self.freq, 
             self.dpi, 
-            self.current, 
             self.preferred,
             self.aspect)
 
@@ -49,8 +86,123 @@ class Mode(object):
 
     __repr__ = __str__
 
+class ModeTable(object):
+    """The modes of a monitor, with their index and columns built on first use"""
+    __slots__ = ('modes', '_index', '_columns', '__weakref__')
+
+    def __init__(self, modes):
+        super(ModeTable, self).__init__()
+        self.modes = tuple(modes)
+        self._index = None
+        self._columns = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = ModeIndex(self.modes)
+        return self._index
+
+    @property
+    def columns(self):
+        """modecolumns.ModeColumns of the modes, NumPy must be installed"""
+        if self._columns is None:
+            import modecolumns
+            self._columns = modecolumns.ModeColumns(self.modes)
+        return self._columns
+
+# Identical monitors share one table, alive as long as a screen uses it
+_mode_tables = weakref.WeakValueDictionary()
+
+# Building a ModeIndex costs about two selections by filtering and sorting
+# the modes, it only pays off in processes that select from the same modes
+# again and again, see index_modes()
+INDEX_MODES = False
+
+# With INDEX_MODES the tables of the last monitors are kept, with their
+# indexes, across probes
+KEPT_MODE_TABLES = 32
+_kept_tables = deque(maxlen=KEPT_MODE_TABLES)
+
+def index_modes(enable=True):
+    """Select modes from mode indexes, for resident processes"""
+    global INDEX_MODES
+    INDEX_MODES = enable
+    if not enable:
+        _kept_tables.clear()
+
+def intern_modes(edid_digest, raw_modes, physical_height):
+    """The ModeTable for (width, height, freq, preferred) tuples
+
+    :edid_digest: digest of the EDID of the monitor, None without EDID
+
+    """
+    key = (edid_digest, physical_height, hashlib.sha1(repr(raw_modes).encode('ascii')).digest())
+    table = _mode_tables.get(key)
+    if table is None:
+        table = ModeTable(Mode(w, h, freq, preferred=preferred, dpi=h / (physical_height/2.54))
+                          for w, h, freq, preferred in raw_modes)
+        _mode_tables[key] = table
+        if INDEX_MODES:
+            _kept_tables.append(table)
+    return table
+
+class ModeIndex(object):
+    """Modes ranked by resolution and rate, grouped by density class and aspect
+
+    Modes of equal rank keep their original order, so select() picks the
+    same mode as filtering the mode list and sorting it by (resolution, rate).
+    """
+    def __init__(self, modes, dpi_threshold=DENSITY_4K_THRESHOLD, aspect_eps=ASPECT_CLOSE_EPS):
+        super(ModeIndex, self).__init__()
+        self.dpi_threshold = dpi_threshold
+        self.aspect_eps = aspect_eps
+        self.ranked = sorted(modes, key=lambda m: (m.width * m.height, m.freq), reverse=True)
+
+        # (density, aspect bucket) -> ascending ranks
+        self.groups = {}
+        for rank, m in enumerate(self.ranked):
+            b = int(m.aspect // aspect_eps)
+            self.add((DENSITY_ANY, b), rank)
+            if m.dpi <= dpi_threshold:
+                self.add((DENSITY_HD, b), rank)
+            if m.dpi >= dpi_threshold:
+                self.add((DENSITY_4K, b), rank)
+
+    def add(self, key, rank):
+        ranks = self.groups.get(key)
+        if ranks is None:
+            self.groups[key] = [rank]
+        else:
+            ranks.append(rank)
+
+    def in_density(self, mode, density):
+        if density == DENSITY_HD:
+            return mode.dpi <= self.dpi_threshold
+        if density == DENSITY_4K:
+            return mode.dpi >= self.dpi_threshold
+        return True
+
+    def select(self, density=DENSITY_ANY, aspect=None, min_rate=0):
+        """Highest ranked mode of the density class, within aspect_eps of
+        aspect and at least min_rate, or None"""
+        if aspect is None:
+            for m in self.ranked:
+                if m.freq >= min_rate and self.in_density(m, density):
+                    return m
+            return None
+
+        eps = self.aspect_eps
+        buckets = range(int((aspect - eps) // eps), int((aspect + eps) // eps) + 1)
+        for rank in heapq.merge(*[self.groups.get((density, b), ()) for b in buckets]):
+            m = self.ranked[rank]
+            if m.freq >= min_rate and math.fabs(m.aspect - aspect) <= eps:
+                return m
+        return None
+
 class ScreenSettings(object):
     """docstring for ScreenSettings"""
+    __slots__ = ('resolution', 'is_primary', 'is_enabled', 'rotation', 'position', 'dirty', 'freq')
+
     def __init__(self):
         super(ScreenSettings, self).__init__()
         self.reset()
@@ -65,7 +217,7 @@ class ScreenSettings(object):
         self.freq = None
 
 class Screen(object):
-    def __init__(self, name, primary, rot, modes, manufacturer_id, manufacturer, model, physical_width, physical_height, product_id, serial_no, connected):
+    def __init__(self, name, primary, rot, modes, manufacturer_id, manufacturer, model, physical_width, physical_height, product_id, serial_no, connected, position=None, curr_scale=None, curr_mode=None, native_timings=(), edid=None):
         super(Screen, self).__init__()
 
         self.name = name
@@ -81,30 +233,35 @@ class Screen(object):
         self.physical_height = physical_height
         self.physical_aspect = self.physical_width / self.physical_height
 
+        # (width, height, freq, preferred) the EDID lists, before X does
+        self.native_timings = native_timings
+        # the raw EDID, None without
+        self.edid = edid
+
         self.scale = [1, 1]
 
-        # dirty hack
-        self.rotation = None
-        for r in modes:
-            if r.current:
-                self.rotation = rot
-                self.curr_mode = r
-                break
+        # Current state, as probed
+        self.curr_position = position
+        self.curr_scale = curr_scale
+        self.curr_mode = curr_mode
+        self.rotation = rot
 
-        # list of Modes (width, height)
-        self.supported_modes = modes
+        # ModeTable, possibly shared with identical monitors
+        self.mode_table = modes if isinstance(modes, ModeTable) else ModeTable(modes)
+        self.supported_modes = self.mode_table.modes
 
         self.set = ScreenSettings()
         self.set.is_enabled = self.is_enabled()
 
+    @property
+    def mode_index(self):
+        return self.mode_table.index
+
     def is_connected(self):
         return len(self.supported_modes) != 0 and self.connected
 
     def is_enabled(self):
-        for m in self.supported_modes:
-            if m.current:
-                return True
-        return False
+        return self.curr_mode is not None or self.curr_position is not None
 
     def available_resolutions(self):
         return [(r.width, r.height) for r in self.supported_modes]
@@ -171,7 +328,31 @@ class Screen(object):
         """
         self.set.position = pos
 
-    def build_cmd(self):
+    def has_changed(self):
+        """Whether the settings differ from the probed state of the output"""
+        if not self.set.is_enabled:
+            return self.is_enabled()
+
+        if self.curr_mode is None or self.curr_mode.resolution() != self.set.resolution:
+            return True
+        if self.set.freq and abs(self.set.freq - self.curr_mode.freq) > RATE_EPS:
+            return True
+        if self.curr_position != tuple(self.set.position):
+            return True
+        if list(self.curr_scale or [1, 1]) != list(self.scale):
+            return True
+        if self.set.is_primary and not self.primary:
+            return True
+        if self.set.rotation and self.set.rotation != self.rotation:
+            return True
+        return False
+
+    def build_cmd(self, force=False):
+        """Arguments to xrandr to apply the settings, empty when unchanged
+
+        :force: emit the full settings even when nothing has changed
+
+        """
         if not self.name:
             raise ValueError('Cannot apply settings without screen name', \
                              self.name)
@@ -179,7 +360,8 @@ class Screen(object):
         if self.set.resolution:
             self.check_resolution(self.set.resolution)
 
-        has_changed = False
+        if not force and not self.has_changed():
+            return []
 
         cmd = ['--output', self.name]
 
@@ -194,45 +376,19 @@ class Screen(object):
             if self.set.freq:
                 cmd.extend(["--rate", str(self.set.freq)])
 
-        else:
-            
-            cmd.append('--off')
+            if self.set.is_primary and not self.primary:
+                cmd.append('--primary')
 
-        return cmd
-        
-        # set resolution
-        if self.is_enabled() \
-                and self.curr_mode.resolution() == self.set.resolution \
-                or not self.set.resolution:
-            cmd.append('--auto')
-        else:
-            res = self.set.resolution
-            cmd.extend(['--mode', '{0}x{1}'.format(res[0], res[1])])
-            has_changed = True
-
-        # Check if this screen is already primary
-        if not self.primary and self.set.is_primary:
-            cmd.append('--primary')
-            has_changed = True
-
-        if self.set.rotation and self.set.rotation is not self.rotation:
-            rot = rot_to_str(self.set.rotation)
-            if not rot:
-                raise ValueError('Invalid rotation value', \
-                                 rot, self.set.rotation)
-            cmd.extend(['--rotate', rot])
-            has_changed = True
-
-        if self.set.position:
-            cmd.extend(['--pos', "x".join(str(x) for x in self.set.position)])
-            has_changed = True
+            if self.set.rotation and self.set.rotation != self.rotation:
+                rot = rot_to_str(self.set.rotation)
+                if not rot:
+                    raise ValueError('Invalid rotation value', \
+                                     rot, self.set.rotation)
+                cmd.extend(['--rotate', rot])
 
-        if self.is_enabled() and not self.set.is_enabled:
-            if has_changed:
-                raise Exception('--off: this option cannot be combined ' \
-                                'with other options')
+        else:
+            
             cmd.append('--off')
-            has_changed = True
 
         return cmd
 
@@ -284,20 +440,138 @@ def pos_to_str(n):
 def str_to_pos(s):
     return PostitonType.nametoval[s]
 
-def exec_cmd(cmd):
-    # throws exception CalledProcessError
-    s = sb.check_output(cmd, stderr=sb.STDOUT)
+class _Watchdog(object):
+    """Kills a process still running after timeout seconds, if not None"""
+    def __init__(self, process, timeout):
+        super(_Watchdog, self).__init__()
+        self.process = process
+        self.expired = False
+        self.timer = None
+        if timeout is not None:
+            self.timer = threading.Timer(timeout, self.kill)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def kill(self):
+        self.expired = True
+        try:
+            self.process.kill()
+        except OSError:
+            pass
+
+    def cancel(self):
+        if self.timer is not None:
+            self.timer.cancel()
+
+def exec_cmd(cmd, env=None, timeout=None):
+    # throws exception CalledProcessError, TimeoutExpired
+    start = time.perf_counter()
+    p = sb.Popen(cmd, stdout=sb.PIPE, stderr=sb.STDOUT, env=env)
+    watchdog = _Watchdog(p, timeout)
+    with p:
+        try:
+            s = p.stdout.read()
+            eof = time.perf_counter()
+            p.wait()
+        finally:
+            watchdog.cancel()
+    _exited(cmd, start, eof, p.returncode)
+    if watchdog.expired:
+        raise sb.TimeoutExpired(cmd, timeout, s)
+    if p.returncode:
+        raise sb.CalledProcessError(p.returncode, cmd, s)
     return s.decode("utf-8").split('\n')
 
-def xrandr_apply(screens, dryrun):
-    cmd = ['xrandr']
-    for s in screens:
-        cmd = cmd + s.build_cmd()
-    print(" ".join(cmd))
-    if not dryrun:
-        exec_cmd(cmd)
+def stream_cmd(cmd, env=None, timeout=None):
+    """Run cmd, yielding its output lines as they are written"""
+    # throws exception CalledProcessError, TimeoutExpired
+    start = time.perf_counter()
+    p = sb.Popen(cmd, stdout=sb.PIPE, stderr=sb.STDOUT, env=env)
+    watchdog = _Watchdog(p, timeout)
+    with p:
+        try:
+            for line in p.stdout:
+                yield line.decode("utf-8").rstrip('\n')
+            eof = time.perf_counter()
+        finally:
+            watchdog.cancel()
+    _exited(cmd, start, eof, p.returncode)
+    if watchdog.expired:
+        raise sb.TimeoutExpired(cmd, timeout)
+    if p.returncode:
+        raise sb.CalledProcessError(p.returncode, cmd)
+
+def _exited(cmd, start, eof, returncode):
+    timings = timing.active()
+    if timings is not None:
+        end = time.perf_counter()
+        timings.add_subprocess(cmd, end - start, end - eof, returncode)
+
+def xrandr_apply(screens, dryrun, force=False):
+    """Apply the settings of screens that changed, with the current backend
+
+    Returns what the backend did (the xrandr command for xrandr), or None
+    when there was nothing to do
+    """
+    return get_backend().apply(screens, dryrun, force)
+
+# The EDID fields screens are built from, timings are the native timings of
+# the monitor as (width, height, freq, preferred), preferred ones first
+EdidInfo = namedtuple("EdidInfo", "model manufacturer_id manufacturer width height product serial_no timings")
+
+def edid_digest(edid_bytes):
+    return hashlib.sha1(edid_bytes).hexdigest()
+
+def decode_edid(edid_bytes, key=None):
+    """Decode an EDID, or look it up in the persistent cache by digest"""
+    edid_cache = cache.edid_cache()
+    if key is None:
+        key = edid_digest(edid_bytes)
+    cached = edid_cache.get(key)
+    if cached is not None:
+        info = EdidInfo(*cached)
+        return info._replace(timings=tuple(tuple(t) for t in info.timings))
+
+    with timing.phase('edid'):
+        # decoding pulls in the PNP id table, only import it on a cache miss
+        from edid import Edid
+        parsed_edid = Edid(edid_bytes)
+        info = EdidInfo(
+            parsed_edid.name if parsed_edid.name else "",
+            parsed_edid.manufacturer_id,
+            parsed_edid.manufacturer,
+            parsed_edid.width,
+            parsed_edid.height,
+            parsed_edid.product,
+            parsed_edid.serial_no,
+            tuple(t[:4] for t in parsed_edid.native_timings))
+    edid_cache.put(key, list(info))
+    return info
+
+def create_screen(sc_line, modes, edid_data, connected, curr_scale=None, current=None):
+    # the base block and all extension blocks
+    edid_bytes = bytes.fromhex("".join(edid_data)) if edid_data else None
+    return make_screen(sc_line, modes, edid_bytes, connected, curr_scale, current)
+
+# Geometry of an active output in its header line, the mode id is only
+# shown with --verbose:
+#   DP-1 connected 1920x1200+1920+0 (0x50) left (normal left inverted ...
+_rxgeometry = re.compile(r' (\d+)x(\d+)\+(\d+)\+(\d+)(?: \(0x[0-9a-fA-F]+\))?(?: (normal|left|inverted|right)\b)?')
+
+def parse_geometry(sc_line):
+    """Returns the (x, y) position and rotation of an active output, or (None, None)"""
+    r = _rxgeometry.search(sc_line)
+    if not r:
+        return None, None
+    return (int(r.group(3)), int(r.group(4))), str_to_rot(r.group(5))
+
+def make_screen(sc_line, modes, edid_bytes, connected, curr_scale=None, current=None):
+    """Build a Screen from its output line and EDID
+
+    :modes: list of (width, height, freq, preferred)
+    :current: index of the current mode in modes, or None
 
-def create_screen(sc_line, modes, edid_data, connected):
+    """
 
     name = sc_line.split(' ')[0]
     model = ""
@@ -307,105 +581,354 @@ def create_screen(sc_line, modes, edid_data, connected):
     serial_no = 0
     physical_width = 30.0
     physical_height = 30.0
-    if(len(edid_data) > 0):
-        bytes = hex2bytes("".join(edid_data[0:8]))
-        parsed_edid = Edid(bytes)
-        model = parsed_edid.name if parsed_edid.name else ""
-        manufacturer_id = parsed_edid.manufacturer_id
-        manufacturer = parsed_edid.manufacturer
-        physical_width = parsed_edid.width
-        physical_height = parsed_edid.height
-        product_id = parsed_edid.product
-        serial_no = parsed_edid.serial_no
-
-    # Set dpi of modes
-    for mode in modes:
-        mode.dpi = mode.height / (physical_height/2.54)
-
-    # if connected
-    rot = None
-    if modes:
-        fr = sc_line.split(' ')
-        if len(fr) > 2:
-            rot = str_to_rot(sc_line.split(' ')[3])
-
-    return Screen(name, 'primary' in sc_line, rot, modes, manufacturer_id, manufacturer, model, physical_width, physical_height, product_id, serial_no, connected)
-
-def parse_xrandr(lines):
-    import re
-    #rx = re.compile('^\s+(\d+)x(\d+)\s+((?:\d+\.)?\d+)([* ]?)([+ ]?)')
-    rx = re.compile('^\s+(\d+)x(\d+)\s+')
-    #rxfreq = re.compile('\s((?:\d+\.)?\d+)([* ]?)([+ ]?)')
-    rxfreq = re.compile('\s([0-9]*[.]?[0-9]+|[0-9]+)([x]?)([* ]?)([+ ]?)')
-    rxconn = re.compile(r'\sconnected\s')
-    rxdisconn = re.compile(r'\bdisconnected\b')
-
+    digest = None
+    native_timings = ()
+    if edid_bytes:
+        digest = edid_digest(edid_bytes)
+        info = decode_edid(edid_bytes, digest)
+        model = info.model
+        manufacturer_id = info.manufacturer_id
+        manufacturer = info.manufacturer
+        physical_width = info.width
+        physical_height = info.height
+        product_id = info.product
+        serial_no = info.serial_no
+        native_timings = info.timings
+        if native_timings and native_timings[0][3] and not any(m[3] for m in modes):
+            modes = mark_preferred(modes, native_timings[0])
+
+    table = intern_modes(digest, modes, physical_height)
+    curr_mode = table.modes[current] if current is not None else None
+
+    position, rot = parse_geometry(sc_line)
+
+    return Screen(name, 'primary' in sc_line, rot, table, manufacturer_id, manufacturer, model, physical_width, physical_height, product_id, serial_no, connected, position, curr_scale, curr_mode, native_timings, edid_bytes or None)
+
+def mark_preferred(modes, timing):
+    """modes with the ones matching the (width, height, freq) of timing
+    flagged preferred, for servers that do not flag any"""
+    width, height, freq = timing[:3]
+    return [(w, h, f, True) if (w, h) == (width, height) and abs(f - freq) < 0.5 else (w, h, f, p)
+            for w, h, f, p in modes]
+
+# Lines inside an output block of xrandr --verbose: a mode, the vertical
+# timings of that mode (with its refresh rate), a line of EDID hex or the
+# first row of the transformation matrix
+_rxblock = re.compile(r'\s+(?:(\d+)x(\d+)\s|v:.*\s([0-9.]+)Hz\s*$|([0-9a-fA-F]{32})\s*$|Transform:\s+([-0-9.]+)\s)')
+
+def iter_xrandr(lines):
+    """Parse xrandr --verbose output line by line
+
+    Yields each Screen as soon as the next output block starts, so parsing
+    overlaps with reading the output of a running xrandr.
+    """
     sc_name_line = None
-    sc_name = None
-    width = None
-    height = None
-    freq = None
-    current = False
-    preferred = False
-
-    screens = []
     modes = []
     edid_data = []
-
     parsing_mode = None
+    scale = None
+    current = None
+
+    for line in lines:
+        if line[:1].isspace():
+            if scale is not None and len(scale) == 1:
+                # second row of the transformation matrix
+                scale.append(float(line.split()[1]))
+                continue
+            r = _rxblock.match(line)
+            if r is None:
+                continue
+            if r.group(1) is not None:
+                parsing_mode = (int(r.group(1)), int(r.group(2)), '*current' in line, '+preferred' in line)
+            elif parsing_mode:
+                if r.group(3) is not None:
+                    if parsing_mode[2]:
+                        current = len(modes)
+                    modes.append((parsing_mode[0], parsing_mode[1], float(r.group(3)), parsing_mode[3]))
+                    parsing_mode = None
+            elif r.group(4) is not None:
+                edid_data.append(r.group(4))
+            elif r.group(5) is not None:
+                scale = [float(r.group(5))]
 
-    for i in lines:
-        #print("\t**", i)
-        if re.search(rxconn, i) or re.search(rxdisconn, i):
+        elif ' connected ' in line or 'disconnected' in line:
             if sc_name_line:
-
-                sc_connected = True if re.search(rxconn, sc_name_line) else False
-                #print("connected: ", sc_connected, "___", sc_name_line)
-                newscreen = create_screen(sc_name_line, modes, edid_data, sc_connected)
-                screens.append(newscreen)
+                yield create_screen(sc_name_line, modes, edid_data, ' connected ' in sc_name_line, scale, current)
                 modes = []
                 edid_data = []
+                scale = None
+                current = None
+            sc_name_line = line
+            parsing_mode = None
 
-            sc_name_line = i
-
-        else:
-            r = re.search(rx, i)
-            parts = i.strip().split(" ")
-            if r:
-                width = int(r.group(1))
-                height = int(r.group(2))
+    if sc_name_line:
+        yield create_screen(sc_name_line, modes, edid_data, ' connected ' in sc_name_line, scale, current)
 
-                parsing_mode = [width, height, 0.0]
+def parse_xrandr(lines):
+    return list(iter_xrandr(lines))
 
-            elif parsing_mode:
-                if(parts[0] == "v:"):
-                    #print(parts[-1][0:-2])
-                    parsing_mode[2] = float(parts[-1][0:-2])
-                    newmode = Mode(parsing_mode[0], parsing_mode[1], parsing_mode[2], False, False)
-                    modes.append(newmode)
-                    parsing_mode = None
-            
-            elif len(parts) == 1 and len(parts[0]) == 32:
-                edid_data.append(parts[0])
+def parse_xrandr_current(lines):
+    """Parse the output of xrandr --current (without --verbose)
 
-    if sc_name_line:
-        sc_connected = True if re.search(rxconn, sc_name_line) else False
-        #print("connected: ", sc_connected, "___++", sc_name_line)
-        screens.append(create_screen(sc_name_line, modes, edid_data, sc_connected))
+    Returns a list of (output line, modes, connected, current) with modes
+    and current as taken by make_screen.
+    """
+    rx = re.compile(r'^\s+(\d+)x(\d+)\s+(.*)$')
+    rxconn = re.compile(r'\sconnected\s')
 
-    return screens
+    outputs = []
+    for line in lines:
+        if not line or line.startswith('Screen '):
+            continue
+        if not line[0].isspace():
+            outputs.append([line, [], bool(re.search(rxconn, line + ' ')), None])
+            continue
+        r = re.match(rx, line)
+        if not r or not outputs:
+            continue
+        width = int(r.group(1))
+        height = int(r.group(2))
+        output = outputs[-1]
+        rates = []
+        for tok in r.group(3).split():
+            if tok == '+':
+                if rates:
+                    rates[-1][2] = True
+                continue
+            rates.append([float(tok.rstrip('*+')), '*' in tok, tok.endswith('+')])
+        for freq, current, preferred in rates:
+            if current:
+                output[3] = len(output[1])
+            output[1].append((width, height, freq, preferred))
+
+    return [tuple(output) for output in outputs]
+
+def parse_crtcs(lines):
+    """CRTCs of each output in xrandr --verbose output
+
+    Returns a dict of output name to (crtc, crtcs), the CRTC the output uses
+    (None when it is off) and the ones it can use.
+    """
+    result = {}
+    name = None
+    for line in lines:
+        if line and not line[0].isspace():
+            if ' connected ' in line or 'disconnected' in line:
+                name = line.split(' ')[0]
+                result[name] = (None, ())
+            continue
+        if name is None:
+            continue
+        r = _rxcrtc.match(line)
+        if r is None:
+            continue
+        crtc, crtcs = result[name]
+        if r.group(1) == 'CRTC':
+            crtc = int(r.group(2))
+        else:
+            crtcs = tuple(int(c) for c in r.group(2).split())
+        result[name] = (crtc, crtcs)
+    return result
+
+_rxcrtc = re.compile(r'^\s+(CRTCs?):\s+([\d ]*)$')
+
+def current_state(lines):
+    """Name to (resolution, position) of the outputs in xrandr --current
+    output, resolution and position are None for disabled outputs"""
+    state = {}
+    for line, modes, connected, index in parse_xrandr_current(lines):
+        position, _ = parse_geometry(line)
+        resolution = (modes[index][0], modes[index][1]) if index is not None else None
+        state[line.split(' ')[0]] = (resolution, position if resolution is not None else None)
+    return state
+
+def mismatched(expected, lines):
+    """Names of the outputs whose mode or position differ from expected
+
+    :expected: list of (name, resolution, position), None for both when
+        the output is to be off
+    :lines: output of xrandr --current
+    """
+    state = current_state(lines)
+    result = []
+    for name, resolution, position in expected:
+        if name not in state:
+            result.append(name)
+        elif resolution is None:
+            if state[name][0] is not None:
+                result.append(name)
+        elif state[name] != (tuple(resolution), tuple(position)):
+            result.append(name)
+    return result
+
+def requested(screens):
+    """The (name, resolution, position) settings of screens, for mismatched()"""
+    return [(s.name, tuple(s.set.resolution), tuple(s.set.position)) if s.set.is_enabled else (s.name, None, None)
+            for s in screens]
 
 def connected_screens():
     """Get connected screens
     """
     #return [s for s in parse_xrandr(exec_cmd('xrandr')) if s.is_connected()]
-    return [s for s in parse_xrandr(exec_cmd(['xrandr', '--verbose'])) if s.is_connected()]
+    return [s for s in screens() if s.is_connected()]
 
-def screens():
-    """Get connected screens
+def screens(probe=PROBE_XRANDR):
+    """Get connected screens, from the current backend
+
+    :probe: how xrandr probes, when no other backend is set
     """
-    #return [s for s in parse_xrandr(exec_cmd('xrandr')) if s.is_connected()]
-    return [s for s in parse_xrandr(exec_cmd(['xrandr', '--verbose']))]
+    if _backend is not None:
+        return _backend.screens()
+    return XrandrBackend(probe).screens()
+
+class Backend(object):
+    """Probes screens and applies their settings
+
+    screens() returns all outputs as Screens, apply() applies the settings
+    of the ones that changed (all with force) and returns what it did, or
+    None when nothing changed.
+    """
+    def screens(self):
+        raise NotImplementedError
+
+    def apply(self, screens, dryrun, force=False):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+def probe_steps(probe=PROBE_TIERED, env=None):
+    """How to probe the screens, see PROBES, for XrandrBackend and aiorandr
+
+    A generator: it yields the xrandr commands whose output it needs, is
+    sent their output lines and returns all outputs as Screens.
+
+    :env: environment of xrandr, its DISPLAY keys the remembered snapshot
+    """
+    probed = None
+    if probe == PROBE_TIERED:
+        import snapshot
+        snap = snapshot.Snapshot((yield ['xrandr', '--current']), snapshot.display_key(env))
+        probed = snap.screens()
+        if probed is None:
+            with timing.phase('full'):
+                probed = snap.sysfs_screens()
+                if probed is None:
+                    probed = parse_xrandr((yield ['xrandr', '--verbose']))
+            snap.remember(probed)
+    elif probe == PROBE_SYSFS:
+        import drm
+        with timing.phase('sysfs'):
+            conns = drm.connectors()
+        if conns:
+            probed = drm.build_screens(conns, (yield ['xrandr', '--current']))
+    if probed is None:
+        probed = parse_xrandr((yield ['xrandr', '--verbose']))
+    cache.edid_cache().save()
+    return probed
+
+def run_probe(steps, run):
+    """The screens of probe_steps(), run(cmd) returns the lines of cmd"""
+    try:
+        cmd = next(steps)
+        while True:
+            cmd = steps.send(run(cmd))
+    except StopIteration as e:
+        return e.value
+
+def xrandr_command(screens, force=False):
+    """The xrandr command applying the settings of screens that changed
+    (all with force), None when none did"""
+    cmd = ['xrandr']
+    for s in screens:
+        cmd = cmd + s.build_cmd(force)
+    return cmd if len(cmd) > 1 else None
+
+class XrandrBackend(Backend):
+    """Probes and applies screens by running xrandr
+
+    :display: X display name, $DISPLAY by default
+    :probe_timeout, apply_timeout: seconds before xrandr is killed, None waits forever
+    :transactional: apply in two phases that fit the CRTCs, verified and
+        rolled back, see transaction.py
+    """
+    def __init__(self, probe=PROBE_TIERED, display=None, probe_timeout=PROBE_TIMEOUT, apply_timeout=APPLY_TIMEOUT, transactional=False):
+        super(XrandrBackend, self).__init__()
+        self.probe = probe
+        self.display = display
+        self.probe_timeout = probe_timeout
+        self.apply_timeout = apply_timeout
+        self.transactional = transactional
+        self.env = None
+        if display is not None:
+            import os
+            self.env = dict(os.environ, DISPLAY=display)
+
+    def screens(self):
+        def run(cmd):
+            # the full probe is parsed while xrandr is still writing it
+            if cmd[-1] == '--verbose':
+                return stream_cmd(cmd, self.env, self.probe_timeout)
+            return exec_cmd(cmd, self.env, self.probe_timeout)
+        return run_probe(probe_steps(self.probe, self.env), run)
+
+    def apply(self, screens, dryrun, force=False):
+        cmd = xrandr_command(screens, force)
+        if cmd is None:
+            print("No changes, not running xrandr")
+            return None
+        if self.transactional:
+            return self.apply_transaction(screens, dryrun, force)
+        print(" ".join(cmd))
+        if not dryrun:
+            exec_cmd(cmd, self.env, self.apply_timeout)
+        return cmd
+
+    def apply_transaction(self, screens, dryrun, force=False):
+        """Returns the xrandr commands of the steps"""
+        import transaction
+        crtcs = parse_crtcs(exec_cmd(['xrandr', '--current', '--verbose'], self.env, self.probe_timeout))
+        t = transaction.Transaction(screens, crtcs,
+                                    lambda cmd: exec_cmd(cmd, self.env, self.apply_timeout),
+                                    lambda: exec_cmd(['xrandr', '--current'], self.env, self.probe_timeout),
+                                    force)
+        steps = t.steps()
+        for _, cmd in steps:
+            print(" ".join(cmd))
+        if not dryrun:
+            t.apply(steps)
+            print("Stable after {:.0f} ms, {} polls".format(1000 * t.stable, t.polls))
+        return [cmd for _, cmd in steps]
+
+_backend = None
+
+def set_backend(backend):
+    """Make screens() and xrandr_apply() use backend, None for xrandr
+
+    Returns the previous backend.
+    """
+    global _backend
+    previous = _backend
+    _backend = backend
+    return previous
+
+def get_backend():
+    """The backend set with set_backend, or xrandr"""
+    return _backend if _backend is not None else XrandrBackend(PROBE_XRANDR)
+
+def backend(name=BACKEND_XRANDR, probe=PROBE_TIERED, display=None, probe_timeout=PROBE_TIMEOUT, apply_timeout=APPLY_TIMEOUT, transactional=False):
+    """The backend called name, see BACKENDS
+
+    :display: X display name, $DISPLAY by default
+    :probe_timeout, apply_timeout: seconds before xrandr is killed
+    :transactional: see XrandrBackend
+    """
+    if name == BACKEND_XLIB:
+        import xlibrandr
+        return xlibrandr.XlibBackend(display)
+    if name != BACKEND_XRANDR:
+        raise ValueError('Unknown backend', name)
+    return XrandrBackend(probe, display, probe_timeout, apply_timeout, transactional)
 
 def enabled_screens():
     return [s for s in connected_screens() if s.is_enabled()]
@@ -413,5 +936,5 @@ def enabled_screens():
 if __name__ == "__main__":
     #print(parse_xrandr(exec_cmd('xrandr')))
     print("--------------------------------------------------------------------------")
-    for x in parse_xrandr(exec_cmd(['xrandr', '--verbose'])):
+    for x in iter_xrandr(stream_cmd(['xrandr', '--verbose'])):
         print(x)
\ No newline at end of file
@@ -0,0 +1,164 @@
+"""Serialise the reconfigurations of concurrent auto.py runs
+
+udev rules, lid switch and resume hooks may all start auto.py at once. A
+run registers its request in a state file and takes the apply lock of its
+display. When another request is pending or came in less than the coalesce
+window ago, it waits for the window first; a run alone goes ahead at once.
+When a newer request came in meanwhile, the run drops out: the newer one
+probes and applies for both. Modesets are at least min_interval seconds
+apart.
+
+Both files live in $XDG_RUNTIME_DIR/auto-randr (the cache directory when it
+is not set), the locks are flock()s, released by the kernel when a run dies.
+"""
+import contextlib
+import fcntl
+import json
+import os
+import re
+import time
+
+import cache
+
+# Seconds a request waits for newer ones to merge into
+COALESCE_WINDOW = 0.2
+
+# Seconds between the end of a modeset and the start of the next one
+MIN_INTERVAL = 1.0
+
+def runtime_dir():
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    return os.path.join(runtime, 'auto-randr') if runtime else cache.CACHE_DIR
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class Ticket(object):
+    """A request, waited is in seconds
+
+    :superseded: a newer request applies instead of this one
+    :merged: seconds waited by each request this one applies for, itself
+        included, oldest first
+    """
+    def __init__(self, seq, requested):
+        super(Ticket, self).__init__()
+        self.seq = seq
+        self.requested = requested
+        self.superseded = False
+        self.merged = []
+        self.waited = 0.0
+        self.applied = True
+        self.lock_fd = None
+
+    def describe(self):
+        if self.superseded:
+            return "Merged into a newer request after {:.0f} ms".format(1000 * self.waited)
+        return "Applying {} request{}, waited {} ms".format(
+            len(self.merged), "s" if len(self.merged) != 1 else "",
+            ", ".join("{:.0f}".format(1000 * w) for w in self.merged))
+
+class Scheduler(object):
+    """Apply scheduler of one display
+
+    :key: the display, e.g. $DISPLAY
+    :window: COALESCE_WINDOW when None
+    :min_interval: MIN_INTERVAL when None
+    """
+    def __init__(self, key='', window=None, min_interval=None, directory=None):
+        super(Scheduler, self).__init__()
+        if directory is None:
+            directory = runtime_dir()
+        name = re.sub(r'[^\w.-]', '_', key) or 'default'
+        self.lock_path = os.path.join(directory, 'apply-{}.lock'.format(name))
+        self.state_path = os.path.join(directory, 'apply-{}.json'.format(name))
+        self.window = window if window is not None else COALESCE_WINDOW
+        self.min_interval = min_interval if min_interval is not None else MIN_INTERVAL
+
+    @contextlib.contextmanager
+    def _state(self):
+        """The state, rewritten in place on exit, the file is its own lock"""
+        os.makedirs(os.path.dirname(self.state_path), mode=0o700, exist_ok=True)
+        fd = os.open(self.state_path, os.O_RDWR | os.O_CREAT, 0o600)
+        with os.fdopen(fd, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                state = json.loads(f.read() or '{}')
+            except ValueError:
+                state = {}
+            state.setdefault('seq', 0)
+            state.setdefault('pending', [])
+            state.setdefault('last_apply', 0.0)
+            state.setdefault('last_request', 0.0)
+            yield state
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+
+    def acquire(self):
+        """Register a request and wait for its turn
+
+        Returns a Ticket, the apply lock is held unless it is superseded.
+        """
+        with self._state() as state:
+            state['seq'] += 1
+            ticket = Ticket(state['seq'], time.time())
+            contended = ticket.requested - state['last_request'] < self.window or \
+                any(_alive(p[2]) for p in state['pending'])
+            state['pending'].append([ticket.seq, ticket.requested, os.getpid()])
+            state['last_request'] = ticket.requested
+        # part of a burst: give newer requests the window to come in, the
+        # newest one then applies for all
+        if contended and self.window > 0:
+            time.sleep(self.window)
+
+        ticket.lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(ticket.lock_fd, fcntl.LOCK_EX)
+        while True:
+            with self._state() as state:
+                pending = [p for p in state['pending'] if p[0] <= ticket.seq or _alive(p[2])]
+                state['pending'] = pending
+                now = time.time()
+                # gone when a newer request already applied for it
+                if ticket.seq not in [p[0] for p in pending] or any(p[0] > ticket.seq for p in pending):
+                    ticket.superseded = True
+                    ticket.waited = now - ticket.requested
+                    self._unlock(ticket)
+                    return ticket
+                delay = state['last_apply'] + self.min_interval - now
+                if delay <= 0:
+                    ticket.merged = [now - p[1] for p in pending]
+                    ticket.waited = now - ticket.requested
+                    state['pending'] = []
+                    return ticket
+            time.sleep(delay)
+
+    def release(self, ticket, applied=True):
+        """End the turn of ticket; when it applied a modeset, the next one
+        starts min_interval later"""
+        if ticket.superseded:
+            return
+        if applied:
+            with self._state() as state:
+                state['last_apply'] = time.time()
+        self._unlock(ticket)
+
+    def _unlock(self, ticket):
+        if ticket.lock_fd is not None:
+            os.close(ticket.lock_fd)
+            ticket.lock_fd = None
+
+    @contextlib.contextmanager
+    def turn(self):
+        """acquire() and release() around a reconfiguration, which can set
+        ticket.applied to False when it left the screens as they were"""
+        ticket = self.acquire()
+        try:
+            yield ticket
+        finally:
+            self.release(ticket, ticket.applied)
@@ -0,0 +1,291 @@
+"""Serve status, plan, apply and print-modes over a Unix socket
+
+    python auto.py --server [--daemon]
+    python client.py status
+
+The server keeps the probed Screens, their decoded EDIDs, the PNP table and
+the last applied plan in memory, so a query costs a round trip instead of
+a Python start, the imports and a probe. The screens are probed again on
+every hotplug event (applying the layout too with --daemon) and before every
+apply. Requests are served in threads, one at a time.
+"""
+import contextlib
+import io
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import auto
+import client
+import displays
+import randr
+import timing
+
+_stdout = None
+_stdout_lock = threading.Lock()
+
+@contextlib.contextmanager
+def _captured(output):
+    """Send what this thread prints to output, other threads print as before"""
+    global _stdout
+    with _stdout_lock:
+        if _stdout is None or sys.stdout is not _stdout:
+            _stdout = displays.ThreadStdout(sys.stdout)
+            sys.stdout = _stdout
+    _stdout.local.buffer = output
+    try:
+        yield
+    finally:
+        _stdout.local.buffer = None
+
+class Server(object):
+    """Warm state of a display and the commands of the protocol
+
+    :defaults: the options of plan and apply, as parse_options returns them
+    :scheduler: a scheduler.Scheduler applies go through, or None
+    """
+    def __init__(self, backend, defaults, scheduler=None, gnome_save_file=None):
+        super(Server, self).__init__()
+        self.backend = backend
+        self.defaults = defaults
+        self.scheduler = scheduler
+        self.gnome_save_file = gnome_save_file
+        self.lock = threading.Lock()
+        self.screens = None
+        self.probed_at = None
+        self.applied = None
+        self.applied_at = None
+
+    def parse_options(self, options):
+        """The defaults updated with a list of "key=value"
+
+        Raises ValueError on unknown options or values.
+        """
+        result = dict(self.defaults)
+        for option in options:
+            key, _, value = option.partition('=')
+            if key == 'setup':
+                if value not in auto.SETUPS:
+                    raise ValueError('setup must be one of', auto.SETUPS)
+                result['setup'] = value
+            elif key == 'density':
+                if value not in auto.DENSITIES:
+                    raise ValueError('density must be one of', auto.DENSITIES)
+                result['density'] = value
+            elif key == 'align':
+                if value not in (auto.ALIGN_BOTTOM, auto.ALIGN_TOP):
+                    raise ValueError('align must be one of', [auto.ALIGN_BOTTOM, auto.ALIGN_TOP])
+                result['align'] = value
+            elif key == 'min-rate':
+                result['min_rate'] = float(value)
+            elif key == 'objective':
+                import solver
+                result['objective'] = solver.parse_objective(value)
+            elif key == 'force':
+                result['force'] = value not in ('', '0', 'false', 'no')
+            else:
+                raise ValueError('Unknown option', key)
+        return result
+
+    def current(self):
+        """The screens, probed when they are not warm, the lock is held"""
+        if self.screens is None:
+            with timing.phase('probe'):
+                self.screens = self.backend.screens()
+            self.probed_at = time.time()
+        return self.screens
+
+    def refresh(self):
+        """Probe the screens again, e.g. after a hotplug event"""
+        with self.lock:
+            self.screens = None
+            self.current()
+
+    def status(self):
+        """Print the screens and the last apply, probing first when a
+        hotplug event or a failed probe left no screens, the lock is held"""
+        screens = self.current()
+        now = time.time()
+        lines = ["probed {:.1f} s ago".format(now - self.probed_at) if self.probed_at is not None else "probe time unknown"]
+        for s in screens:
+            if not s.is_connected() and not s.is_enabled():
+                continue
+            if s.curr_mode is None:
+                lines.append("{} off".format(s.name))
+                continue
+            position = s.curr_position or (0, 0)
+            lines.append("{} {}x{}@{:.2f} +{}+{}{}{}".format(
+                s.name, s.curr_mode.width, s.curr_mode.height, s.curr_mode.freq, position[0], position[1],
+                " primary" if s.primary else "", "" if s.is_connected() else " disconnected"))
+        if self.applied is not None:
+            lines.append("last apply {:.1f} s ago: {}".format(now - self.applied_at, self.applied))
+        print("\n".join(lines))
+
+    def plan(self, options, dry_run, print_modes=False):
+        """Lay out the screens and apply them unless dry_run, the lock is held
+
+        Returns whether a modeset was applied.
+        """
+        if not dry_run:
+            # the layout may have changed since the last probe
+            self.screens = None
+        screens = self.current()
+        for s in screens:
+            s.set.reset()
+            s.set.is_enabled = s.is_enabled()
+        cs = auto.prepare(screens, options['setup'], options['density'], print_modes, options['align'],
+                          options['min_rate'], True, options['objective'])
+        with timing.phase('apply'):
+            done = self.backend.apply(screens, dry_run, options['force'])
+        if dry_run:
+            return False
+        # probe the new layout now, not in the next query
+        self.screens = None
+        self.current()
+        if done is not None:
+            self.applied = _describe(done)
+            self.applied_at = time.time()
+        if self.gnome_save_file is not None:
+            auto.save_gnome(cs, self.gnome_save_file)
+        return done is not None
+
+    def apply(self, options):
+        """plan() through the scheduler, without holding the lock while
+        waiting for it"""
+        ticket = None
+        if self.scheduler is not None:
+            ticket = self.scheduler.acquire()
+            print(ticket.describe())
+            if ticket.superseded:
+                return
+        applied = False
+        try:
+            with self.lock:
+                applied = self.plan(options, self.defaults['dry_run'])
+        finally:
+            if ticket is not None:
+                self.scheduler.release(ticket, applied)
+
+    def handle(self, line):
+        """Run the request line, returns (ok, output)"""
+        words = line.split()
+        if not words or words[0] not in client.COMMANDS:
+            return False, "unknown command, one of: {}\n".format(", ".join(client.COMMANDS))
+        command = words[0]
+        output = io.StringIO()
+        ok = True
+        try:
+            options = self.parse_options(words[1:])
+            with _captured(output):
+                if command == 'apply':
+                    self.apply(options)
+                else:
+                    with self.lock:
+                        if command == 'status':
+                            self.status()
+                        else:
+                            self.plan(options, True, command == 'print-modes')
+        except Exception as e:
+            ok = False
+            output.write(repr(e) + "\n")
+        return ok, output.getvalue()
+
+def _describe(done):
+    """What a backend did, one xrandr command, steps of xrandr commands or
+    anything else"""
+    if isinstance(done, list) and all(isinstance(c, str) for c in done):
+        return " ".join(done)
+    if isinstance(done, list) and all(isinstance(c, list) for c in done):
+        return "; ".join(" ".join(c) for c in done)
+    return repr(done)
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        start = time.perf_counter()
+        line = self.rfile.readline(4096).decode('utf-8', 'replace').strip()
+        ok, output = self.server.state.handle(line)
+        self.wfile.write((("ok" if ok else "error") + "\n" + output).encode('utf-8'))
+        if self.server.log is not None:
+            self.server.log.write("{} {} {:.1f} ms\n".format(line, "ok" if ok else "failed", 1000 * (time.perf_counter() - start)))
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    # connecting to a unix socket with a full backlog fails at once
+    request_queue_size = 64
+
+def listen(state, path, log=sys.stderr):
+    """A socket server for state on path, not serving yet
+
+    :log: where each request is logged with its time, None for nowhere
+
+    Raises RuntimeError when another server listens on path.
+    """
+    if os.path.exists(path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(path)
+            except OSError:
+                # left behind by a server that died
+                os.unlink(path)
+            else:
+                raise RuntimeError('A server already listens on', path)
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    server = _UnixServer(path, _Handler)
+    os.chmod(path, 0o600)
+    server.state = state
+    server.log = log
+    return server
+
+def serve(state, path=None, source=None, debounce=1.0, reconfigure=False):
+    """Serve state on path (client.socket_path() by default) until
+    interrupted
+
+    :source: hotplug event source the screens are probed again on, None
+        to only probe them on apply
+    :reconfigure: apply the layout on every settled burst of events too
+    """
+    if path is None:
+        path = client.socket_path()
+    server = listen(state, path)
+    randr.index_modes()
+
+    def on_hotplug():
+        if reconfigure:
+            ok, output = state.handle('apply')
+        else:
+            try:
+                state.refresh()
+                ok, output = state.handle('status')
+            except Exception as e:
+                # keep serving, the next hotplug event may well probe
+                output = "Probe failed: {!r}\n".format(e)
+        sys.stderr.write(output)
+
+    if source is not None:
+        import hotplug
+        watcher = threading.Thread(target=hotplug.run, args=(source, on_hotplug, debounce))
+        watcher.daemon = True
+        watcher.start()
+    else:
+        with state.lock:
+            state.current()
+    sys.stderr.write("Listening on {}\n".format(path))
+    if threading.current_thread() is threading.main_thread():
+        import signal
+        # exit through the finally below, which removes the socket
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if source is not None:
+            source.close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
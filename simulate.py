@@ -0,0 +1,235 @@
+"""Simulated display server, for hotplug load tests without X
+
+    python simulate.py                      # all scenarios
+    python simulate.py flaky-dock --debounce 0.2 --modeset-latency 0.5
+
+Time is simulated: connector events, probe and modeset latencies advance a
+virtual clock, so a minute long hotplug storm runs in a fraction of a second.
+"""
+import contextlib
+import io
+import random
+
+import corpus
+import randr
+
+# Seconds a probe and a modeset take, by default
+PROBE_LATENCY = 0.05
+MODESET_LATENCY = 0.25
+
+class SimulatedServer(object):
+    """Outputs and the monitors plugged into them, as corpus.Outputs
+
+    :outputs: list of output names
+    :monitors: dict of output name to the monitor (a corpus.Output, only its
+        EDID and modes are used) plugged in at the start
+
+    """
+    def __init__(self, outputs, monitors=None, probe_latency=PROBE_LATENCY, modeset_latency=MODESET_LATENCY):
+        super(SimulatedServer, self).__init__()
+        self.clock = 0.0
+        self.probe_latency = probe_latency
+        self.modeset_latency = modeset_latency
+        self.outputs = [corpus.Output(name) for name in outputs]
+        self.probes = 0
+        self.modesets = 0
+        for name, monitor in (monitors or {}).items():
+            self.plug(name, monitor)
+
+    def output(self, name):
+        for o in self.outputs:
+            if o.name == name:
+                return o
+        raise KeyError(name)
+
+    def plug(self, name, monitor):
+        """Connect monitor to output name, None disconnects it"""
+        o = self.output(name)
+        o.edid = monitor.edid if monitor is not None else None
+        o.modes = list(monitor.modes) if monitor is not None else []
+        # the output keeps scanning out until it is reconfigured, a
+        # disconnected one is dropped by the X server
+        if monitor is None:
+            o.current = None
+
+    def verbose(self):
+        """Lines of xrandr --verbose for the current state"""
+        return corpus.verbose_output(self.outputs)
+
+    def screens(self):
+        self.clock += self.probe_latency
+        self.probes += 1
+        return randr.parse_xrandr(self.verbose())
+
+    def apply(self, screens, force=False):
+        """Apply the settings of the screens that changed, in one modeset
+
+        Returns the number of outputs changed.
+        """
+        changed = [s for s in screens if force or s.has_changed()]
+        if not changed:
+            return 0
+        for s in changed:
+            o = self.output(s.name)
+            if not s.set.is_enabled:
+                o.current = None
+                continue
+            o.current = self.mode_index(o, s)
+            o.position = tuple(s.set.position)
+            o.primary = s.set.is_primary
+        self.clock += self.modeset_latency
+        self.modesets += 1
+        return len(changed)
+
+    def mode_index(self, output, screen):
+        width, height = screen.set.resolution
+        for i, (w, h, rate) in enumerate(output.modes):
+            if (w, h) == (width, height) and (not screen.set.freq or abs(rate - screen.set.freq) <= randr.RATE_EPS):
+                return i
+        raise ValueError('Requested mode is not supported', screen.name, screen.set.resolution, screen.set.freq)
+
+    def is_stable(self):
+        """Whether exactly the connected outputs are on"""
+        return all((o.edid is not None) == (o.current is not None) for o in self.outputs)
+
+class SimulatedBackend(randr.Backend):
+    def __init__(self, server):
+        super(SimulatedBackend, self).__init__()
+        self.server = server
+
+    def screens(self):
+        return self.server.screens()
+
+    def apply(self, screens, dryrun, force=False):
+        if dryrun:
+            return None
+        return self.server.apply(screens, force) or None
+
+class SimulatedEventSource(object):
+    """Plays a timeline of connector changes as hotplug events
+
+    :timeline: list of (time in seconds, output name, corpus.Output or None)
+
+    """
+    def __init__(self, server, timeline):
+        super(SimulatedEventSource, self).__init__()
+        self.server = server
+        self.timeline = sorted(timeline, key=lambda e: e[0])
+        self.events = 0
+        self.last_event = 0.0
+
+    def now(self):
+        return self.server.clock
+
+    def wait(self, timeout):
+        if not self.timeline:
+            if timeout is None:
+                return None
+            self.server.clock += timeout
+            return False
+        at, name, monitor = self.timeline[0]
+        clock = self.server.clock
+        # events during a probe or modeset are already pending
+        if timeout is not None and at > clock + timeout:
+            self.server.clock = clock + timeout
+            return False
+        self.timeline.pop(0)
+        self.server.clock = max(clock, at)
+        self.server.plug(name, monitor)
+        self.events += 1
+        self.last_event = at
+        return True
+
+    def close(self):
+        pass
+
+def monitors(count, modes=20, seed=0):
+    """count monitors, the first one a laptop panel"""
+    return corpus.synthetic_outputs(count, modes, seed)
+
+def flaky_dock(seconds=2.0, rate=20):
+    """A dock dropping and restoring its monitor rate times a second"""
+    laptop, external = monitors(2)
+    timeline = []
+    for i in range(int(seconds * rate)):
+        timeline.append((1.0 + i / float(rate), "DP-1", None if i % 2 == 0 else external))
+    return ["eDP-1", "DP-1"], {"eDP-1": laptop, "DP-1": external}, timeline
+
+def mst_hub(outputs=12, interval=0.05):
+    """A hub bringing up its outputs one after the other"""
+    ms = monitors(outputs + 1)
+    names = ["DP-{}".format(i + 1) for i in range(outputs)]
+    timeline = [(1.0 + i * interval, name, ms[i + 1]) for i, name in enumerate(names)]
+    return ["eDP-1"] + names, {"eDP-1": ms[0]}, timeline
+
+def storm(outputs=4, seconds=5.0, rate=20, seed=0):
+    """Random connects and disconnects on several outputs"""
+    rng = random.Random(seed)
+    ms = monitors(outputs + 1, seed=seed)
+    names = ["DP-{}".format(i + 1) for i in range(outputs)]
+    connected = dict((name, False) for name in names)
+    timeline = []
+    for i in range(int(seconds * rate)):
+        name = rng.choice(names)
+        connected[name] = not connected[name]
+        timeline.append((1.0 + i / float(rate), name, ms[names.index(name) + 1] if connected[name] else None))
+    return ["eDP-1"] + names, {"eDP-1": ms[0]}, timeline
+
+SCENARIOS = {
+    'flaky-dock': flaky_dock,
+    'mst-hub': mst_hub,
+    'storm': storm,
+}
+
+class Report(object):
+    def __init__(self, name, events, runs, probes, modesets, time_to_stable, stable):
+        super(Report, self).__init__()
+        self.name = name
+        self.events = events
+        self.runs = runs
+        self.probes = probes
+        self.modesets = modesets
+        self.time_to_stable = time_to_stable
+        self.stable = stable
+
+def run(name, outputs, initial, timeline, debounce, probe_latency=PROBE_LATENCY, modeset_latency=MODESET_LATENCY):
+    """Run the hotplug daemon against a simulated server
+
+    time_to_stable is the simulated time from the last event to the end of
+    the last modeset (or probe) of the daemon, debouncing included.
+    """
+    import auto
+    server = SimulatedServer(outputs, initial, probe_latency, modeset_latency)
+    source = SimulatedEventSource(server, timeline)
+    backend = SimulatedBackend(server)
+    main_args = (False, None, auto.DENSITY_ANY, False, False, None, auto.ALIGN_BOTTOM, 0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        runs = auto.daemon(source, debounce, *main_args, plan_cache=False, backend=backend)
+    return Report(name, source.events, runs, server.probes, server.modesets,
+                  server.clock - source.last_event, server.is_stable())
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    import cache
+
+    parser = argparse.ArgumentParser(description='Hotplug load tests against a simulated display server')
+    parser.add_argument("scenarios", help='scenarios to run ['+", ".join(sorted(SCENARIOS))+'], all by default', nargs='*')
+    parser.add_argument("--debounce", help='seconds to wait for hotplug events to settle [1.0]', default = 1.0, type=float)
+    parser.add_argument("--probe-latency", help='seconds a probe takes ['+str(PROBE_LATENCY)+']', default = PROBE_LATENCY, type=float)
+    parser.add_argument("--modeset-latency", help='seconds a modeset takes ['+str(MODESET_LATENCY)+']', default = MODESET_LATENCY, type=float)
+
+    args = parser.parse_args()
+
+    # keep the caches of the user out of it
+    cache.CACHE_DIR = tempfile.mkdtemp()
+
+    print("{:<12} {:>7} {:>5} {:>7} {:>9} {:>15} {:>7}".format(
+        "scenario", "events", "runs", "probes", "modesets", "time to stable", "stable"))
+    for name in args.scenarios or sorted(SCENARIOS):
+        if name not in SCENARIOS:
+            parser.error("unknown scenario: "+name)
+        r = run(name, *SCENARIOS[name](), debounce=args.debounce,
+                probe_latency=args.probe_latency, modeset_latency=args.modeset_latency)
+        print("{:<12} {:>7} {:>5} {:>7} {:>9} {:>14.2f}s {:>7}".format(
+            r.name, r.events, r.runs, r.probes, r.modesets, r.time_to_stable, "yes" if r.stable else "no"))
@@ -0,0 +1,137 @@
+"""Two tier probing: a cheap snapshot first, a full probe only on change
+
+The snapshot is the status of the drm connectors in sysfs with their epoch
+where the kernel has it, else a digest of the EDID the kernel cached, and
+the output of xrandr --current, which does not reprobe. Its digest is
+compared with the one remembered, per display, by the last run. When they
+match, the screens are built from xrandr --current and the EDIDs and scales
+of the last run, without touching the DDC bus. Otherwise the screens are
+probed from sysfs or, when X has not caught up with the kernel, with a full
+xrandr --verbose.
+"""
+import hashlib
+import json
+import os
+import re
+
+import cache
+import drm
+import randr
+import timing
+
+# Bump when the digest or the remembered state change
+STATE_VERSION = 3
+
+def connector_digest(sysfs, outputs):
+    """Digest of the connector set
+
+    :sysfs: list of (connector, status, epoch, EDID digest) from
+        drm.connector_states()
+    :outputs: list of (output name, connected, resolutions)
+    """
+    outputs = sorted([name, connected, sorted(set(resolutions))] for name, connected, resolutions in outputs)
+    return hashlib.sha1(json.dumps([sysfs, outputs]).encode('utf-8')).hexdigest()
+
+def current_digest(sysfs, current):
+    """connector_digest of parsed xrandr --current output"""
+    return connector_digest(sysfs, [(line.split(' ')[0], connected, [(m[0], m[1]) for m in modes])
+                                    for line, modes, connected, _ in current])
+
+def screens_digest(sysfs, screens):
+    """connector_digest of probed screens"""
+    return connector_digest(sysfs, [(s.name, s.is_connected(), [(m.width, m.height) for m in s.modes()])
+                                    for s in screens])
+
+def display_key(env=None):
+    return (env if env is not None else os.environ).get('DISPLAY', '')
+
+_rxsize = re.compile(r'\s(\d+)x(\d+)[+-]\d+[+-]\d+')
+
+def geometry(line, modes, index):
+    """[size on the screen, size of the current mode] of an output of parsed
+    xrandr --current output, None when it is off"""
+    r = _rxsize.search(line)
+    if r is None or index is None:
+        return None
+    return [[int(r.group(1)), int(r.group(2))], list(modes[index][:2])]
+
+def remembered(current, state):
+    """Screens of parsed xrandr --current output with the EDIDs and scales
+    of state, None when a connected output has no EDID or its scale is
+    unknown"""
+    edids = state['edids']
+    scales = state['scales']
+    result = []
+    for line, modes, connected, index in current:
+        name = line.split(' ')[0]
+        edid = None
+        scale = None
+        if connected:
+            if name not in edids:
+                return None
+            edid = bytes.fromhex(edids[name]) if edids[name] else None
+        size = geometry(line, modes, index)
+        if size is not None:
+            # xrandr --current has no transform: the remembered scale holds
+            # while the output shows the same mode at the same size, an
+            # output showing its mode as is (maybe rotated) is not scaled
+            if name in scales and scales[name][1] == size:
+                scale = scales[name][0]
+            elif size[0] in (size[1], size[1][::-1]):
+                scale = [1.0, 1.0]
+            else:
+                return None
+        result.append(randr.make_screen(line, modes, edid, connected, scale, index))
+    return result
+
+def probed_state(sysfs, current, screens):
+    """The state remembered for fully probed screens, current being the
+    parsed xrandr --current output of the snapshot"""
+    edids = {}
+    for s in screens:
+        if s.is_connected():
+            edids[s.name] = bytes(s.edid).hex() if s.edid is not None else None
+    scales = {}
+    probed = dict((s.name, s) for s in screens)
+    for line, modes, connected, index in current:
+        name = line.split(' ')[0]
+        size = geometry(line, modes, index)
+        if size is not None and name in probed:
+            scales[name] = [list(probed[name].curr_scale or [1.0, 1.0]), size]
+    return {'digest': screens_digest(sysfs, screens), 'edids': edids, 'scales': scales}
+
+class Snapshot(object):
+    """A snapshot of the connectors of one display
+
+    :lines: output of xrandr --current
+    """
+    def __init__(self, lines, key, root=drm.SYSFS_DRM):
+        super(Snapshot, self).__init__()
+        self.lines = lines
+        self.key = key
+        self.root = root
+        with timing.phase('snapshot'):
+            self.sysfs = drm.connector_states(root)
+            self.current = randr.parse_xrandr_current(lines)
+            self.digest = current_digest(self.sysfs, self.current)
+
+    def screens(self):
+        """The screens when nothing changed since the last run, else None"""
+        state = cache.probe_cache(STATE_VERSION).get(self.key)
+        if state is None or state['digest'] != self.digest:
+            return None
+        return remembered(self.current, state)
+
+    def sysfs_screens(self):
+        """The screens probed from sysfs, None when X has not caught up"""
+        if not self.sysfs:
+            return None
+        with timing.phase('sysfs'):
+            conns = drm.connectors(self.root)
+        return drm.build_screens(conns, self.lines)
+
+    def remember(self, screens):
+        """Store the digest, EDIDs and scales of fully probed screens"""
+        states = cache.probe_cache(STATE_VERSION)
+        states.put(self.key, probed_state(self.sysfs, self.current, screens))
+        states.save()
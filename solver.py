@@ -0,0 +1,177 @@
+"""Branch and bound search for the modes of all screens together
+
+The objective is a weighted sum of terms between 0 and 1, higher is better:
+
+    pixels  pixels of the chosen modes, relative to the largest modes
+    dpi     how close the densities of the screens are
+    edges   how close the heights of the screens are
+    rate    the lowest refresh rate, relative to the highest available
+
+dpi, edges and rate only get worse as screens are added, and each remaining
+screen adds at least its closest candidate, so a partial assignment bounds
+every completion of it, and branches below the best complete assignment are
+cut.
+"""
+import randr
+
+PIXELS = 'pixels'
+DPI = 'dpi'
+EDGES = 'edges'
+RATE = 'rate'
+
+DEFAULT_OBJECTIVE = {PIXELS: 1.0, DPI: 0.5, EDGES: 0.5, RATE: 0.25}
+
+# Resolutions considered per screen, largest first
+MAX_CANDIDATES = 8
+
+def parse_objective(text):
+    """Weights from "pixels=1,dpi=0.5", missing terms weigh 0
+
+    Raises ValueError on unknown terms or bad weights.
+    """
+    objective = dict((term, 0.0) for term in DEFAULT_OBJECTIVE)
+    for item in text.split(','):
+        term, _, weight = item.partition('=')
+        term = term.strip()
+        if term not in objective:
+            raise ValueError('Unknown objective term', term)
+        objective[term] = float(weight) if weight else 1.0
+    return objective
+
+def candidates(screen, density=randr.DENSITY_ANY, min_rate=0):
+    """Highest rate mode of each resolution meeting density and min_rate,
+    largest first, all resolutions when none does"""
+    def allowed(m):
+        if density == randr.DENSITY_HD and m.dpi > randr.DENSITY_4K_THRESHOLD:
+            return False
+        if density == randr.DENSITY_4K and m.dpi < randr.DENSITY_4K_THRESHOLD:
+            return False
+        return m.freq >= min_rate
+
+    modes = [m for m in screen.modes() if allowed(m)] or list(screen.modes())
+    best = {}
+    for m in modes:
+        key = (m.width, m.height)
+        if key not in best or m.freq > best[key].freq:
+            best[key] = m
+    return sorted(best.values(), key=lambda m: (m.width * m.height, m.freq), reverse=True)[:MAX_CANDIDATES]
+
+def arrange(screens, modes, first=None):
+    """Order screens left to right so neighbouring heights differ least
+
+    :first: a screen kept leftmost, e.g. the builtin panel
+    """
+    height = dict((id(s), m.height) for s, m in zip(screens, modes))
+    rest = [s for s in screens if s is not first]
+    if first is None:
+        return sorted(rest, key=lambda s: height[id(s)], reverse=True)
+
+    def cost(order):
+        return sum(abs(height[id(a)] - height[id(b)]) for a, b in zip(order, order[1:]))
+
+    orders = [[first] + sorted(rest, key=lambda s: height[id(s)], reverse=reverse) for reverse in (True, False)]
+    return min(orders, key=cost)
+
+def _min(a, b):
+    return a if b is None else (b if a is None else min(a, b))
+
+def _max(a, b):
+    return a if b is None else (b if a is None else max(a, b))
+
+class Solution(object):
+    """Best modes, parallel to the screens, and their left to right order"""
+    def __init__(self, screens, modes, order, score, visited):
+        super(Solution, self).__init__()
+        self.screens = screens
+        self.modes = modes
+        self.order = order
+        self.score = score
+        self.visited = visited
+
+def solve(screens, objective=None, density=randr.DENSITY_ANY, min_rate=0, first=None):
+    """The modes of screens maximising objective, see the module docstring
+
+    Returns a Solution, visited counts the partial assignments searched.
+    """
+    if objective is None:
+        objective = DEFAULT_OBJECTIVE
+    w_pixels = objective.get(PIXELS, 0.0)
+    w_dpi = objective.get(DPI, 0.0)
+    w_edges = objective.get(EDGES, 0.0)
+    w_rate = objective.get(RATE, 0.0)
+
+    options = [candidates(s, density, min_rate) for s in screens]
+    # fewest choices first, so the deep levels branch the most and are cut
+    levels = sorted(range(len(screens)), key=lambda i: len(options[i]))
+    level_options = [options[i] for i in levels]
+    max_pixels = [c[0].width * c[0].height for c in level_options]
+    total_pixels = float(sum(max_pixels)) or 1.0
+    # best pixels of the levels still to assign
+    remaining_pixels = [sum(max_pixels[i:]) for i in range(len(levels) + 1)]
+    top_rate = max([m.freq for c in level_options for m in c] or [1.0]) or 1.0
+
+    # What the remaining levels add at least, whatever mode they get: the
+    # highest of their lowest dpis and heights, the lowest of their highest
+    # dpis, heights and rates
+    n = len(levels)
+    dpi_floor = [None] * (n + 1)
+    dpi_ceiling = [None] * (n + 1)
+    h_floor = [None] * (n + 1)
+    h_ceiling = [None] * (n + 1)
+    rate_ceiling = [None] * (n + 1)
+    for i in reversed(range(n)):
+        c = level_options[i]
+        dpi_floor[i] = _max(dpi_floor[i + 1], min(m.dpi for m in c))
+        dpi_ceiling[i] = _min(dpi_ceiling[i + 1], max(m.dpi for m in c))
+        h_floor[i] = _max(h_floor[i + 1], min(m.height for m in c))
+        h_ceiling[i] = _min(h_ceiling[i + 1], max(m.height for m in c))
+        rate_ceiling[i] = _min(rate_ceiling[i + 1], max(m.freq for m in c))
+
+    def score(pixels, dpi_min, dpi_max, h_min, h_max, rate_min):
+        s = w_pixels * pixels / total_pixels
+        if dpi_max:
+            s += w_dpi * (1.0 - (dpi_max - dpi_min) / dpi_max)
+        else:
+            s += w_dpi
+        if h_max:
+            s += w_edges * (1.0 - (h_max - h_min) / float(h_max))
+        else:
+            s += w_edges
+        s += w_rate * (rate_min if rate_min is not None else top_rate) / top_rate
+        return s
+
+    best = [None, None]
+    chosen = [None] * len(levels)
+    visited = [0]
+
+    def search(level, pixels, dpi_min, dpi_max, h_min, h_max, rate_min):
+        visited[0] += 1
+        if level == len(levels):
+            s = score(pixels, dpi_min, dpi_max, h_min, h_max, rate_min)
+            if best[0] is None or s > best[0]:
+                best[0] = s
+                best[1] = list(chosen)
+            return
+        for m in level_options[level]:
+            n_dpi_min = m.dpi if dpi_min is None else min(dpi_min, m.dpi)
+            n_dpi_max = m.dpi if dpi_max is None else max(dpi_max, m.dpi)
+            n_h_min = m.height if h_min is None else min(h_min, m.height)
+            n_h_max = m.height if h_max is None else max(h_max, m.height)
+            n_rate_min = m.freq if rate_min is None else min(rate_min, m.freq)
+            n_pixels = pixels + m.width * m.height
+            rest = level + 1
+            bound = score(n_pixels + remaining_pixels[rest],
+                          _min(n_dpi_min, dpi_ceiling[rest]), _max(n_dpi_max, dpi_floor[rest]),
+                          _min(n_h_min, h_ceiling[rest]), _max(n_h_max, h_floor[rest]),
+                          _min(n_rate_min, rate_ceiling[rest]))
+            if best[0] is not None and bound <= best[0]:
+                continue
+            chosen[level] = m
+            search(level + 1, n_pixels, n_dpi_min, n_dpi_max, n_h_min, n_h_max, n_rate_min)
+
+    search(0, 0, None, None, None, None, None)
+
+    modes = [None] * len(screens)
+    for level, i in enumerate(levels):
+        modes[i] = best[1][level]
+    return Solution(screens, modes, arrange(screens, modes, first), best[0], visited[0])
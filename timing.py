@@ -0,0 +1,186 @@
+"""Wall clock and CPU time of the phases of a run
+
+Phases are recorded by whatever Timings is active, timing.phase() is a no-op
+otherwise:
+
+    timings = timing.Timings()
+    with timings:
+        with timing.phase('probe'):
+            ...
+    print(timings.to_json())
+
+Nested phases are named after their parents, e.g. probe/edid. Each thread
+and asyncio task has its own active Timings.
+"""
+import contextvars
+import time
+
+# Bump when the fields of the JSON record change
+FORMAT_VERSION = 2
+
+_active = contextvars.ContextVar('timings', default=None)
+
+class Phase(object):
+    """Totals of a phase, over all of its calls"""
+    __slots__ = ('name', 'calls', 'wall', 'cpu')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def as_dict(self):
+        return {'name': self.name, 'calls': self.calls, 'wall': self.wall, 'cpu': self.cpu}
+
+class _Running(object):
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        stack = self.timings._stack
+        self.path = stack[-1] + '/' + self.name if stack else self.name
+        stack.append(self.path)
+        self.timings.started(self.path)
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        self.timings._stack.pop()
+        self.timings.add(self.path, wall, cpu)
+        return False
+
+class _Idle(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_idle = _Idle()
+
+class Timings(object):
+    """Phases and subprocesses of one run, active inside a with block
+
+    :display: the X display of the run, None for $DISPLAY
+    """
+    def __init__(self, display=None):
+        super(Timings, self).__init__()
+        self.display = display
+        self.phases = {}
+        self.subprocesses = []
+        self._stack = []
+        self._previous = None
+        self._wall = None
+        self._cpu = None
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def __enter__(self):
+        self._previous = active()
+        _active.set(self)
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall += time.perf_counter() - self._wall
+        self.cpu += time.process_time() - self._cpu
+        _active.set(self._previous)
+        return False
+
+    def phase(self, name):
+        return _Running(self, name)
+
+    def started(self, name):
+        # phases are listed in the order they first started
+        if name not in self.phases:
+            self.phases[name] = Phase(name)
+
+    def add(self, name, wall, cpu):
+        self.started(name)
+        p = self.phases[name]
+        p.calls += 1
+        p.wall += wall
+        p.cpu += cpu
+
+    def add_subprocess(self, cmd, wall, exit_latency, returncode):
+        """A finished subprocess
+
+        :wall: from start to exit
+        :exit_latency: from the end of its output to its exit
+        """
+        self.subprocesses.append({
+            'cmd': " ".join(cmd[:2]),
+            'phase': self._stack[-1] if self._stack else None,
+            'wall': wall,
+            'exit_latency': exit_latency,
+            'returncode': returncode})
+
+    def as_dict(self):
+        return {
+            'version': FORMAT_VERSION,
+            'time': time.time(),
+            'display': self.display,
+            'wall': self.wall,
+            'cpu': self.cpu,
+            'phases': [p.as_dict() for p in self.phases.values()],
+            'subprocesses': self.subprocesses,
+        }
+
+    def to_json(self):
+        import json
+        return json.dumps(self.as_dict(), sort_keys=True)
+
+    def write(self, path):
+        """Append the record as one JSON line to path, '-' for stderr"""
+        if path == '-':
+            import sys
+            sys.stderr.write(self.to_json() + '\n')
+            sys.stderr.flush()
+            return
+        with open(path, 'a') as f:
+            f.write(self.to_json() + '\n')
+
+def active():
+    """The Timings being recorded by this thread or task, or None"""
+    return _active.get()
+
+def recording(timings):
+    """Context manager activating timings, a no-op when it is None"""
+    return _idle if timings is None else timings
+
+def phase(name):
+    """Context manager timing a phase of the active Timings"""
+    timings = _active.get()
+    if timings is None:
+        return _idle
+    return timings.phase(name)
+
+def profiled(fn, path):
+    """Wrap fn so that its first call is profiled with cProfile
+
+    The stats are written to path, or printed on stderr when path is '-'.
+    """
+    done = []
+
+    def wrapper(*args, **kwargs):
+        if done:
+            return fn(*args, **kwargs)
+        done.append(True)
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(fn, *args, **kwargs)
+        finally:
+            if path == '-':
+                import pstats
+                import sys
+                pstats.Stats(profile, stream=sys.stderr).sort_stats('cumulative').print_stats(30)
+            else:
+                profile.dump_stats(path)
+    return wrapper
@@ -0,0 +1,186 @@
+"""Apply a layout in two phases that fit the CRTCs, verified and rolled back
+
+One xrandr command that turns outputs off and others on at once fails with
+"cannot find crtc" when the new outputs need the CRTCs of the old ones. A
+Transaction first turns off the outputs going away, then sets up the rest,
+new outputs on the CRTCs left free. It polls xrandr --current, with
+backoff, until the layout is the requested one, and restores the probed
+layout when a step fails or the layout does not settle.
+"""
+import subprocess as sb
+import time
+
+import randr
+import timing
+
+# Backoff of the polls of xrandr --current, in seconds
+POLL_START = 0.02
+POLL_MAX = 0.5
+
+# Seconds the layout may take to settle before it is rolled back
+SETTLE_TIMEOUT = 5.0
+
+def assign_crtcs(screens, crtcs):
+    """CRTCs of the outputs screens enables
+
+    :crtcs: from randr.parse_crtcs()
+
+    Outputs that stay on keep their CRTC, outputs missing from crtcs are
+    left out. Returns a dict of output name to CRTC, raises ValueError when
+    the outputs do not fit the CRTCs.
+    """
+    enabled = [s for s in screens if s.set.is_enabled and s.name in crtcs]
+    assigned = {}
+    used = {}
+    for s in enabled:
+        crtc = crtcs.get(s.name, (None, ()))[0]
+        if crtc is not None and s.is_enabled():
+            assigned[s.name] = crtc
+            used[crtc] = s.name
+
+    def place(name, seen):
+        # augmenting path: take a free CRTC, else move the output holding one
+        options = crtcs.get(name, (None, ()))[1]
+        for crtc in sorted(options, key=lambda c: c in used):
+            if crtc in seen:
+                continue
+            seen.add(crtc)
+            holder = used.get(crtc)
+            if holder is None or (holder not in fixed and place(holder, seen)):
+                used[crtc] = name
+                assigned[name] = crtc
+                return True
+        return False
+
+    fixed = set(assigned)
+    for s in enabled:
+        if s.name not in assigned and not place(s.name, set()):
+            raise ValueError('Not enough CRTCs for outputs', [s.name for s in enabled])
+    return assigned
+
+def restore_cmd(s):
+    """xrandr arguments restoring the probed state of s"""
+    if s.curr_mode is None:
+        return ['--output', s.name, '--off']
+    cmd = ['--output', s.name, '--mode', '{0}x{1}'.format(s.curr_mode.width, s.curr_mode.height),
+           '--rate', str(s.curr_mode.freq),
+           '--pos', "x".join(str(x) for x in (s.curr_position or (0, 0))),
+           '--scale', "x".join(str(x) for x in (s.curr_scale or [1, 1]))]
+    if s.rotation is not None:
+        cmd.extend(['--rotate', randr.rot_to_str(s.rotation)])
+    if s.primary:
+        cmd.append('--primary')
+    return cmd
+
+def _steps(off, on):
+    steps = []
+    if off:
+        steps.append(('disable', ['xrandr'] + off))
+    if on:
+        steps.append(('enable', ['xrandr'] + on))
+    return steps
+
+class Transaction(object):
+    """The two phase apply of the settings of screens
+
+    :crtcs: from randr.parse_crtcs()
+    :run: runs an xrandr command
+    :query: returns the lines of xrandr --current
+    """
+    def __init__(self, screens, crtcs, run, query, force=False, settle_timeout=SETTLE_TIMEOUT):
+        super(Transaction, self).__init__()
+        self.screens = screens
+        self.crtcs = crtcs
+        self.run = run
+        self.query = query
+        self.force = force
+        self.settle_timeout = settle_timeout
+        self.polls = 0
+        # seconds from the first step to the settled layout
+        self.stable = None
+
+    def steps(self):
+        """(phase, command) of the outputs turned off, then of the ones
+        set up, new outputs on the CRTCs left free"""
+        changed = [s for s in self.screens if s.build_cmd(self.force)]
+        assigned = assign_crtcs(self.screens, self.crtcs)
+        # CRTCs are only picked for new outputs when those of the others are known
+        pick = all(self.crtcs.get(s.name, (None, ()))[0] is not None
+                   for s in self.screens if s.is_enabled() and s.set.is_enabled)
+        off = []
+        on = []
+        for s in changed:
+            if not s.set.is_enabled:
+                off += s.build_cmd(self.force)
+                continue
+            cmd = s.build_cmd(self.force)
+            if pick and not s.is_enabled() and s.name in assigned:
+                cmd += ['--crtc', str(assigned[s.name])]
+            on += cmd
+        return _steps(off, on)
+
+    def rollback_steps(self):
+        """(phase, command) restoring the probed layout, in two phases too"""
+        changed = [s for s in self.screens if s.build_cmd(self.force)]
+        off = []
+        on = []
+        for s in changed:
+            if s.curr_mode is None:
+                off += restore_cmd(s)
+            else:
+                on += restore_cmd(s)
+        return _steps(off, on)
+
+    def settle(self, expected):
+        """Poll until xrandr --current shows expected, returns the names of
+        the outputs that still differ when settle_timeout runs out"""
+        deadline = time.perf_counter() + self.settle_timeout
+        delay = POLL_START
+        while True:
+            self.polls += 1
+            differ = randr.mismatched(expected, self.query())
+            if not differ or time.perf_counter() + delay > deadline:
+                return differ
+            time.sleep(delay)
+            delay = min(2 * delay, POLL_MAX)
+
+    def apply(self, steps=None):
+        """Run steps (self.steps() by default) and wait for the layout to
+        settle
+
+        Restores the probed layout and raises when a step fails or the
+        layout does not settle: the error of the step, or RuntimeError.
+        """
+        if steps is None:
+            steps = self.steps()
+        start = time.perf_counter()
+        try:
+            for name, cmd in steps:
+                with timing.phase(name):
+                    self.run(cmd)
+            with timing.phase('settle'):
+                differ = self.settle(randr.requested(self.screens))
+            if differ:
+                raise RuntimeError('Layout did not settle', differ)
+        except (sb.CalledProcessError, sb.TimeoutExpired, RuntimeError):
+            self.rollback()
+            raise
+        self.stable = time.perf_counter() - start
+        return steps
+
+    def rollback(self):
+        """Restore the probed layout, best effort"""
+        print("Rolling back")
+        with timing.phase('rollback'):
+            for name, cmd in self.rollback_steps():
+                print(" ".join(cmd))
+                try:
+                    self.run(cmd)
+                except (sb.CalledProcessError, sb.TimeoutExpired) as e:
+                    print("Rollback failed:", repr(e))
+                    return
+            expected = [(s.name, s.curr_mode.resolution() if s.curr_mode is not None else None,
+                         s.curr_position or (0, 0)) for s in self.screens]
+            differ = self.settle(expected)
+            if differ:
+                print("Not restored:", ", ".join(differ))
@@ -0,0 +1,249 @@
+"""RandR backend talking the X protocol with python-xlib
+
+Reads outputs, CRTCs, modes and EDIDs as binary replies and applies a
+layout with explicit mode ids, without running xrandr.
+"""
+from collections import namedtuple
+
+import randr
+
+# randr.RotateDirection to RandR rotation bits
+ROTATIONS = {
+    randr.RotateDirection.Normal: 1,
+    randr.RotateDirection.Left: 2,
+    randr.RotateDirection.Inverted: 4,
+    randr.RotateDirection.Right: 8,
+}
+
+# Mode flags
+_INTERLACE = 0x10
+_DOUBLE_SCAN = 0x20
+
+# Physical size reported for the screen
+SCREEN_DPI = 96.0
+
+# What apply needs to know about a probed output
+OutputState = namedtuple("OutputState", "id crtc crtcs mode_ids")
+
+# One SetCrtcConfig request, mode 0 disables the CRTC
+CrtcConfig = namedtuple("CrtcConfig", "output crtc x y mode rotation")
+
+def mode_rate(info):
+    """Refresh rate of a RandR mode info, as xrandr computes it"""
+    v_total = info.v_total
+    if info.flags & _DOUBLE_SCAN:
+        v_total *= 2
+    if info.flags & _INTERLACE:
+        v_total /= 2
+    if not info.h_total or not v_total:
+        return 0.0
+    return info.dot_clock / float(info.h_total * v_total)
+
+def header_line(name, connected, primary, crtc):
+    """The output line xrandr would print, for randr.make_screen"""
+    line = name + (" connected" if connected else " disconnected")
+    if primary:
+        line += " primary"
+    if crtc is not None and crtc.mode:
+        rotation = [k for k, v in ROTATIONS.items() if crtc.rotation & v]
+        line += " {}x{}+{}+{} {}".format(crtc.width, crtc.height, crtc.x, crtc.y,
+                                         randr.rot_to_str(rotation[0] if rotation else randr.RotateDirection.Normal))
+    return line + " (normal left inverted right x axis y axis)"
+
+def _rotation(direction):
+    return ROTATIONS.get(direction or randr.RotateDirection.Normal, 1)
+
+def _bounds(geometries):
+    """Size of the screen holding (position, (width, height), rotation)s"""
+    width = height = 0
+    for position, (w, h), direction in geometries:
+        if direction in (randr.RotateDirection.Left, randr.RotateDirection.Right):
+            w, h = h, w
+        width = max(width, position[0] + w)
+        height = max(height, position[1] + h)
+    return width, height
+
+def _text(value):
+    return value.decode('utf-8', 'replace') if isinstance(value, bytes) else value
+
+class XlibBackend(randr.Backend):
+    """Probes and applies screens over a connection to the X server
+
+    :display: X display name, $DISPLAY by default
+    """
+    def __init__(self, display=None):
+        super(XlibBackend, self).__init__()
+        self.display_name = display
+        self._display = None
+        self.outputs = {}
+        self.config_timestamp = None
+
+    def display(self):
+        if self._display is None:
+            from Xlib import display
+            d = display.Display(self.display_name)
+            if not d.has_extension('RANDR'):
+                d.close()
+                raise RuntimeError('X server has no RandR extension')
+            self._display = d
+        return self._display
+
+    def close(self):
+        if self._display is not None:
+            self._display.close()
+            self._display = None
+
+    def screens(self):
+        from Xlib import Xatom
+        from Xlib.ext import randr as xrandr
+
+        d = self.display()
+        root = d.screen().root
+        resources = root.xrandr_get_screen_resources()
+        timestamp = resources.config_timestamp
+        mode_infos = dict((m.id, m) for m in resources.modes)
+        primary = root.xrandr_get_output_primary().output
+        edid_atom = d.intern_atom('EDID')
+
+        self.outputs = {}
+        self.config_timestamp = timestamp
+        result = []
+        for output in resources.outputs:
+            info = d.xrandr_get_output_info(output, timestamp)
+            name = _text(info.name)
+            connected = info.connection == xrandr.Connected
+            crtc = d.xrandr_get_crtc_info(info.crtc, timestamp) if info.crtc else None
+
+            modes = []
+            current = None
+            for i, mode_id in enumerate(info.modes):
+                m = mode_infos[mode_id]
+                if crtc is not None and crtc.mode == mode_id:
+                    current = i
+                modes.append((m.width, m.height, round(mode_rate(m), 2), i < info.num_preferred))
+
+            edid = None
+            if connected:
+                # 32 bit units, enough for the base block and three extensions
+                prop = d.xrandr_get_output_property(output, edid_atom, Xatom.INTEGER, 0, 128)
+                value = bytes(bytearray(prop.value)) if prop.value else b''
+                if len(value) >= 128:
+                    edid = value
+
+            scale = None
+            if crtc is not None and crtc.mode:
+                scale = self._scale(info.crtc)
+
+            self.outputs[name] = OutputState(output, info.crtc, list(info.crtcs), list(info.modes))
+            result.append(randr.make_screen(header_line(name, connected, output == primary, crtc),
+                                            modes, edid, connected, scale, current))
+        return result
+
+    def _scale(self, crtc):
+        try:
+            transform = self.display().xrandr_get_crtc_transform(crtc).current_transform
+        except Exception:
+            return None
+        # 16.16 fixed point
+        return [transform.matrix11 / 65536.0, transform.matrix22 / 65536.0]
+
+    def mode_id(self, screen):
+        """Id of the mode matching the settings of screen"""
+        state = self.outputs[screen.name]
+        width, height = screen.set.resolution
+        for mode, mode_id in zip(screen.modes(), state.mode_ids):
+            if (mode.width, mode.height) != (width, height):
+                continue
+            if screen.set.freq and abs(mode.freq - screen.set.freq) > randr.RATE_EPS:
+                continue
+            return mode_id
+        raise ValueError('Requested mode is not supported', screen.name, screen.set.resolution, screen.set.freq)
+
+    def plan(self, screens, force=False):
+        """The CRTC configurations applying screens
+
+        Returns (disable, enable, size), the CRTCs to turn off before the
+        screen is resized to size, and the CRTCs to set up afterwards.
+        """
+        used = {}
+        for s in screens:
+            state = self.outputs.get(s.name)
+            if state is None:
+                raise ValueError('Output was not probed by this backend', s.name)
+            if list(s.scale) != [1, 1]:
+                raise ValueError('Scaling needs the xrandr backend', s.name, s.scale)
+            if s.set.is_enabled and state.crtc and not (force or s.has_changed()):
+                used[state.crtc] = s.name
+
+        enable = []
+        for s in screens:
+            state = self.outputs[s.name]
+            if not s.set.is_enabled or not (force or s.has_changed()):
+                continue
+            free = [c for c in ([state.crtc] if state.crtc else []) + state.crtcs if c not in used]
+            if not free:
+                raise ValueError('No free CRTC for output', s.name)
+            used[free[0]] = s.name
+            enable.append(CrtcConfig(s.name, free[0], s.set.position[0], s.set.position[1], self.mode_id(s), _rotation(s.set.rotation or s.rotation)))
+
+        size = _bounds((s.set.position, s.set.resolution, s.set.rotation or s.rotation) for s in screens if s.set.is_enabled)
+
+        # CRTCs losing their output, or not fitting the new screen size until
+        # they are set up again
+        disable = []
+        for s in screens:
+            state = self.outputs[s.name]
+            if not state.crtc or not (force or s.has_changed()):
+                continue
+            if used.get(state.crtc) == s.name and s.curr_mode is not None and s.curr_position is not None:
+                current = _bounds([(s.curr_position, s.curr_mode.resolution(), s.rotation)])
+                if current[0] <= size[0] and current[1] <= size[1]:
+                    continue
+            disable.append(CrtcConfig(s.name, state.crtc, 0, 0, 0, _rotation(None)))
+        return disable, enable, size
+
+    def apply(self, screens, dryrun, force=False):
+        """Apply the settings of screens that changed, in one server grab
+
+        Returns the (disable, enable, size) plan, or None when there was
+        nothing to do
+        """
+        for s in screens:
+            if s.set.resolution:
+                s.check_resolution(s.set.resolution)
+        disable, enable, size = self.plan(screens, force)
+        if not disable and not enable:
+            print("No changes, not reconfiguring")
+            return None
+        for c in disable:
+            print("crtc 0x{:x} off ({})".format(c.crtc, c.output))
+        print("screen {}x{}".format(*size))
+        for c in enable:
+            print("crtc 0x{:x} mode 0x{:x} at {}x{} rotation {} ({})".format(c.crtc, c.mode, c.x, c.y, c.rotation, c.output))
+        if dryrun:
+            return disable, enable, size
+
+        d = self.display()
+        root = d.screen().root
+        d.grab_server()
+        try:
+            for c in disable:
+                self._set_crtc(c, [])
+            if size[0] and size[1]:
+                root.xrandr_set_screen_size(size[0], size[1],
+                                            int(size[0] * 25.4 / SCREEN_DPI), int(size[1] * 25.4 / SCREEN_DPI))
+            for c in enable:
+                self._set_crtc(c, [self.outputs[c.output].id])
+            for s in screens:
+                if s.set.is_enabled and s.set.is_primary and not s.primary:
+                    root.xrandr_set_output_primary(self.outputs[s.name].id)
+        finally:
+            d.ungrab_server()
+            d.sync()
+        return disable, enable, size
+
+    def _set_crtc(self, c, outputs):
+        from Xlib.ext import randr as xrandr
+        reply = self.display().xrandr_set_crtc_config(c.crtc, self.config_timestamp, c.x, c.y, c.mode, c.rotation, outputs)
+        if reply.status != xrandr.SetConfigSuccess:
+            raise RuntimeError('SetCrtcConfig failed', c.output, reply.status)